@@ -0,0 +1,114 @@
+"""
+Micro-benchmarks for the request-path code.
+
+These are not tests - they are run manually, using the test settings:
+
+    $ python -m benchmarks                    # run everything
+    $ python -m benchmarks session            # run a single module
+    $ python -m benchmarks --save base.json   # save the results ...
+    $ python -m benchmarks --compare base.json  # ... and compare later runs
+
+Each benchmark reports the best per-call time over five runs, which is
+the least noisy measure on a shared machine. Results are only comparable
+between runs on the same machine, Python and Django versions - these are
+saved with the results, and a warning is printed if they differ.
+
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import platform
+import timeit
+from typing import Any, Callable
+
+# label -> best per-call time (µs), for all benchmarks run in this process
+RESULTS: dict[str, float] = {}
+
+# a change of more than this (as a fraction) is reported as a regression
+THRESHOLD = 0.10
+
+_database_created = False
+
+
+def setup_django(database: bool = False) -> None:
+    """
+    Configure Django using the test settings.
+
+    If database is True then a (temporary, in-memory) test database is
+    created and migrated.
+
+    """
+    global _database_created
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tests.settings")
+    import django
+
+    django.setup()
+
+    from django.test.utils import setup_test_environment
+
+    # the test settings log everything (including SQL) at DEBUG level
+    logging.disable(logging.CRITICAL)
+    try:
+        setup_test_environment(debug=False)
+    except RuntimeError:
+        # already set up by another benchmark module
+        pass
+    if database and not _database_created:
+        from django.db import connection
+
+        connection.creation.create_test_db(verbosity=0)
+        _database_created = True
+
+
+def bench(label: str, func: Callable[[], object], number: int = 10_000) -> float:
+    """Print, record and return the best per-call time (in µs) over five runs."""
+    best = min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+    RESULTS[label] = best
+    print(f"{label:<50} {best:>8.2f} µs")  # noqa: T201
+    return best
+
+
+def get_environment() -> dict[str, str]:
+    import django
+
+    return {
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "machine": platform.machine(),
+        "node": platform.node(),
+    }
+
+
+def save_results(path: str) -> None:
+    with open(path, "w") as f:
+        json.dump({"environment": get_environment(), "results": RESULTS}, f, indent=2)
+
+
+def compare_results(path: str, threshold: float = THRESHOLD) -> list[str]:
+    """
+    Print a comparison of the results with those saved in path.
+
+    Returns the labels of the benchmarks that are slower by more than the
+    threshold.
+
+    """
+    with open(path) as f:
+        saved: dict[str, Any] = json.load(f)
+    if saved["environment"] != (environment := get_environment()):
+        print(f"WARNING: environment differs: {saved['environment']} != {environment}")  # noqa: T201, E501
+    regressions = []
+    print(f"\n{'':<50} {'before':>8} {'after':>8} {'change':>8}")  # noqa: T201
+    for label, after in RESULTS.items():
+        if (before := saved["results"].get(label)) is None:
+            continue
+        change = (after - before) / before
+        flag = ""
+        if change > threshold:
+            flag = " REGRESSION"
+            regressions.append(label)
+        print(f"{label:<50} {before:>8.2f} {after:>8.2f} {change:>+8.1%}{flag}")  # noqa: T201, E501
+    return regressions
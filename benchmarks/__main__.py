@@ -0,0 +1,30 @@
+"""Run all (or some) of the benchmarks, and save or compare the results."""
+
+import argparse
+import importlib
+import sys
+
+from . import compare_results, save_results
+
+MODULES = ["request", "session", "middleware", "client"]
+
+parser = argparse.ArgumentParser(prog="python -m benchmarks")
+parser.add_argument(
+    "modules", nargs="*", help=f"Any of {', '.join(MODULES)} (default: all)."
+)
+parser.add_argument("--save", metavar="PATH", help="Save the results as JSON.")
+parser.add_argument(
+    "--compare", metavar="PATH", help="Compare the results with saved results."
+)
+args = parser.parse_args()
+if unknown := set(args.modules) - set(MODULES):
+    parser.error(f"unknown modules: {', '.join(sorted(unknown))}")
+
+for name in args.modules or MODULES:
+    print(f"\n== {name} ==")  # noqa: T201
+    importlib.import_module(f"benchmarks.{name}").run()
+
+if args.save:
+    save_results(args.save)
+if args.compare and compare_results(args.compare):
+    sys.exit(1)
@@ -0,0 +1,67 @@
+"""
+Measure both middleware classes end-to-end, through the test client.
+
+Each scenario is run with and without the utm_tracker middleware, and
+the difference is reported as the overhead. This includes the session
+save (and LeadSource INSERT for authenticated users), using the
+in-memory SQLite test database.
+
+"""
+
+import itertools
+from typing import Any, Callable
+
+from . import bench, setup_django
+
+setup_django(database=True)
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+
+# unique values, so that params are not ignored as duplicates
+counter = itertools.count()
+
+WITHOUT_MIDDLEWARE = [m for m in settings.MIDDLEWARE if "utm_tracker" not in m]
+
+SCENARIOS = {
+    "anonymous, untagged": (False, lambda: {"page": "2"}),
+    "anonymous, tagged": (
+        False,
+        lambda: {"utm_source": "google", "utm_medium": "cpc", "mytag": next(counter)},
+    ),
+    "authenticated, untagged": (True, lambda: {"page": "2"}),
+    "authenticated, tagged": (
+        True,
+        lambda: {"utm_source": "google", "utm_medium": "cpc", "mytag": next(counter)},
+    ),
+}
+
+
+def get_call(user: Any, get_params: Callable[[], dict]) -> Callable[[], None]:
+    # the client builds its middleware chain on the first request, so a
+    # new client is required for each MIDDLEWARE setting.
+    client = Client()
+    if user:
+        client.force_login(user)
+
+    def call() -> None:
+        client.get("/200/", get_params())
+
+    return call
+
+
+def run() -> None:
+    user = get_user_model().objects.create(username="client")
+    for label, (authenticated, get_params) in SCENARIOS.items():
+        login = user if authenticated else None
+        with override_settings(MIDDLEWARE=WITHOUT_MIDDLEWARE):
+            call = get_call(login, get_params)
+            base = bench(f"client: {label} (without middleware)", call, number=200)
+        call = get_call(login, get_params)
+        total = bench(f"client: {label} (with middleware)", call, number=200)
+        print(f"{label:<50} {total - base:>8.2f} µs overhead\n")  # noqa: T201
+
+
+if __name__ == "__main__":
+    run()
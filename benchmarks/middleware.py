@@ -0,0 +1,57 @@
+"""
+Measure the per-request overhead of UtmSessionMiddleware.
+
+The overhead is the time spent in the middleware over and above calling
+the (no-op) view directly. Untagged requests should be close to zero as
+they never parse the querystring or touch the session.
+
+"""
+
+from . import bench, setup_django
+
+setup_django()
+
+from django.contrib.sessions.backends.db import SessionStore  # noqa: E402
+from django.http import HttpResponse  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+
+from utm_tracker.middleware import UtmSessionMiddleware  # noqa: E402
+
+RESPONSE = HttpResponse()
+QUERY_STRINGS = {
+    "no querystring": "",
+    "untagged querystring": "page=2&sort=-created_at&q=django",
+    "tagged querystring": "utm_source=google&utm_medium=cpc&utm_campaign=spring",
+}
+
+
+def get_response(request: object) -> HttpResponse:
+    return RESPONSE
+
+
+def run() -> None:
+    factory = RequestFactory()
+    middleware = UtmSessionMiddleware(get_response)
+
+    for label, query_string in QUERY_STRINGS.items():
+
+        def call() -> None:
+            request = factory.get("/", QUERY_STRING=query_string)
+            # an unsaved db session - loading it would hit the database
+            request.session = SessionStore()
+            request.session._session_cache = {}
+            middleware(request)
+
+        def baseline() -> None:
+            request = factory.get("/", QUERY_STRING=query_string)
+            request.session = SessionStore()
+            request.session._session_cache = {}
+            get_response(request)
+
+        base = bench(f"{label} (view only)", baseline)
+        total = bench(f"{label} (with middleware)", call)
+        print(f"{label:<50} {total - base:>8.2f} µs overhead\n")  # noqa: T201
+
+
+if __name__ == "__main__":
+    run()
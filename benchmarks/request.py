@@ -0,0 +1,70 @@
+"""
+Measure the cost of parsing the tracked params from the querystring.
+
+request.GET is built once, so that only the cost of extracting the params
+is measured (building the QueryDict is the same for any implementation).
+The original three-pass implementation of parse_qs is included, for
+comparison with the current single-pass, table-driven one.
+
+"""
+
+from . import bench, setup_django
+
+setup_django()
+
+from django.http import HttpRequest, QueryDict  # noqa: E402
+
+from utm_tracker.request import (  # noqa: E402
+    VALID_AD_PARAMS,
+    VALID_UTM_PARAMS,
+    has_tracked_params,
+    parse_qs,
+)
+from utm_tracker.settings import get_config  # noqa: E402
+
+TAGGED = "utm_source=google&utm_medium=cpc&utm_campaign=spring&gclid=1C5CHFA&mytag=x"
+
+
+def parse_qs_three_pass(request: HttpRequest) -> dict[str, str]:
+    """Return the params using the original three-pass parse_qs."""
+    utm_keys = {
+        str(k).lower(): str(v).lower()
+        for k, v in request.GET.items()
+        if k in VALID_UTM_PARAMS and v != ""
+    }
+    for ad_key in VALID_AD_PARAMS:
+        if akey := request.GET.get(ad_key):
+            utm_keys[ad_key] = akey
+    for tag in get_config().custom_tags:
+        if val := request.GET.getlist(tag):
+            utm_keys[tag] = ",".join(val)
+    return utm_keys
+
+
+def build_query_string(untagged: int, tagged: bool = True) -> str:
+    """Return a querystring with the number of untagged params (+ tags)."""
+    params = [f"param{i}=value{i}" for i in range(untagged)]
+    if tagged:
+        params.append(TAGGED)
+    return "&".join(params)
+
+
+def run() -> None:
+    request = HttpRequest()
+    for untagged in (0, 10, 100):
+        for tagged in (True, False):
+            query_string = build_query_string(untagged, tagged)
+            request.META["QUERY_STRING"] = query_string
+            request.GET = QueryDict(query_string)
+            label = f"{untagged} untagged params{' + tags' if tagged else ''}"
+            if parse_qs(request) != parse_qs_three_pass(request):
+                raise ValueError(f"parse_qs mismatch: {query_string}")
+            bench(
+                f"parse_qs (three-pass): {label}", lambda: parse_qs_three_pass(request)
+            )
+            bench(f"parse_qs: {label}", lambda: parse_qs(request))
+            bench(f"has_tracked_params: {label}", lambda: has_tracked_params(request))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,81 @@
+"""
+Measure the cost of stashing params in, and dumping them from, the session.
+
+stash_utm_params is measured with different numbers of params already
+stashed (up to, and beyond, the default limit of 20, which triggers
+eviction). dump_utm_params is measured with different numbers of params
+to save, and so includes the database INSERT (into an in-memory SQLite
+test database).
+
+"""
+
+import itertools
+
+from . import bench, setup_django
+
+setup_django(database=True)
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.contrib.sessions.backends.db import SessionStore  # noqa: E402
+
+from utm_tracker.session import (  # noqa: E402
+    SESSION_KEY_UTM_FINGERPRINTS,
+    SESSION_KEY_UTM_PARAMS,
+    append_utm_params,
+    dump_utm_params,
+    stash_utm_params,
+)
+
+PARAMS = {"utm_source": "google", "utm_medium": "cpc", "utm_campaign": "spring"}
+
+# unique values, so that dumped params are not ignored as duplicates
+counter = itertools.count()
+
+
+def build_stash(length: int) -> tuple[list, list]:
+    """Return the (stashed, fingerprints) lists, for a number of params."""
+    stashed: list = []
+    fingerprints: list = []
+    for i in range(length):
+        append_utm_params(stashed, fingerprints, {**PARAMS, "mytag": f"{i}"})
+    return stashed, fingerprints
+
+
+def build_session(stashed: list, fingerprints: list) -> SessionStore:
+    # an unsaved db session - loading it would hit the database
+    session = SessionStore()
+    session._session_cache = {
+        SESSION_KEY_UTM_PARAMS: list(stashed),
+        SESSION_KEY_UTM_FINGERPRINTS: list(fingerprints),
+    }
+    return session
+
+
+def run() -> None:
+    for length in (0, 5, 19, 20):
+        stashed, fingerprints = build_stash(length)
+
+        def stash() -> None:
+            session = build_session(stashed, fingerprints)
+            stash_utm_params(session, dict(PARAMS))
+
+        bench(f"stash_utm_params: {length} stashed", stash)
+
+    user = get_user_model().objects.create(username="bench")
+    for length in (1, 5, 20):
+
+        def dump() -> None:
+            session = build_session([], [])
+            for _ in range(length):
+                append_utm_params(
+                    session[SESSION_KEY_UTM_PARAMS],
+                    session[SESSION_KEY_UTM_FINGERPRINTS],
+                    {**PARAMS, "mytag": str(next(counter))},
+                )
+            dump_utm_params(user, session)
+
+        bench(f"dump_utm_params: {length} stashed", dump, number=200)
+
+
+if __name__ == "__main__":
+    run()
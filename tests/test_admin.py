@@ -0,0 +1,160 @@
+import datetime
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from utm_tracker.admin import EstimatedCountPaginator
+from utm_tracker.models import LeadSource, LeadSourceDailyStat, UtmDimension
+
+User = get_user_model()
+
+
+class LeadSourceAdminTests(TestCase):
+    def setUp(self):
+        admin_user = User.objects.create_superuser(username="admin")
+        self.client.force_login(admin_user)
+        self.url = reverse("admin:utm_tracker_leadsource_changelist")
+
+    def create_lead_sources(self, count):
+        for i in range(count):
+            user = User.objects.create(username=f"user{LeadSource.objects.count()}")
+            LeadSource.objects.create_from_utm_params(
+                user, {"utm_medium": f"medium{i % 2}", "utm_source": "google"}
+            )
+
+    def count_queries(self, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url, params)
+        assert response.status_code == 200
+        return len(context.captured_queries)
+
+    def test_changelist__constant_queries(self):
+        self.create_lead_sources(5)
+        num_queries = self.count_queries()
+        self.create_lead_sources(20)
+        assert self.count_queries() == num_queries
+        # filtered changelist
+        num_queries = self.count_queries(medium="medium1")
+        self.create_lead_sources(10)
+        assert self.count_queries(medium="medium1") == num_queries
+
+    @override_settings(UTM_TRACKER_NORMALIZE_DIMENSIONS=True)
+    def test_changelist__constant_queries__normalized(self):
+        self.create_lead_sources(5)
+        UtmDimension.objects.clear_cache()
+        num_queries = self.count_queries()
+        self.create_lead_sources(20)
+        # the values are not read one at a time, even if they are not cached
+        UtmDimension.objects.clear_cache()
+        assert self.count_queries() == num_queries
+        UtmDimension.objects.clear_cache()
+        num_queries = self.count_queries(medium="medium1")
+        self.create_lead_sources(10)
+        UtmDimension.objects.clear_cache()
+        assert self.count_queries(medium="medium1") == num_queries
+
+    def test_search(self):
+        self.create_lead_sources(4)
+        LeadSource.objects.create_from_utm_params(
+            User.objects.create(username="fred"),
+            {"utm_medium": "email", "utm_source": "newsletter"},
+        )
+        response = self.client.get(self.url, {"q": "News"})
+        assert response.context["cl"].result_count == 1
+        response = self.client.get(self.url, {"q": "medium"})
+        assert response.context["cl"].result_count == 4
+        response = self.client.get(self.url, {"q": "fred"})
+        assert response.context["cl"].result_count == 1
+        # substring matches are not supported
+        response = self.client.get(self.url, {"q": "letter"})
+        assert response.context["cl"].result_count == 0
+
+    def test_search__username_field(self):
+        """Check that the user model's USERNAME_FIELD is searched."""
+        LeadSource.objects.create_from_utm_params(
+            User.objects.create(username="fred", email="fred@example.com"),
+            {"utm_medium": "email", "utm_source": "newsletter"},
+        )
+        with mock.patch.object(User, "USERNAME_FIELD", "email"):
+            response = self.client.get(self.url, {"q": "fred@example.com"})
+            assert response.context["cl"].result_count == 1
+            response = self.client.get(self.url, {"q": "fred"})
+            assert response.context["cl"].result_count == 0
+
+    def test_list_filter(self):
+        """Check that filter choices are read from the stats, not LeadSource."""
+        self.create_lead_sources(2)
+        LeadSourceDailyStat.objects.create(
+            date=datetime.date(2023, 2, 17), source="google", medium="medium0"
+        )
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url)
+        assert not any(
+            "DISTINCT" in q["sql"] and '"utm_tracker_leadsource"' in q["sql"]
+            for q in context.captured_queries
+        )
+        medium_filter = response.context["cl"].filter_specs[0]
+        assert medium_filter.lookup_choices == [("medium0", "medium0")]
+        response = self.client.get(self.url, {"medium": "medium1"})
+        assert response.context["cl"].result_count == 1
+
+    @override_settings(UTM_TRACKER_NORMALIZE_DIMENSIONS=True)
+    def test_list_filter__normalized(self):
+        self.create_lead_sources(4)
+        response = self.client.get(self.url, {"medium": "medium1", "source": "google"})
+        assert response.context["cl"].result_count == 2
+
+    @override_settings(UTM_TRACKER_NORMALIZE_DIMENSIONS=True)
+    def test_search__normalized(self):
+        self.create_lead_sources(4)
+        response = self.client.get(self.url, {"q": "goo"})
+        assert response.context["cl"].result_count == 4
+        response = self.client.get(self.url, {"q": "medium1"})
+        assert response.context["cl"].result_count == 2
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username="fred")
+        for i in range(3):
+            LeadSource.objects.create_from_utm_params(
+                user, {"utm_medium": f"medium{i}", "utm_source": "google"}
+            )
+
+    def test_count(self):
+        paginator = EstimatedCountPaginator(LeadSource.objects.order_by("id"), 2)
+        assert paginator.count == 3
+        assert paginator.estimated_count() is None
+
+    @mock.patch.object(connection, "vendor", "postgresql")
+    def test_count__estimated(self):
+        queryset = LeadSource.objects.order_by("id")
+        paginator = EstimatedCountPaginator(queryset, 2)
+        with mock.patch.object(connection, "cursor") as mock_cursor:
+            cursor = mock_cursor.return_value.__enter__.return_value
+            cursor.fetchone.return_value = (250_000.0,)
+            assert paginator.count == 250_000
+        cursor.execute.assert_called_once_with(
+            "SELECT reltuples FROM pg_class WHERE relname = %s",
+            ["utm_tracker_leadsource"],
+        )
+
+    @mock.patch.object(connection, "vendor", "postgresql")
+    def test_count__estimate_below_threshold(self):
+        queryset = LeadSource.objects.order_by("id")
+        paginator = EstimatedCountPaginator(queryset, 2)
+        with mock.patch.object(connection, "cursor") as mock_cursor:
+            cursor = mock_cursor.return_value.__enter__.return_value
+            cursor.fetchone.return_value = (3.0,)
+            assert paginator.estimated_count() is None
+
+    @mock.patch.object(connection, "vendor", "postgresql")
+    def test_count__filtered(self):
+        queryset = LeadSource.objects.filter(medium="medium1").order_by("id")
+        paginator = EstimatedCountPaginator(queryset, 2)
+        assert paginator.estimated_count() is None
+        assert paginator.count == 1
@@ -0,0 +1,108 @@
+import datetime
+import gzip
+import json
+from io import StringIO
+from unittest import mock
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+
+from utm_tracker.archive import (
+    CHECKPOINT_NAME,
+    archive_lead_sources,
+    restore_lead_sources,
+)
+from utm_tracker.models import Checkpoint, LeadSource
+
+User = get_user_model()
+
+CUTOFF = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+@pytest.fixture
+def lead_sources():
+    user = User.objects.create()
+    for i, days in enumerate([30, 20, -10, 10]):
+        lead_source = LeadSource.objects.create_from_utm_params(
+            user, {"utm_medium": "cpc", "utm_source": "google", "gclid": str(i)}
+        )
+        lead_source.created_at = CUTOFF - datetime.timedelta(days=days)
+        lead_source.save()
+    return list(LeadSource.objects.order_by("id"))
+
+
+def read_lines(path):
+    with gzip.open(path, "rt") as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("chunk_size", [1, 2, 1000])
+def test_archive_lead_sources(tmp_path, lead_sources, chunk_size):
+    path = tmp_path / "archive.jsonl.gz"
+    assert archive_lead_sources(str(path), CUTOFF, chunk_size=chunk_size) == 3
+    assert list(LeadSource.objects.all()) == [lead_sources[2]]
+    records = read_lines(path)
+    assert [r["id"] for r in records] == [lead_sources[i].id for i in (0, 1, 3)]
+    assert records[0] == lead_sources[0].to_dict()
+    checkpoint = Checkpoint.objects.get(name=CHECKPOINT_NAME)
+    assert checkpoint.value == f"{CUTOFF.isoformat()}|{lead_sources[3].id}"
+    # nothing left to archive
+    assert archive_lead_sources(str(path), CUTOFF) == 0
+
+
+@pytest.mark.django_db
+def test_archive_lead_sources__resume(tmp_path, lead_sources):
+    path = str(tmp_path / "archive.jsonl.gz")
+    with mock.patch("utm_tracker.archive.transaction.atomic") as atomic:
+        # fail the first delete, after the chunk has been written
+        atomic.side_effect = Exception("crash")
+        with pytest.raises(Exception, match="crash"):
+            archive_lead_sources(path, CUTOFF, chunk_size=2)
+    assert LeadSource.objects.count() == 4
+    assert archive_lead_sources(path, CUTOFF, chunk_size=2) == 3
+    # the first chunk was written twice
+    assert len(read_lines(path)) == 5
+    LeadSource.objects.all().delete()
+    assert restore_lead_sources(path) == 5
+    assert LeadSource.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_archive_lead_sources__new_cutoff(tmp_path, lead_sources):
+    path = str(tmp_path / "archive.jsonl.gz")
+    assert archive_lead_sources(path, CUTOFF) == 3
+    # lead_sources[2] has a lower id than the checkpoint, but was not archived
+    lead_sources[2].created_at = CUTOFF - datetime.timedelta(days=40)
+    lead_sources[2].save()
+    # the checkpoint is still used for the same cutoff ...
+    assert archive_lead_sources(path, CUTOFF) == 0
+    # ... but not for a new one
+    assert archive_lead_sources(path, CUTOFF + datetime.timedelta(days=1)) == 1
+    assert not LeadSource.objects.exists()
+
+
+@pytest.mark.django_db
+def test_restore_lead_sources(tmp_path, lead_sources):
+    path = str(tmp_path / "archive.jsonl.gz")
+    archive_lead_sources(path, CUTOFF)
+    assert restore_lead_sources(path, batch_size=2) == 3
+    restored = list(LeadSource.objects.order_by("id"))
+    assert [ls.to_dict() for ls in restored] == [ls.to_dict() for ls in lead_sources]
+    # idempotent
+    assert restore_lead_sources(path) == 3
+    assert LeadSource.objects.count() == 4
+
+
+@pytest.mark.django_db
+def test_commands(tmp_path, lead_sources):
+    path = str(tmp_path / "archive.jsonl.gz")
+    out = StringIO()
+    call_command("archive_lead_sources", path, before="2023-01-01", stdout=out)
+    assert out.getvalue() == "Archived 3 lead sources created before 2023-01-01.\n"
+    out = StringIO()
+    call_command("restore_lead_sources", path, stdout=out)
+    assert out.getvalue() == f"Restored 3 lead sources from {path}.\n"
+    with pytest.raises(CommandError):
+        call_command("archive_lead_sources", path, before="yesterday")
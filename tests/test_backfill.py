@@ -0,0 +1,187 @@
+import datetime
+import json
+from io import StringIO
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import override_settings
+
+from utm_tracker.backfill import (
+    backfill_lead_sources,
+    parse_timestamp,
+    resolve_users,
+    to_utm_params,
+)
+from utm_tracker.export import iter_jsonl
+from utm_tracker.models import LeadSource
+from utm_tracker.sinks import JsonLinesSink
+
+User = get_user_model()
+
+
+@pytest.fixture
+def users():
+    return [
+        User.objects.create(username="alice", email="alice@example.com"),
+        User.objects.create(username="bob", email="bob@example.com"),
+        User.objects.create(username="bob2", email="bob@example.com"),
+    ]
+
+
+def write_jsonl(path, records):
+    path.write_text("".join(json.dumps(r) + "\n" for r in records))
+    return str(path)
+
+
+def test_to_utm_params():
+    record = {
+        "email": "alice@example.com",
+        "utm_source": "Google",
+        "medium": "CPC",
+        "utm_campaign": "",
+        "gclid": "1C5CHFA_enGB",
+        "mytag": 123,
+        "custom_tags": {"mytag": "ignored", "other": "ignored"},
+        "created_at": "2023-01-01",
+    }
+    assert to_utm_params(record) == {
+        "utm_source": "google",
+        "utm_medium": "cpc",
+        "gclid": "1C5CHFA_enGB",
+        "mytag": "123",
+    }
+    assert to_utm_params({"custom_tags": {"mytag": "foo"}}) == {"mytag": "foo"}
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        ("2023-02-17T12:00:00+00:00", "2023-02-17T12:00:00+00:00"),
+        ("2023-02-17 12:00:00Z", "2023-02-17T12:00:00+00:00"),
+        # naive values are in the current time zone (America/Chicago)
+        ("2023-02-17T12:00:00", "2023-02-17T12:00:00-06:00"),
+    ],
+)
+def test_parse_timestamp(value, expected):
+    assert parse_timestamp(value) == expected
+
+
+@pytest.mark.parametrize("value", ["", "yesterday", "2023-02-30T12:00:00"])
+def test_parse_timestamp__invalid(value):
+    with pytest.raises(ValueError):
+        parse_timestamp(value)
+
+
+@pytest.mark.django_db
+def test_resolve_users(users, django_assert_num_queries):
+    alice, bob, _ = users
+    records = [
+        {"user_id": alice.pk},
+        {"user_id": str(bob.pk)},
+        {"user_id": "999"},
+        {"user_id": "not-an-id"},
+        {"email": "alice@example.com"},
+        # ambiguous
+        {"email": "bob@example.com"},
+        {},
+    ]
+    with django_assert_num_queries(2):
+        resolved = resolve_users(records)
+    assert resolved == {
+        ("user_id", str(alice.pk)): alice.pk,
+        ("user_id", str(bob.pk)): bob.pk,
+        ("email", "alice@example.com"): alice.pk,
+    }
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("batch_size", [1, 2, 1000])
+def test_backfill_lead_sources__jsonl(tmp_path, users, batch_size):
+    alice, bob, _ = users
+    record = {"utm_medium": "cpc", "utm_source": "google"}
+    path = write_jsonl(
+        tmp_path / "leads.jsonl",
+        [
+            {"user_id": alice.pk, **record, "timestamp": "2023-02-17T12:00:00Z"},
+            {"email": "alice@example.com", **record, "gclid": "1"},
+            # duplicate of the first record
+            {"user_id": alice.pk, **record, "timestamp": "2023-02-17T12:00:00Z"},
+            {"user_id": bob.pk, "utm_medium": "cpc"},
+            {"email": "bob@example.com", **record},
+        ],
+    )
+    with open(path, "a") as f:
+        f.write("not json\n\n[]\n")
+    rejected = []
+    stats = backfill_lead_sources(
+        path,
+        "jsonl",
+        batch_size=batch_size,
+        on_reject=lambda line, reason: rejected.append((line, reason)),
+    )
+    assert (stats.read, stats.created, stats.duplicates, stats.rejected) == (
+        7,
+        2,
+        1,
+        4,
+    )
+    assert rejected == [
+        (4, "Missing utm param: 'utm_source'"),
+        (5, "Unknown user: bob@example.com"),
+        (6, "Invalid record"),
+        (8, "Invalid record"),
+    ]
+    timestamps = set(LeadSource.objects.values_list("timestamp", flat=True))
+    assert timestamps == {
+        None,
+        datetime.datetime(2023, 2, 17, 12, tzinfo=datetime.timezone.utc),
+    }
+    # re-running the import creates nothing new
+    stats = backfill_lead_sources(path, "jsonl", batch_size=batch_size)
+    assert (stats.created, stats.duplicates) == (0, 3)
+
+
+@pytest.mark.django_db
+def test_backfill_lead_sources__export(tmp_path, users):
+    LeadSource.objects.create_from_utm_params(
+        users[0], {"utm_medium": "cpc", "utm_source": "google", "mytag": "foo"}
+    )
+    path = tmp_path / "export.jsonl"
+    path.write_text("".join(iter_jsonl(LeadSource.objects.all())))
+    LeadSource.objects.all().delete()
+    stats = backfill_lead_sources(str(path), "jsonl")
+    assert stats.created == 1
+    lead_source = LeadSource.objects.get()
+    assert lead_source.user == users[0]
+    assert lead_source.custom_tags == {"mytag": "foo"}
+
+
+@pytest.mark.django_db
+@override_settings(UTM_TRACKER_NORMALIZE_DIMENSIONS=True)
+def test_backfill_lead_sources__sink(tmp_path, users):
+    """Check that JsonLinesSink files can be re-imported (normalized)."""
+    path = tmp_path / "leads.jsonl"
+    lead_source = LeadSource.objects.build_from_utm_params(
+        users[0], {"utm_medium": "cpc", "utm_source": "google"}
+    )
+    JsonLinesSink(str(path)).write([lead_source])
+    stats = backfill_lead_sources(str(path), "jsonl")
+    assert (stats.created, stats.rejected) == (1, 0)
+    assert LeadSource.objects.get().utm_source == "google"
+
+
+@pytest.mark.django_db
+def test_command__csv(tmp_path, users):
+    path = tmp_path / "leads.csv"
+    path.write_text(
+        "email,utm_medium,utm_source,mytag\n"
+        "alice@example.com,cpc,google,foo\n"
+        "alice@example.com,,google,\n"
+    )
+    out, err = StringIO(), StringIO()
+    call_command("backfill_lead_sources", str(path), stdout=out, stderr=err)
+    assert out.getvalue().startswith("Read 2 records in ")
+    assert out.getvalue().endswith(": 1 created, 0 duplicates, 1 rejected.\n")
+    assert err.getvalue() == "Line 3: Missing utm param: 'utm_medium'\n"
+    assert LeadSource.objects.get().custom_tags == {"mytag": "foo"}
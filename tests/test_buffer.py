@@ -0,0 +1,102 @@
+from unittest import mock
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.base import SessionBase
+from django.test import override_settings
+
+from utm_tracker.buffer import LeadSourceBuffer
+from utm_tracker.models import LeadSource
+from utm_tracker.session import SESSION_KEY_UTM_PARAMS, dump_utm_params
+
+User = get_user_model()
+
+
+def build(user, count):
+    return [
+        LeadSource.objects.build_from_utm_params(
+            user, {"utm_medium": f"medium{i}", "utm_source": "source"}
+        )
+        for i in range(count)
+    ]
+
+
+@pytest.mark.django_db
+def test_put__overflow():
+    user = User.objects.create()
+    buffer = LeadSourceBuffer(max_size=3, batch_size=10, flush_interval=60)
+    lead_sources = build(user, 5)
+    with mock.patch.object(buffer, "start"):
+        assert buffer.put(lead_sources) == lead_sources[3:]
+    assert buffer.queue.qsize() == 3
+    assert not LeadSource.objects.exists()
+
+
+@pytest.mark.django_db
+def test_flush(django_assert_num_queries):
+    user = User.objects.create()
+    buffer = LeadSourceBuffer(max_size=10, batch_size=2, flush_interval=60)
+    with mock.patch.object(buffer, "start"):
+        buffer.put(build(user, 5))
+    # 5 objects in batches of 2 - each INSERT is in a savepoint, as the
+    # test runs in a transaction
+    with django_assert_num_queries(9):
+        buffer.flush()
+    assert LeadSource.objects.count() == 5
+    assert buffer.queue.empty()
+
+
+def test_get_batch__batch_size():
+    buffer = LeadSourceBuffer(max_size=10, batch_size=2, flush_interval=60)
+    for i in range(3):
+        buffer.queue.put(i)
+    assert buffer.get_batch() == ([0, 1], False)
+
+
+def test_get_batch__flush_interval():
+    buffer = LeadSourceBuffer(max_size=10, batch_size=10, flush_interval=0.01)
+    buffer.queue.put(0)
+    assert buffer.get_batch() == ([0], False)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_worker_thread():
+    user = User.objects.create()
+    buffer = LeadSourceBuffer(max_size=10, batch_size=2, flush_interval=60)
+    buffer.put(build(user, 3))
+    assert buffer.thread.is_alive()
+    buffer.stop(timeout=5)
+    assert not buffer.thread.is_alive()
+    assert LeadSource.objects.count() == 3
+
+
+@pytest.mark.django_db
+@override_settings(UTM_TRACKER_WRITE_BEHIND=True)
+@mock.patch("utm_tracker.session.lead_source_buffer")
+def test_dump_utm_params__write_behind(mock_buffer):
+    user = User.objects.create()
+    session = SessionBase()
+    session[SESSION_KEY_UTM_PARAMS] = [
+        {"utm_medium": "medium1", "utm_source": "source1"},
+        {"utm_medium": "medium2", "utm_source": "source2"},
+    ]
+    mock_buffer.put.side_effect = lambda lead_sources: lead_sources[1:]
+    queued = dump_utm_params(user, session)
+    assert len(queued) == 2
+    mock_buffer.put.assert_called_once_with(queued)
+    # the overflow is saved synchronously
+    assert LeadSource.objects.get().medium == "medium2"
+
+
+def test_settings():
+    """Check that the settings are read on use, not at import."""
+    buffer = LeadSourceBuffer()
+    with override_settings(
+        UTM_TRACKER_WRITE_BEHIND_QUEUE_SIZE=5,
+        UTM_TRACKER_WRITE_BEHIND_BATCH_SIZE=2,
+        UTM_TRACKER_WRITE_BEHIND_FLUSH_INTERVAL=0.5,
+    ):
+        assert buffer.max_size == 5
+        assert buffer.batch_size == 2
+        assert buffer.flush_interval == 0.5
+    assert buffer.max_size == 10_000
@@ -0,0 +1,122 @@
+import asyncio
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+
+from utm_tracker.cookie import (
+    CookieStash,
+    decode_cookie,
+    encode_cookie,
+    get_cookie_stash,
+)
+from utm_tracker.encoding import decode_utm_params
+from utm_tracker.middleware import UtmSessionMiddleware
+from utm_tracker.models import LeadSource
+
+User = get_user_model()
+
+COOKIE = "utm_stash"
+
+
+def get_request(value=None):
+    request = RequestFactory().get("/")
+    if value is not None:
+        request.COOKIES[COOKIE] = value
+    return request
+
+
+@override_settings(UTM_TRACKER_STASH_COOKIE=COOKIE)
+class CookieStashTests(TestCase):
+    def test_decode_cookie(self):
+        stashed = [[1, 1676625600, "google", "cpc"]]
+        assert decode_cookie(encode_cookie(stashed)) == stashed
+        assert decode_cookie("foo") == []
+        # tampered
+        assert decode_cookie(encode_cookie(stashed) + "x") == []
+
+    def test_add(self):
+        stash = CookieStash(get_request())
+        assert not stash
+        assert stash.add({"utm_source": "google", "utm_medium": "cpc"})
+        assert decode_utm_params(stash.stashed[0])["utm_source"] == "google"
+        # duplicate
+        assert not stash.add({"utm_source": "google", "utm_medium": "cpc"})
+        assert not stash.add({})
+        assert len(stash.stashed) == 1
+
+    def test_update_response(self):
+        stash = CookieStash(get_request())
+        response = HttpResponse()
+        stash.update_response(response)
+        assert COOKIE not in response.cookies
+        stash.add({"utm_source": "google", "utm_medium": "cpc"})
+        stash.update_response(response)
+        value = response.cookies[COOKIE].value
+        # read back from the next request
+        stash = CookieStash(get_request(value))
+        assert decode_utm_params(stash.stashed[0])["utm_medium"] == "cpc"
+        assert stash.pop()[0]["utm_medium"] == "cpc"
+        response = HttpResponse()
+        stash.update_response(response)
+        assert response.cookies[COOKIE].value == ""
+
+    @override_settings(UTM_TRACKER_STASH_COOKIE_MAX_SIZE=200)
+    def test_max_size(self):
+        stash = CookieStash(get_request())
+        for i in range(10):
+            # random-looking values, which do not compress
+            gclid = hashlib.sha256(str(i).encode()).hexdigest()
+            stash.add({"utm_source": "google", "gclid": gclid})
+            assert len(encode_cookie(stash.stashed)) <= 200
+        assert 0 < len(stash.stashed) < 10
+
+    @override_settings(UTM_TRACKER_STASH_COOKIE_MAX_SIZE=50)
+    def test_max_size__too_large(self):
+        stash = CookieStash(get_request())
+        assert not stash.add({"utm_source": "google", "gclid": "x" * 100})
+        assert not stash
+
+    def test_get_cookie_stash(self):
+        request = get_request()
+        assert get_cookie_stash(request) is get_cookie_stash(request)
+
+    def test_middleware__async(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        request = RequestFactory().get("/?utm_medium=cpc&utm_source=google")
+        response = asyncio.run(UtmSessionMiddleware(get_response)(request))
+        assert not hasattr(request, "session")
+        stash = CookieStash(get_request(response.cookies[COOKIE].value))
+        assert decode_utm_params(stash.stashed[0])["utm_source"] == "google"
+
+
+@override_settings(UTM_TRACKER_STASH_COOKIE=COOKIE)
+class CookieIntegrationTests(TestCase):
+    def test_dump_params(self):
+        user = User.objects.create(username="fred")
+        # the 302 view does not use the session
+        self.client.get("/302/?utm_medium=medium1&utm_source=source1")
+        self.client.get("/302/?utm_medium=medium2&utm_source=source1")
+        assert COOKIE in self.client.cookies
+        assert settings.SESSION_COOKIE_NAME not in self.client.cookies
+        assert not LeadSource.objects.exists()
+
+        self.client.force_login(user)
+        self.client.get("/200/")
+        assert self.client.cookies[COOKIE].value == ""
+        assert [ls.medium for ls in LeadSource.objects.order_by("id")] == [
+            "medium1",
+            "medium2",
+        ]
+
+    def test_dump_params__authenticated(self):
+        """Check that params are flushed in the request they are stashed in."""
+        user = User.objects.create(username="fred")
+        self.client.force_login(user)
+        self.client.get("/200/?utm_medium=medium1&utm_source=source1")
+        assert COOKIE not in self.client.cookies
+        assert LeadSource.objects.get().medium == "medium1"
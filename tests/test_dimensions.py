@@ -0,0 +1,216 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+import freezegun
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import transaction
+from django.test import override_settings
+
+from utm_tracker.models import LeadSource, LeadSourceDailyStat, UtmDimension
+from utm_tracker.rollup import rollup_lead_sources
+
+User = get_user_model()
+
+UTM_PARAMS = {
+    "utm_medium": "cpc",
+    "utm_source": "google",
+    "utm_campaign": "spring",
+}
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # ids cached (on commit) inside django_capture_on_commit_callbacks are not
+    # valid once the test transaction is rolled back
+    UtmDimension.objects.clear_cache()
+    yield
+    UtmDimension.objects.clear_cache()
+
+
+@pytest.fixture
+def normalize():
+    with override_settings(UTM_TRACKER_NORMALIZE_DIMENSIONS=True):
+        yield
+
+
+@pytest.mark.django_db
+class TestUtmDimensionManager:
+    def test_get_id(
+        self, django_assert_num_queries, django_capture_on_commit_callbacks
+    ):
+        # ids are only cached once the transaction is committed
+        with django_capture_on_commit_callbacks(execute=True):
+            pk = UtmDimension.objects.get_id("medium", "cpc")
+            assert not UtmDimension.objects.ids
+        assert UtmDimension.objects.get(pk=pk).value == "cpc"
+        # cached
+        with django_assert_num_queries(0):
+            assert UtmDimension.objects.get_id("medium", "cpc") == pk
+        # same value, different kind
+        assert UtmDimension.objects.get_id("source", "cpc") != pk
+
+    def test_get_value(
+        self, django_assert_num_queries, django_capture_on_commit_callbacks
+    ):
+        dimension = UtmDimension.objects.create(kind="medium", value="cpc")
+        with (
+            django_assert_num_queries(1),
+            django_capture_on_commit_callbacks(execute=True),
+        ):
+            assert UtmDimension.objects.get_value(dimension.pk) == "cpc"
+        with django_assert_num_queries(0):
+            assert UtmDimension.objects.get_value(dimension.pk) == "cpc"
+            assert UtmDimension.objects.get_id("medium", "cpc") == dimension.pk
+
+    @mock.patch.object(UtmDimension.objects, "max_cache_size", 2)
+    def test_cache_size(self, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            UtmDimension.objects.get_id("medium", "cpc")
+            UtmDimension.objects.get_id("medium", "email")
+        assert len(UtmDimension.objects.values) == 2
+        with django_capture_on_commit_callbacks(execute=True):
+            UtmDimension.objects.get_id("medium", "social")
+        assert len(UtmDimension.objects.values) == 1
+
+    def test_rollback(self, normalize):
+        """Check that ids created in a rolled back transaction are not cached."""
+        user = User.objects.create()
+        with pytest.raises(RuntimeError):
+            with transaction.atomic():
+                LeadSource.objects.create_from_utm_params(user, UTM_PARAMS)
+                raise RuntimeError
+        assert not UtmDimension.objects.exists()
+        assert not UtmDimension.objects.ids
+        lead_source = LeadSource.objects.create_from_utm_params(user, UTM_PARAMS)
+        lead_source.refresh_from_db()
+        assert lead_source.medium_ref.value == "cpc"
+
+
+@pytest.mark.django_db
+class TestNormalizedLeadSource:
+    def test_create(self, normalize):
+        user = User.objects.create()
+        lead_source = LeadSource.objects.create_from_utm_params(user, UTM_PARAMS)
+        lead_source.refresh_from_db()
+        assert lead_source.medium == ""
+        assert lead_source.source == ""
+        assert lead_source.campaign == ""
+        assert lead_source.medium_ref.value == "cpc"
+        assert lead_source.utm_medium == "cpc"
+        assert lead_source.utm_source == "google"
+        assert lead_source.utm_campaign == "spring"
+        assert str(lead_source).endswith(": cpc/google")
+
+    def test_create__no_campaign(self, normalize):
+        user = User.objects.create()
+        lead_source = LeadSource.objects.create_from_utm_params(
+            user, {"utm_medium": "cpc", "utm_source": "google"}
+        )
+        assert lead_source.campaign_ref_id is None
+        assert lead_source.utm_campaign == ""
+
+    def test_bulk_create(
+        self, normalize, django_assert_num_queries, django_capture_on_commit_callbacks
+    ):
+        user = User.objects.create()
+        with django_capture_on_commit_callbacks(execute=True):
+            UtmDimension.objects.get_id("medium", "cpc")
+            UtmDimension.objects.get_id("source", "google")
+            UtmDimension.objects.get_id("campaign", "spring")
+        # all dimensions cached - INSERT + SELECT only (plus the savepoint,
+        # as the test runs in a transaction)
+        with django_assert_num_queries(4):
+            LeadSource.objects.bulk_create_from_utm_params(
+                user, [UTM_PARAMS, {**UTM_PARAMS, "gclid": "1C5CHFA"}]
+            )
+        assert UtmDimension.objects.count() == 3
+
+    def test_to_dict(self, normalize):
+        user = User.objects.create()
+        lead_source = LeadSource.objects.create_from_utm_params(user, UTM_PARAMS)
+        record = lead_source.to_dict()
+        assert record["medium"] == "cpc"
+        assert record["source"] == "google"
+        assert record["campaign"] == "spring"
+        assert "medium_ref_id" not in record
+
+    def test_with_dimensions(self, normalize):
+        user = User.objects.create()
+        lead_source = LeadSource.objects.create_from_utm_params(user, UTM_PARAMS)
+        with override_settings(UTM_TRACKER_NORMALIZE_DIMENSIONS=False):
+            unnormalized = LeadSource.objects.create_from_utm_params(
+                user, {**UTM_PARAMS, "gclid": "1C5CHFA"}
+            )
+        queryset = LeadSource.objects.with_dimensions(medium="cpc", source="google")
+        assert set(queryset) == {lead_source, unnormalized}
+        assert not LeadSource.objects.with_dimensions(medium="email").exists()
+        assert list(
+            LeadSource.objects.with_dimensions(campaign="spring").first_touch()
+        ) == [lead_source]
+        with pytest.raises(ValueError):
+            LeadSource.objects.with_dimensions(term="foo")
+
+    def test_with_dimensions__no_join(
+        self, normalize, django_capture_on_commit_callbacks
+    ):
+        user = User.objects.create()
+        with django_capture_on_commit_callbacks(execute=True):
+            LeadSource.objects.create_from_utm_params(user, UTM_PARAMS)
+        queryset = LeadSource.objects.with_dimensions(source="google")
+        # the id is resolved from the cache, and UtmDimension is not joined
+        assert "utm_tracker_utmdimension" not in str(queryset.query)
+        assert queryset.count() == 1
+        # unknown values are not created
+        assert not LeadSource.objects.with_dimensions(source="bing").exists()
+        assert not UtmDimension.objects.filter(value="bing").exists()
+        with override_settings(UTM_TRACKER_NORMALIZE_DIMENSIONS=False):
+            queryset = LeadSource.objects.with_dimensions(source="google")
+            assert "source_ref_id" not in str(queryset.query).split("WHERE")[1]
+
+    def test_unnormalized(self):
+        user = User.objects.create()
+        lead_source = LeadSource.objects.create_from_utm_params(user, UTM_PARAMS)
+        assert lead_source.medium == "cpc"
+        assert lead_source.medium_ref_id is None
+        assert lead_source.utm_medium == "cpc"
+        assert not UtmDimension.objects.exists()
+
+    def test_rollup(self, normalize):
+        user = User.objects.create()
+        now = datetime.datetime(2023, 2, 17, 12, 0, tzinfo=datetime.timezone.utc)
+        LeadSource.objects.create_from_utm_params(user, UTM_PARAMS)
+        with override_settings(UTM_TRACKER_NORMALIZE_DIMENSIONS=False):
+            LeadSource.objects.create_from_utm_params(
+                user, {**UTM_PARAMS, "gclid": "1C5CHFA"}
+            )
+        LeadSource.objects.update(created_at=now, timestamp=now)
+        with freezegun.freeze_time(now + datetime.timedelta(hours=1)):
+            rollup_lead_sources()
+        stat = LeadSourceDailyStat.objects.get()
+        assert (stat.medium, stat.source, stat.campaign) == ("cpc", "google", "spring")
+        assert stat.count == 2
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("chunk_size", [1, 1000])
+def test_normalize_lead_sources(chunk_size):
+    user = User.objects.create()
+    LeadSource.objects.create_from_utm_params(user, UTM_PARAMS)
+    LeadSource.objects.create_from_utm_params(user, {**UTM_PARAMS, "gclid": "1"})
+    out = StringIO()
+    call_command("normalize_lead_sources", chunk_size=chunk_size, stdout=out)
+    assert out.getvalue() == "Updated 2 lead sources.\n"
+    assert not LeadSource.objects.exclude(medium="").exists()
+    assert not LeadSource.objects.filter(medium_ref__isnull=True).exists()
+    assert UtmDimension.objects.count() == 3
+    # nothing left to do
+    call_command("normalize_lead_sources", stdout=out)
+    assert out.getvalue().endswith("Updated 0 lead sources.\n")
+
+    call_command("normalize_lead_sources", "--reverse", stdout=out)
+    assert out.getvalue().endswith("Updated 2 lead sources.\n")
+    assert not LeadSource.objects.exclude(medium="cpc").exists()
+    assert not LeadSource.objects.filter(medium_ref__isnull=False).exists()
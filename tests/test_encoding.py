@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from utm_tracker.encoding import decode_utm_params, encode_utm_params
+
+TIMESTAMP = "2023-02-17T09:20:00+00:00"
+
+
+@pytest.mark.parametrize(
+    "params,encoded",
+    [
+        ({}, [1, None]),
+        ({"timestamp": TIMESTAMP}, [1, 1676625600]),
+        (
+            {"utm_source": "google", "utm_medium": "cpc", "timestamp": TIMESTAMP},
+            [1, 1676625600, "google", "cpc"],
+        ),
+        (
+            {"utm_source": "google", "gclid": "ABC123"},
+            [1, None, "google", "", "", "", "", "ABC123"],
+        ),
+        (
+            {"utm_source": "google", "tag1": "foo"},
+            [1, None, "google", *[""] * 9, {"tag1": "foo"}],
+        ),
+    ],
+)
+def test_encode_decode(params, encoded):
+    assert encode_utm_params(params) == encoded
+    assert decode_utm_params(encoded) == params
+
+
+def test_decode_utm_params__legacy():
+    params = {"utm_source": "google", "timestamp": TIMESTAMP}
+    assert decode_utm_params(params) is params
+
+
+def test_decode_utm_params__unknown_version():
+    with pytest.raises(ValueError):
+        decode_utm_params([2, None, "google"])
+
+
+def test_encoded_size():
+    """Check the number of bytes saved per stashed entry in the session."""
+    params = {
+        "utm_source": "google",
+        "utm_medium": "cpc",
+        "utm_campaign": "spring_sale",
+        "gclid": "1C5CHFA_enGB874GB874",
+        "timestamp": "2023-02-17T09:20:00.123456+00:00",
+    }
+    # sessions are serialized using JSONSerializer by default
+    legacy = len(json.dumps(params, separators=(",", ":")))
+    compact = len(json.dumps(encode_utm_params(params), separators=(",", ":")))
+    assert legacy == 149
+    assert compact == 72
+    assert legacy - compact == 77
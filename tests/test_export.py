@@ -0,0 +1,179 @@
+import csv
+import datetime
+import io
+import json
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core.management import CommandError, call_command
+from django.test import override_settings
+from django.urls import reverse
+
+from utm_tracker.export import (
+    EXPORT_FIELDS,
+    escape_formula,
+    filter_lead_sources,
+    iter_csv,
+    iter_jsonl,
+)
+from utm_tracker.models import LeadSource
+
+User = get_user_model()
+
+CREATED_AT = datetime.datetime(2023, 2, 17, 12, 0, tzinfo=datetime.timezone.utc)
+
+
+@pytest.fixture
+def lead_sources():
+    user = User.objects.create(username="user")
+    lead_sources = []
+    for i in range(3):
+        lead_source = LeadSource.objects.create_from_utm_params(
+            user,
+            {
+                "utm_medium": "cpc",
+                "utm_source": "google",
+                "gclid": str(i),
+                "mytag": f"tag{i}",
+            },
+        )
+        lead_source.created_at = CREATED_AT + datetime.timedelta(days=i)
+        lead_source.save()
+        lead_sources.append(lead_source)
+    return lead_sources
+
+
+def read_csv(lines):
+    return list(csv.DictReader(io.StringIO("".join(lines))))
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("chunk_size", [1, 1000])
+def test_iter_csv(lead_sources, chunk_size):
+    lines = list(iter_csv(LeadSource.objects.all(), chunk_size=chunk_size))
+    assert len(lines) == 4
+    rows = read_csv(lines)
+    assert list(rows[0]) == EXPORT_FIELDS + ["mytag"]
+    assert rows[0]["id"] == str(lead_sources[0].id)
+    assert rows[0]["medium"] == "cpc"
+    assert rows[0]["created_at"] == CREATED_AT.isoformat()
+    assert rows[0]["timestamp"] == ""
+    assert [r["mytag"] for r in rows] == ["tag0", "tag1", "tag2"]
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        ('=HYPERLINK("http://example.com")', '\'=HYPERLINK("http://example.com")'),
+        ("+1", "'+1"),
+        ("-1", "'-1"),
+        ("@SUM(A1)", "'@SUM(A1)"),
+        ("google", "google"),
+        ("", ""),
+        (1, 1),
+        (None, None),
+    ],
+)
+def test_escape_formula(value, expected):
+    assert escape_formula(value) == expected
+
+
+@pytest.mark.django_db
+def test_iter_csv__formula(lead_sources):
+    LeadSource.objects.create_from_utm_params(
+        lead_sources[0].user,
+        {"utm_medium": "cpc", "utm_source": "=cmd|' /c calc'!A0", "mytag": "@x"},
+    )
+    rows = read_csv(iter_csv(LeadSource.objects.all()))
+    assert rows[-1]["source"] == "'=cmd|' /c calc'!A0"
+    assert rows[-1]["mytag"] == "'@x"
+    # JSON Lines is not escaped
+    record = json.loads(list(iter_jsonl(LeadSource.objects.all()))[-1])
+    assert record["source"] == "=cmd|' /c calc'!A0"
+
+
+@pytest.mark.django_db
+def test_iter_jsonl(lead_sources):
+    rows = [json.loads(line) for line in iter_jsonl(LeadSource.objects.all())]
+    assert len(rows) == 3
+    assert rows[2]["gclid"] == "2"
+    assert rows[2]["mytag"] == "tag2"
+    assert rows[2]["user_id"] == lead_sources[2].user_id
+    assert rows[2]["timestamp"] is None
+
+
+@pytest.mark.django_db
+def test_iter_jsonl__normalized(lead_sources):
+    with override_settings(UTM_TRACKER_NORMALIZE_DIMENSIONS=True):
+        LeadSource.objects.create_from_utm_params(
+            lead_sources[0].user, {"utm_medium": "email", "utm_source": "newsletter"}
+        )
+    row = [json.loads(line) for line in iter_jsonl(LeadSource.objects.all())][-1]
+    assert (row["medium"], row["source"]) == ("email", "newsletter")
+
+
+@pytest.mark.django_db
+def test_filter_lead_sources(lead_sources):
+    since = CREATED_AT.date() + datetime.timedelta(days=1)
+    assert list(filter_lead_sources(since=since)) == lead_sources[1:]
+    assert list(filter_lead_sources(until=since)) == lead_sources[:2]
+    assert list(filter_lead_sources(since=since, until=since)) == lead_sources[1:2]
+
+
+@pytest.mark.django_db
+def test_command(tmp_path, lead_sources):
+    out = io.StringIO()
+    call_command("export_lead_sources", stdout=out)
+    assert len(read_csv([out.getvalue()])) == 3
+    path = tmp_path / "export.jsonl"
+    call_command("export_lead_sources", str(path), format="jsonl", since="2023-02-18")
+    assert len(path.read_text().splitlines()) == 2
+    with pytest.raises(CommandError):
+        call_command("export_lead_sources", since="yesterday")
+
+
+@pytest.mark.django_db
+class TestExportView:
+    url = reverse("utm_tracker:export_lead_sources")
+
+    def test_export(self, admin_client, lead_sources):
+        response = admin_client.get(self.url)
+        assert response.status_code == 200
+        assert response.streaming
+        assert response["Content-Type"] == "text/csv"
+        assert response["Content-Disposition"] == (
+            'attachment; filename="lead_sources.csv"'
+        )
+        lines = [line.decode() for line in response.streaming_content]
+        assert len(read_csv(lines)) == 3
+
+    def test_export__jsonl(self, admin_client, lead_sources):
+        response = admin_client.get(
+            self.url, {"format": "jsonl", "until": "2023-02-17"}
+        )
+        assert response["Content-Type"] == "application/x-ndjson"
+        lines = list(response.streaming_content)
+        assert len(lines) == 1
+
+    @pytest.mark.parametrize(
+        "params", [{"format": "xml"}, {"since": "yesterday"}, {"until": "2023-02-30"}]
+    )
+    def test_export__bad_request(self, admin_client, params):
+        assert admin_client.get(self.url, params).status_code == 400
+
+    def test_export__not_staff(self, client):
+        client.force_login(User.objects.create(username="user"))
+        response = client.get(self.url)
+        assert response.status_code == 302
+
+    def test_export__no_permission(self, client):
+        client.force_login(User.objects.create(username="staff", is_staff=True))
+        response = client.get(self.url)
+        assert response.status_code == 403
+
+    def test_export__permission(self, client, lead_sources):
+        user = User.objects.create(username="staff", is_staff=True)
+        user.user_permissions.add(Permission.objects.get(codename="view_leadsource"))
+        client.force_login(user)
+        assert client.get(self.url).status_code == 200
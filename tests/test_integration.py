@@ -1,8 +1,9 @@
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from utm_tracker.models import LeadSource
-from utm_tracker.session import SESSION_KEY_UTM_PARAMS
+from utm_tracker.session import SESSION_KEY_UTM_PARAMS, decode_stashed_params
 
 User = get_user_model()
 
@@ -10,7 +11,7 @@ User = get_user_model()
 class IntegrationTests(TestCase):
     def test_single_utm(self):
         self.client.get("/200/?utm_medium=medium1&utm_source=source1&foo=bar")
-        utm_params = self.client.session[SESSION_KEY_UTM_PARAMS]
+        utm_params = decode_stashed_params(self.client.session[SESSION_KEY_UTM_PARAMS])
         assert len(utm_params) == 1
         assert utm_params[0]["utm_medium"] == "medium1"
         assert utm_params[0]["utm_source"] == "source1"
@@ -19,7 +20,7 @@ class IntegrationTests(TestCase):
     def test_duplicate_utm(self):
         self.client.get("/200/?utm_medium=medium1&utm_source=source1&foo=bar")
         self.client.get("/200/?utm_medium=medium1&utm_source=source1&foo=bar")
-        utm_params = self.client.session[SESSION_KEY_UTM_PARAMS]
+        utm_params = decode_stashed_params(self.client.session[SESSION_KEY_UTM_PARAMS])
         assert len(utm_params) == 1
         assert utm_params[0]["utm_medium"] == "medium1"
         assert utm_params[0]["utm_source"] == "source1"
@@ -28,7 +29,7 @@ class IntegrationTests(TestCase):
     def test_multiple_utm(self):
         self.client.get("/200/?utm_medium=medium1&utm_source=source1&foo=bar")
         self.client.get("/200/?utm_medium=medium2&utm_source=source1&foo=bar")
-        utm_params = self.client.session[SESSION_KEY_UTM_PARAMS]
+        utm_params = decode_stashed_params(self.client.session[SESSION_KEY_UTM_PARAMS])
         assert len(utm_params) == 2
         assert utm_params[0]["utm_medium"] == "medium1"
         assert utm_params[1]["utm_medium"] == "medium2"
@@ -39,7 +40,7 @@ class IntegrationTests(TestCase):
             "/302/?utm_medium=medium1&utm_source=source1", follow=True
         )
         assert response.redirect_chain == [("/200/", 302)]
-        utm_params = self.client.session[SESSION_KEY_UTM_PARAMS]
+        utm_params = decode_stashed_params(self.client.session[SESSION_KEY_UTM_PARAMS])
         assert len(utm_params) == 1
         assert not LeadSource.objects.exists()
 
@@ -48,7 +49,7 @@ class IntegrationTests(TestCase):
             "/301/?utm_medium=medium1&utm_source=source1", follow=True
         )
         assert response.redirect_chain == [("/200/", 301)]
-        utm_params = self.client.session[SESSION_KEY_UTM_PARAMS]
+        utm_params = decode_stashed_params(self.client.session[SESSION_KEY_UTM_PARAMS])
         assert len(utm_params) == 1
         assert not LeadSource.objects.exists()
 
@@ -75,3 +76,39 @@ class IntegrationTests(TestCase):
         assert ls2.fbclid == "ASrdfBB"
         assert ls2.source == "source2"
         assert ls2.gclid == "1C5CHFA_enGB874GB874222"
+
+    @override_settings(UTM_TRACKER_PENDING_COOKIE="utm_pending")
+    def test_dump_params__pending_cookie(self):
+        user = User.objects.create(username="fred")
+        self.client.get("/200/?utm_medium=medium1&utm_source=source1")
+        assert self.client.cookies["utm_pending"].value == "1"
+
+        self.client.force_login(user)
+        self.client.get("/200/")
+        assert SESSION_KEY_UTM_PARAMS not in self.client.session
+        assert self.client.cookies["utm_pending"].value == ""
+        assert LeadSource.objects.get().medium == "medium1"
+
+    @override_settings(UTM_TRACKER_PENDING_COOKIE="utm_pending")
+    def test_dump_params__pending_cookie__authenticated(self):
+        """Check that params are flushed in the request they are stashed in."""
+        user = User.objects.create(username="fred")
+        self.client.force_login(user)
+        self.client.get("/200/?utm_medium=medium1&utm_source=source1")
+        assert SESSION_KEY_UTM_PARAMS not in self.client.session
+        assert "utm_pending" not in self.client.cookies
+        assert LeadSource.objects.get().medium == "medium1"
+
+
+class AsyncIntegrationTests(TestCase):
+    async def test_dump_params(self):
+        user = await User.objects.acreate(username="fred")
+        await self.async_client.get("/200/?utm_medium=medium1&utm_source=source1")
+        assert not await LeadSource.objects.aexists()
+
+        await sync_to_async(self.async_client.force_login)(user)
+        await self.async_client.get("/200/?utm_medium=medium2&utm_source=source2")
+        session = await sync_to_async(lambda: dict(self.async_client.session))()
+        assert SESSION_KEY_UTM_PARAMS not in session
+        mediums = [ls.medium async for ls in LeadSource.objects.order_by("id")]
+        assert mediums == ["medium1", "medium2"]
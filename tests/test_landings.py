@@ -0,0 +1,126 @@
+import datetime
+from unittest import mock
+
+import freezegun
+import pytest
+from django.db import DatabaseError
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+
+from utm_tracker.landings import LandingCounter, add_landing_counts, get_landing_key
+from utm_tracker.middleware import UtmSessionMiddleware
+from utm_tracker.models import LandingDailyStat
+
+DAY = datetime.date(2023, 2, 17)
+
+
+def stats():
+    return {
+        (s.date, s.source, s.medium, s.campaign): s.count
+        for s in LandingDailyStat.objects.all()
+    }
+
+
+@freezegun.freeze_time("2023-02-17 12:00")
+def test_get_landing_key():
+    params = {"utm_source": "google", "utm_medium": "cpc", "utm_campaign": "spring"}
+    assert get_landing_key(params) == (DAY, "google", "cpc", "spring")
+    assert get_landing_key({"utm_source": "google", "utm_medium": "cpc"}) == (
+        DAY,
+        "google",
+        "cpc",
+        "",
+    )
+    assert get_landing_key({"utm_source": "google"}) is None
+    assert get_landing_key({"gclid": "1C5CHFA_enGB874GB874"}) is None
+
+
+@pytest.mark.django_db
+def test_add_landing_counts():
+    add_landing_counts({(DAY, "google", "cpc", ""): 2})
+    add_landing_counts(
+        {(DAY, "google", "cpc", ""): 3, (DAY, "google", "cpc", "spring"): 1}
+    )
+    assert stats() == {
+        (DAY, "google", "cpc", ""): 5,
+        (DAY, "google", "cpc", "spring"): 1,
+    }
+
+
+@pytest.mark.django_db
+@freezegun.freeze_time("2023-02-17 12:00")
+def test_flush(django_assert_num_queries):
+    counter = LandingCounter(flush_interval=60)
+    with mock.patch.object(counter, "start"):
+        for _ in range(100):
+            counter.incr({"utm_source": "google", "utm_medium": "cpc"})
+        counter.incr({"utm_source": "bing", "utm_medium": "cpc"})
+        counter.incr({"utm_source": "bing"})
+    counter.flush()
+    assert stats() == {
+        (DAY, "google", "cpc", ""): 100,
+        (DAY, "bing", "cpc", ""): 1,
+    }
+    assert not counter.counts
+    with django_assert_num_queries(0):
+        counter.flush()
+    with mock.patch.object(counter, "start"):
+        for _ in range(100):
+            counter.incr({"utm_source": "google", "utm_medium": "cpc"})
+        counter.incr({"utm_source": "bing", "utm_medium": "cpc"})
+    # one UPDATE per key (plus the transaction savepoint) - not one per landing
+    with django_assert_num_queries(4):
+        counter.flush()
+    assert stats() == {
+        (DAY, "google", "cpc", ""): 200,
+        (DAY, "bing", "cpc", ""): 2,
+    }
+
+
+@pytest.mark.django_db
+def test_flush__error():
+    counter = LandingCounter(flush_interval=60)
+    with mock.patch.object(counter, "start"):
+        counter.incr({"utm_source": "google", "utm_medium": "cpc"})
+    with mock.patch(
+        "utm_tracker.landings.add_landing_counts", side_effect=DatabaseError
+    ):
+        counter.flush()
+    # kept for the next flush
+    assert sum(counter.counts.values()) == 1
+    counter.flush()
+    assert list(stats().values()) == [1]
+
+
+@pytest.mark.django_db
+def test_stop():
+    counter = LandingCounter(flush_interval=60)
+    counter.incr({"utm_source": "google", "utm_medium": "cpc"})
+    assert counter.thread and counter.thread.is_alive()
+    counter.stop(timeout=1)
+    assert not counter.thread.is_alive()
+    assert list(stats().values()) == [1]
+
+
+def test_flush_interval():
+    """Check that the setting is read on use, not at import."""
+    counter = LandingCounter()
+    assert counter.flush_interval == 60.0
+    with override_settings(UTM_TRACKER_LANDING_COUNTS_FLUSH_INTERVAL=5.0):
+        assert counter.flush_interval == 5.0
+    assert LandingCounter(flush_interval=1).flush_interval == 1
+
+
+@mock.patch("utm_tracker.middleware.landing_counter")
+def test_middleware(mock_counter):
+    request = RequestFactory().get("/?utm_source=google&utm_medium=cpc")
+    with override_settings(UTM_TRACKER_STASH_COOKIE="utm_stash"):
+        UtmSessionMiddleware(lambda r: HttpResponse())(request)
+    assert mock_counter.incr.call_count == 0
+    with override_settings(
+        UTM_TRACKER_STASH_COOKIE="utm_stash", UTM_TRACKER_LANDING_COUNTS=True
+    ):
+        UtmSessionMiddleware(lambda r: HttpResponse())(request)
+    mock_counter.incr.assert_called_once_with(
+        {"utm_source": "google", "utm_medium": "cpc"}
+    )
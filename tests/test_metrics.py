@@ -0,0 +1,143 @@
+from unittest import mock
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.test import RequestFactory, override_settings
+
+from utm_tracker import metrics
+from utm_tracker.metrics import (
+    InMemoryMetricsBackend,
+    MetricsBackend,
+    SignalMetricsBackend,
+    get_backend,
+)
+from utm_tracker.middleware import UtmSessionMiddleware
+from utm_tracker.session import dump_utm_params, stash_utm_params
+from utm_tracker.signals import counter_incremented, timing_recorded
+
+User = get_user_model()
+
+
+@pytest.fixture
+def backend():
+    backend = get_backend()
+    backend.reset()
+    yield backend
+    backend.reset()
+
+
+def counters(backend):
+    return backend.snapshot()["counters"]
+
+
+def test_in_memory_backend():
+    backend = InMemoryMetricsBackend()
+    backend.incr("stashed")
+    backend.incr("stashed", 2)
+    backend.timing("flush", 0.5)
+    backend.timing("flush", 0.25)
+    assert backend.snapshot() == {
+        "counters": {"stashed": 3},
+        "timings": {"flush": {"count": 2, "total": 0.75, "max": 0.5}},
+    }
+    backend.reset()
+    assert backend.snapshot() == {"counters": {}, "timings": {}}
+
+
+def test_signal_backend():
+    counter_handler = mock.Mock()
+    timing_handler = mock.Mock()
+    counter_incremented.connect(counter_handler)
+    timing_recorded.connect(timing_handler)
+    try:
+        backend = SignalMetricsBackend()
+        backend.incr("stashed", 2)
+        backend.timing("flush", 0.5)
+    finally:
+        counter_incremented.disconnect(counter_handler)
+        timing_recorded.disconnect(timing_handler)
+    counter_handler.assert_called_once_with(
+        signal=counter_incremented,
+        sender=SignalMetricsBackend,
+        name="stashed",
+        value=2,
+    )
+    timing_handler.assert_called_once_with(
+        signal=timing_recorded,
+        sender=SignalMetricsBackend,
+        name="flush",
+        seconds=0.5,
+    )
+
+
+def test_get_backend():
+    assert isinstance(get_backend(), InMemoryMetricsBackend)
+    with override_settings(
+        UTM_TRACKER_METRICS_BACKEND="utm_tracker.metrics.MetricsBackend"
+    ):
+        assert type(get_backend()) is MetricsBackend
+    assert isinstance(get_backend(), InMemoryMetricsBackend)
+
+
+def test_timer(backend):
+    with metrics.timer("stash"):
+        pass
+    with pytest.raises(ValueError):
+        with metrics.timer("flush"):
+            raise ValueError
+    assert list(backend.snapshot()["timings"]) == ["stash"]
+
+
+@override_settings(UTM_TRACKER_MAX_STASHED_PARAMS=2)
+@override_settings(UTM_TRACKER_EVICTION_POLICY="last")
+def test_stash_counters(backend):
+    session = SessionStore()
+    session._session_cache = {}
+    stash_utm_params(session, {"utm_medium": "cpc", "utm_source": "google"})
+    stash_utm_params(session, {"utm_medium": "cpc", "utm_source": "google"})
+    stash_utm_params(session, {"utm_medium": "cpc", "utm_source": "bing"})
+    stash_utm_params(session, {"utm_medium": "cpc", "utm_source": "yahoo"})
+    assert counters(backend) == {"stashed": 3, "deduped": 1, "evicted": 1}
+
+
+@pytest.mark.django_db
+def test_dump_counters(backend):
+    user = User.objects.create()
+    session = SessionStore()
+    session._session_cache = {}
+    stash_utm_params(session, {"utm_medium": "cpc", "utm_source": "google"})
+    stash_utm_params(session, {"utm_source": "google"})
+    stash_utm_params(session, {"utm_medium": "cpc"})
+    dump_utm_params(user, session)
+    assert counters(backend) == {"stashed": 3, "rejected": 2, "persisted": 1}
+    assert backend.snapshot()["timings"]["flush"]["count"] == 1
+
+
+@mock.patch("utm_tracker.sinks.get_sinks")
+@pytest.mark.django_db
+def test_sink_errors(mock_get_sinks, backend):
+    mock_get_sinks.return_value = [mock.Mock(write=mock.Mock(side_effect=Exception))]
+    user = User.objects.create()
+    session = SessionStore()
+    session._session_cache = {}
+    stash_utm_params(session, {"utm_medium": "cpc", "utm_source": "google"})
+    dump_utm_params(user, session)
+    assert counters(backend)["sink_errors"] == 1
+    # not persisted, as the (only) sink failed
+    assert counters(backend)["dropped"] == 1
+    assert "persisted" not in counters(backend)
+
+
+def test_middleware_timings(backend):
+    request = RequestFactory().get("/", {"utm_medium": "cpc", "utm_source": "google"})
+    request.session = SessionStore()
+    request.session._session_cache = {}
+    UtmSessionMiddleware(lambda r: None)(request)
+    timings = backend.snapshot()["timings"]
+    assert timings["parse_qs"]["count"] == 1
+    assert timings["stash"]["count"] == 1
+    # untagged requests are not timed
+    request = RequestFactory().get("/")
+    UtmSessionMiddleware(lambda r: None)(request)
+    assert backend.snapshot()["timings"]["parse_qs"]["count"] == 1
@@ -1,12 +1,22 @@
+import asyncio
 from unittest import mock
 
+import pytest
+from asgiref.sync import iscoroutinefunction
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
 from django.contrib.sessions.backends.base import SessionBase
-from django.http import HttpRequest, HttpResponse
+from django.http import HttpRequest, HttpResponse, QueryDict
+from django.test import override_settings
 
-from utm_tracker.middleware import LeadSourceMiddleware, UtmSessionMiddleware
-from utm_tracker.session import SESSION_KEY_UTM_PARAMS
+from utm_tracker.encoding import decode_utm_params
+from utm_tracker.metrics import get_backend
+from utm_tracker.middleware import (
+    AsyncCapableMiddleware,
+    LeadSourceMiddleware,
+    UtmSessionMiddleware,
+)
+from utm_tracker.session import SESSION_KEY_UTM_PARAMS, decode_stashed_params
 
 User = get_user_model()
 
@@ -15,6 +25,7 @@ class TestUtmSessionMiddleware:
     @mock.patch("utm_tracker.middleware.parse_qs")
     def test_middleware(self, mock_utm):
         request = mock.Mock(spec=HttpRequest)
+        request.META = {"QUERY_STRING": "utm_medium=medium&utm_source=source"}
         request.session = SessionBase()
         mock_utm.return_value = {
             "utm_medium": "medium",
@@ -31,7 +42,7 @@ class TestUtmSessionMiddleware:
         middleware = UtmSessionMiddleware(lambda r: HttpResponse())
         middleware(request)
         assert len(request.session[SESSION_KEY_UTM_PARAMS]) == 1
-        utm_params = request.session[SESSION_KEY_UTM_PARAMS][0]
+        utm_params = decode_utm_params(request.session[SESSION_KEY_UTM_PARAMS][0])
         assert utm_params["utm_medium"] == "medium"
         assert utm_params["utm_source"] == "source"
         assert utm_params["utm_campaign"] == "campaign"
@@ -46,12 +57,69 @@ class TestUtmSessionMiddleware:
     @mock.patch("utm_tracker.middleware.parse_qs")
     def test_middleware__no_params(self, mock_utm):
         request = mock.Mock(spec=HttpRequest)
+        request.META = {"QUERY_STRING": "utm_medium="}
         request.session = SessionBase()
         mock_utm.return_value = {}
         middleware = UtmSessionMiddleware(lambda r: HttpResponse())
         middleware(request)
         assert SESSION_KEY_UTM_PARAMS not in request.session
 
+    @mock.patch("utm_tracker.middleware.parse_qs")
+    def test_middleware__untracked_querystring(self, mock_utm):
+        """Check that untagged requests do not parse the qs or touch the session."""
+        request = mock.Mock(spec=HttpRequest)
+        request.META = {"QUERY_STRING": "foo=bar&page=2"}
+        session = mock.Mock(spec=SessionBase)
+        request.session = session
+        middleware = UtmSessionMiddleware(lambda r: HttpResponse())
+        middleware(request)
+        assert mock_utm.call_count == 0
+        assert session.mock_calls == []
+
+    @mock.patch("utm_tracker.middleware.parse_qs")
+    def test_middleware__ignored_user_agent(self, mock_utm):
+        """Check that bots do not parse the qs or touch the session."""
+        request = mock.Mock(spec=HttpRequest)
+        request.META = {
+            "QUERY_STRING": "utm_medium=medium&utm_source=source",
+            "HTTP_USER_AGENT": "Mozilla/5.0 (compatible; bingbot/2.0)",
+        }
+        session = mock.Mock(spec=SessionBase)
+        request.session = session
+        get_backend().reset()
+        middleware = UtmSessionMiddleware(lambda r: HttpResponse())
+        middleware(request)
+        assert mock_utm.call_count == 0
+        assert session.mock_calls == []
+        assert get_backend().snapshot()["counters"] == {"skipped_user_agent": 1}
+
+    @override_settings(UTM_TRACKER_PENDING_COOKIE="utm_pending")
+    def test_middleware__pending_cookie(self):
+        request = mock.Mock(spec=HttpRequest)
+        request.META = {"QUERY_STRING": "utm_medium=medium&utm_source=source"}
+        request.GET = QueryDict(request.META["QUERY_STRING"])
+        request.session = SessionBase()
+        middleware = UtmSessionMiddleware(lambda r: HttpResponse())
+        response = middleware(request)
+        assert request.utm_params_stashed
+        assert response.cookies["utm_pending"].value == "1"
+
+    @override_settings(UTM_TRACKER_PENDING_COOKIE="utm_pending")
+    def test_middleware__pending_cookie__flushed(self):
+        """Check that the cookie is not set if the params were flushed."""
+        request = mock.Mock(spec=HttpRequest)
+        request.META = {"QUERY_STRING": "utm_medium=medium&utm_source=source"}
+        request.GET = QueryDict(request.META["QUERY_STRING"])
+        request.session = SessionBase()
+
+        def get_response(request):
+            request.session.pop(SESSION_KEY_UTM_PARAMS)
+            return HttpResponse()
+
+        middleware = UtmSessionMiddleware(get_response)
+        response = middleware(request)
+        assert "utm_pending" not in response.cookies
+
 
 class TestLeadSourceMiddleware:
     @mock.patch("utm_tracker.middleware.dump_utm_params")
@@ -79,3 +147,129 @@ class TestLeadSourceMiddleware:
         middleware = LeadSourceMiddleware(lambda r: HttpResponse())
         middleware(request)
         assert mock_flush.call_count == 1
+
+    @override_settings(UTM_TRACKER_PENDING_COOKIE="utm_pending")
+    @mock.patch("utm_tracker.middleware.dump_utm_params")
+    def test_middleware__no_pending_cookie(self, mock_flush):
+        session = mock.Mock(SessionBase)
+        request = mock.Mock(spec=HttpRequest, user=User(), session=session)
+        request.COOKIES = {}
+        middleware = LeadSourceMiddleware(lambda r: HttpResponse())
+        response = middleware(request)
+        assert mock_flush.call_count == 0
+        assert session.mock_calls == []
+        assert "utm_pending" not in response.cookies
+
+    @override_settings(UTM_TRACKER_PENDING_COOKIE="utm_pending")
+    @mock.patch("utm_tracker.middleware.dump_utm_params")
+    def test_middleware__pending_cookie(self, mock_flush):
+        session = mock.Mock(SessionBase)
+        request = mock.Mock(spec=HttpRequest, user=User(), session=session)
+        request.COOKIES = {"utm_pending": "1"}
+        middleware = LeadSourceMiddleware(lambda r: HttpResponse())
+        response = middleware(request)
+        mock_flush.assert_called_once_with(request.user, session)
+        # cookie is deleted
+        assert response.cookies["utm_pending"]["max-age"] == 0
+
+    @override_settings(UTM_TRACKER_PENDING_COOKIE="utm_pending")
+    @mock.patch("utm_tracker.middleware.dump_utm_params")
+    def test_middleware__pending_cookie__error(self, mock_flush):
+        """Check that the cookie is retained if the flush fails."""
+        session = mock.Mock(SessionBase)
+        request = mock.Mock(spec=HttpRequest, user=User(), session=session)
+        request.COOKIES = {"utm_pending": "1"}
+        mock_flush.side_effect = Exception("Panic")
+        middleware = LeadSourceMiddleware(lambda r: HttpResponse())
+        response = middleware(request)
+        assert mock_flush.call_count == 1
+        assert "utm_pending" not in response.cookies
+
+
+async def async_get_response(request):
+    return HttpResponse()
+
+
+class TestUtmSessionMiddlewareAsync:
+    def test_async_mode(self):
+        assert not UtmSessionMiddleware(lambda r: HttpResponse()).async_mode
+        middleware = UtmSessionMiddleware(async_get_response)
+        assert middleware.async_mode
+        assert iscoroutinefunction(middleware)
+
+    def test_middleware(self):
+        request = mock.Mock(spec=HttpRequest)
+        request.META = {"QUERY_STRING": "utm_medium=medium&utm_source=source"}
+        request.GET = QueryDict(request.META["QUERY_STRING"])
+        request.session = SessionBase()
+        middleware = UtmSessionMiddleware(async_get_response)
+        asyncio.run(middleware(request))
+        assert request.utm_params_stashed
+        utm_params = decode_stashed_params(request.session[SESSION_KEY_UTM_PARAMS])
+        assert len(utm_params) == 1
+        assert utm_params[0]["utm_medium"] == "medium"
+        assert utm_params[0]["utm_source"] == "source"
+
+    @mock.patch("utm_tracker.middleware.parse_qs")
+    def test_middleware__untracked_querystring(self, mock_utm):
+        request = mock.Mock(spec=HttpRequest)
+        request.META = {"QUERY_STRING": "foo=bar"}
+        session = mock.Mock(spec=SessionBase)
+        request.session = session
+        middleware = UtmSessionMiddleware(async_get_response)
+        asyncio.run(middleware(request))
+        assert mock_utm.call_count == 0
+        assert session.mock_calls == []
+
+    @mock.patch("utm_tracker.middleware.parse_qs")
+    def test_middleware__ignored_user_agent(self, mock_utm):
+        request = mock.Mock(spec=HttpRequest)
+        request.META = {
+            "QUERY_STRING": "utm_medium=medium&utm_source=source",
+            "HTTP_USER_AGENT": "Twitterbot/1.0",
+        }
+        session = mock.Mock(spec=SessionBase)
+        request.session = session
+        middleware = UtmSessionMiddleware(async_get_response)
+        asyncio.run(middleware(request))
+        assert mock_utm.call_count == 0
+        assert session.mock_calls == []
+
+
+class TestLeadSourceMiddlewareAsync:
+    @mock.patch("utm_tracker.middleware.adump_utm_params")
+    def test_middleware__unauthenticated(self, mock_flush):
+        request = mock.Mock(spec=HttpRequest)
+        request.auser = mock.AsyncMock(return_value=AnonymousUser())
+        middleware = LeadSourceMiddleware(async_get_response)
+        asyncio.run(middleware(request))
+        assert mock_flush.call_count == 0
+
+    @mock.patch("utm_tracker.middleware.adump_utm_params")
+    def test_middleware__authenticated(self, mock_flush):
+        user = User()
+        session = mock.Mock(SessionBase)
+        request = mock.Mock(spec=HttpRequest, session=session)
+        request.auser = mock.AsyncMock(return_value=user)
+        middleware = LeadSourceMiddleware(async_get_response)
+        asyncio.run(middleware(request))
+        mock_flush.assert_awaited_once_with(user, session)
+
+    @mock.patch("utm_tracker.middleware.adump_utm_params")
+    def test_middleware__error(self, mock_flush):
+        session = mock.Mock(SessionBase)
+        request = mock.Mock(spec=HttpRequest, session=session)
+        request.auser = mock.AsyncMock(return_value=User())
+        mock_flush.side_effect = Exception("Panic")
+        middleware = LeadSourceMiddleware(async_get_response)
+        response = asyncio.run(middleware(request))
+        assert mock_flush.call_count == 1
+        assert response.status_code == 200
+
+
+def test_async_capable_middleware__abstract():
+    # middleware must implement both process and __acall__
+    with pytest.raises(TypeError):
+        type("SyncOnly", (AsyncCapableMiddleware,), {"process": lambda s, r: r})(
+            lambda r: HttpResponse()
+        )
@@ -1,15 +1,18 @@
 from unittest import mock
 
 import pytest
+from asgiref.sync import async_to_sync
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import override_settings
 
-from utm_tracker.models import LeadSource
+from utm_tracker.models import LeadSource, fingerprint_lead_source
 
 User = get_user_model()
 
 
 @pytest.mark.django_db
-@mock.patch("utm_tracker.request.CUSTOM_TAGS", ["tag1", "tag2"])
+@override_settings(UTM_TRACKER_CUSTOM_TAGS=["tag1", "tag2"])
 def test_create_from_utm_params():
     user = User.objects.create(username="Bob")
     utm_params = {
@@ -60,3 +63,203 @@ def test_create_from_utm_params___missing_params():
 
     utm_params = {"utm_source": "source", "utm_medium": "medium"}
     LeadSource.objects.create_from_utm_params(user, utm_params)
+
+
+@pytest.mark.django_db
+def test_bulk_create_from_utm_params(django_assert_num_queries):
+    user = User.objects.create(username="Bob")
+    params_list = [
+        {"utm_medium": f"medium{i}", "utm_source": "source", "gclid": "x" * 300}
+        for i in range(10)
+    ]
+    # one INSERT, and one SELECT to fetch the primary keys (in a savepoint,
+    # as the test runs in a transaction)
+    with django_assert_num_queries(4):
+        created = LeadSource.objects.bulk_create_from_utm_params(user, params_list)
+    assert len(created) == 10
+    assert list(LeadSource.objects.order_by("id")) == created
+    assert [ls.medium for ls in created] == [f"medium{i}" for i in range(10)]
+    # values are truncated to fit the fields
+    assert all(ls.gclid == "x" * 255 for ls in created)
+
+
+@pytest.mark.django_db
+def test_bulk_create_ignore_duplicates(django_assert_num_queries):
+    user = User.objects.create(username="Bob")
+    lead_sources = [
+        LeadSource.objects.build_from_utm_params(
+            user, {"utm_medium": f"medium{i}", "utm_source": "source"}
+        )
+        for i in range(3)
+    ]
+    # a single INSERT (in a savepoint, as the test runs in a transaction) -
+    # the primary keys are not fetched
+    with django_assert_num_queries(3):
+        LeadSource.objects.bulk_create_ignore_duplicates(lead_sources)
+    assert all(ls.pk is None for ls in lead_sources)
+    assert LeadSource.objects.count() == 3
+    # duplicates are ignored, and the primary keys fetched if asked for
+    with django_assert_num_queries(4):
+        LeadSource.objects.bulk_create_ignore_duplicates(lead_sources, fetch_pks=True)
+    assert list(LeadSource.objects.order_by("id")) == lead_sources
+
+
+@pytest.mark.django_db
+def test_bulk_create_from_utm_params__missing_params():
+    """Check that nothing is saved if any of the params are invalid."""
+    user = User.objects.create(username="Bob")
+    params_list = [
+        {"utm_medium": "medium", "utm_source": "source"},
+        {"utm_source": "source"},
+    ]
+    with pytest.raises(ValueError):
+        LeadSource.objects.bulk_create_from_utm_params(user, params_list)
+    assert not LeadSource.objects.exists()
+
+
+@pytest.mark.django_db
+def test_acreate_from_utm_params():
+    user = User.objects.create(username="Bob")
+    utm_params = {"utm_source": "source", "utm_medium": "medium"}
+    ls = async_to_sync(LeadSource.objects.acreate_from_utm_params)(user, utm_params)
+    assert LeadSource.objects.get() == ls
+
+
+@pytest.mark.django_db
+def test_abulk_create_from_utm_params():
+    user = User.objects.create(username="Bob")
+    params_list = [{"utm_medium": f"medium{i}", "utm_source": "src"} for i in range(3)]
+    created = async_to_sync(LeadSource.objects.abulk_create_from_utm_params)(
+        user, params_list
+    )
+    assert list(LeadSource.objects.order_by("id")) == created
+
+
+@pytest.mark.django_db
+def test_create_from_utm_params__duplicate():
+    user = User.objects.create(username="Bob")
+    utm_params = {
+        "utm_source": "source",
+        "utm_medium": "medium",
+        "timestamp": "2023-02-17T09:20:00+00:00",
+    }
+    ls1 = LeadSource.objects.create_from_utm_params(user, utm_params)
+    ls2 = LeadSource.objects.create_from_utm_params(user, utm_params)
+    assert ls1 == ls2
+    assert LeadSource.objects.count() == 1
+    # different timestamp is a different event
+    utm_params["timestamp"] = "2023-02-17T09:21:00+00:00"
+    LeadSource.objects.create_from_utm_params(user, utm_params)
+    # different user is a different event
+    LeadSource.objects.create_from_utm_params(User.objects.create(), utm_params)
+    assert LeadSource.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_bulk_create_from_utm_params__duplicates():
+    user = User.objects.create(username="Bob")
+    params_list = [
+        {"utm_medium": f"medium{i}", "utm_source": "source", "timestamp": None}
+        for i in range(3)
+    ]
+    existing = LeadSource.objects.create_from_utm_params(user, params_list[1])
+    created = LeadSource.objects.bulk_create_from_utm_params(
+        user, params_list + params_list
+    )
+    assert LeadSource.objects.count() == 3
+    # only the objects inserted are returned
+    assert [ls.medium for ls in created] == ["medium0", "medium2"]
+    assert set(LeadSource.objects.all()) == {*created, existing}
+
+
+def test_fingerprint_lead_source():
+    params = {"utm_medium": "medium", "utm_source": "source", "tag1": "foo"}
+    fingerprint = fingerprint_lead_source(1, params)
+    assert len(fingerprint) == 64
+    # order of keys is irrelevant
+    assert fingerprint_lead_source(1, dict(reversed(params.items()))) == fingerprint
+    assert fingerprint_lead_source(2, params) != fingerprint
+    assert fingerprint_lead_source(1, {**params, "tag1": "bar"}) != fingerprint
+    # timestamps are normalised to UTC
+    assert fingerprint_lead_source(
+        1, {**params, "timestamp": "2023-02-17T09:20:00+00:00"}
+    ) == fingerprint_lead_source(
+        1, {**params, "timestamp": "2023-02-17T10:20:00+01:00"}
+    )
+
+
+@pytest.fixture
+def touches():
+    """Create three users with lead sources at different times."""
+    users = [User.objects.create(username=f"user{i}") for i in range(3)]
+    for user in users:
+        for day in (3, 1, 2):
+            LeadSource.objects.create_from_utm_params(
+                user,
+                {
+                    "utm_medium": f"day{day}",
+                    "utm_source": "source",
+                    "timestamp": f"2023-02-0{day}T00:00:00+00:00",
+                },
+            )
+    # no timestamp - falls back to created_at, which is more recent
+    LeadSource.objects.create_from_utm_params(
+        users[2], {"utm_medium": "unknown", "utm_source": "source"}
+    )
+    return users
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("over_clause", [True, False])
+def test_first_touch(touches, over_clause, django_assert_num_queries):
+    with (
+        mock.patch.object(connection.features, "supports_over_clause", over_clause),
+        django_assert_num_queries(1),
+    ):
+        first = {ls.user_id: ls.medium for ls in LeadSource.objects.first_touch()}
+    assert first == {u.id: "day1" for u in touches}
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("over_clause", [True, False])
+def test_last_touch(touches, over_clause, django_assert_num_queries):
+    with (
+        mock.patch.object(connection.features, "supports_over_clause", over_clause),
+        django_assert_num_queries(1),
+    ):
+        last = {ls.user_id: ls.medium for ls in LeadSource.objects.last_touch()}
+    assert last == {
+        touches[0].id: "day3",
+        touches[1].id: "day3",
+        touches[2].id: "unknown",
+    }
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("over_clause", [True, False])
+def test_last_touch__scoped(touches, over_clause):
+    users = User.objects.filter(username__in=["user0", "user1"])
+    with mock.patch.object(connection.features, "supports_over_clause", over_clause):
+        # filters are applied before picking the last touch
+        queryset = LeadSource.objects.exclude(medium="day3").last_touch(users)
+        last = {ls.user_id: ls.medium for ls in queryset}
+    assert last == {touches[0].id: "day2", touches[1].id: "day2"}
+
+
+@pytest.mark.django_db
+def test_chunked(django_assert_num_queries):
+    user = User.objects.create()
+    lead_sources = LeadSource.objects.bulk_create_from_utm_params(
+        user,
+        [
+            {"utm_medium": "cpc", "utm_source": "google", "gclid": str(i)}
+            for i in range(5)
+        ],
+    )
+    # 3 chunks + the final empty query
+    with django_assert_num_queries(4):
+        chunks = list(LeadSource.objects.chunked(2))
+    assert [len(c) for c in chunks] == [2, 2, 1]
+    assert [ls for chunk in chunks for ls in chunk] == lead_sources
+    chunks = list(LeadSource.objects.chunked(10, after=lead_sources[2].pk))
+    assert chunks == [lead_sources[3:]]
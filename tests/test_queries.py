@@ -0,0 +1,153 @@
+"""
+Pin the query plans for the common LeadSource query patterns.
+
+These tests run EXPLAIN QUERY PLAN (SQLite) against the test database and
+check that the expected index is used - if a model or query change means
+that an index is no longer used, these will fail.
+
+"""
+
+import datetime
+
+import pytest
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from django.utils.timezone import now as tz_now
+
+from utm_tracker.admin import LeadSourceAdmin
+from utm_tracker.models import LeadSource
+
+User = get_user_model()
+
+pytestmark = pytest.mark.skipif(
+    connection.vendor != "sqlite", reason="Query plans are database-specific"
+)
+
+
+@pytest.fixture
+def user():
+    user = User.objects.create(username="fred")
+    for i in range(10):
+        LeadSource.objects.create_from_utm_params(
+            user,
+            {
+                "utm_medium": f"medium{i % 3}",
+                "utm_source": f"source{i % 2}",
+                "timestamp": (tz_now() - datetime.timedelta(days=i)).isoformat(),
+            },
+        )
+    return user
+
+
+def assert_uses_index(queryset, index_name):
+    plan = queryset.explain()
+    assert f"USING INDEX {index_name}" in plan or (
+        f"USING COVERING INDEX {index_name}" in plan
+    ), plan
+
+
+@pytest.mark.django_db
+def test_latest(user, django_assert_num_queries):
+    with django_assert_num_queries(1):
+        latest = LeadSource.objects.latest()
+    assert latest == LeadSource.objects.order_by("-timestamp").first()
+    assert_uses_index(
+        LeadSource.objects.order_by("-timestamp")[:1], "utm_ls_timestamp_idx"
+    )
+
+
+@pytest.mark.django_db
+def test_user_latest(user, django_assert_num_queries):
+    with django_assert_num_queries(1):
+        user.lead_sources.latest()
+    assert_uses_index(
+        user.lead_sources.order_by("-timestamp")[:1], "utm_ls_user_timestamp_idx"
+    )
+
+
+@pytest.mark.django_db
+def test_user_lead_sources(user):
+    assert_uses_index(LeadSource.objects.filter(user=user), "utm_ls_user_timestamp_idx")
+
+
+@pytest.mark.django_db
+def test_admin_filter__source_medium(user):
+    queryset = LeadSource.objects.filter(
+        source="source1",
+        medium="medium2",
+        timestamp__gte=tz_now() - datetime.timedelta(days=7),
+    ).order_by("-timestamp")
+    assert_uses_index(queryset, "utm_ls_src_med_ts_idx")
+
+
+@pytest.mark.django_db
+def test_admin_filter__source(user):
+    queryset = LeadSource.objects.filter(source="source1")
+    assert_uses_index(queryset, "utm_ls_src_med_ts_idx")
+
+
+@pytest.mark.django_db
+def test_admin_filter__timestamp(user):
+    queryset = LeadSource.objects.filter(
+        timestamp__gte=tz_now() - datetime.timedelta(days=7)
+    )
+    assert_uses_index(queryset, "utm_ls_timestamp_idx")
+
+
+@pytest.mark.django_db
+def test_created_at_range(user):
+    queryset = LeadSource.objects.filter(
+        created_at__gt=tz_now() - datetime.timedelta(hours=1),
+        created_at__lte=tz_now(),
+    )
+    assert_uses_index(queryset, "utm_ls_created_at_idx")
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("normalize", [False, True])
+def test_admin_search(user, normalize):
+    """Check that each of the search conditions uses an index."""
+    with override_settings(UTM_TRACKER_NORMALIZE_DIMENSIONS=normalize):
+        queryset, _ = LeadSourceAdmin(LeadSource, admin.site).get_search_results(
+            None, LeadSource.objects.all(), "Source1"
+        )
+        assert queryset.count() == 5
+        plan = queryset.explain()
+    assert "SCAN" not in plan, plan
+    assert "utm_ls_src_med_ts_idx" in plan
+    assert "utm_ls_med_ts_idx" in plan
+
+
+def get_changelist_queryset(**params):
+    request = RequestFactory().get("/", params)
+    request.user = User.objects.create_superuser(username="admin")
+    model_admin = admin.site._registry[LeadSource]
+    return model_admin.get_changelist_instance(request).queryset
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("normalize", [False, True])
+@pytest.mark.parametrize(
+    "params,index_name",
+    [
+        ({"source": "source1"}, "utm_ls_src_med_ts_idx"),
+        ({"source": "source1", "medium": "medium2"}, "utm_ls_src_med_ts_idx"),
+        ({"medium": "medium2"}, "utm_ls_med_ts_idx"),
+    ],
+)
+def test_admin_changelist__filtered(user, normalize, params, index_name):
+    """Pin the plan of the queryset the admin builds, with the filters applied."""
+    with override_settings(UTM_TRACKER_NORMALIZE_DIMENSIONS=normalize):
+        LeadSource.objects.create_from_utm_params(
+            user, {"utm_medium": "medium2", "utm_source": "source1"}
+        )
+        queryset = get_changelist_queryset(**params)
+        assert queryset.count() == LeadSource.objects.with_dimensions(**params).count()
+    plan = queryset.explain()
+    assert "SCAN utm_tracker_leadsource" not in plan, plan
+    if not normalize:
+        # normalized filters are an OR of two indexes (column and ref), and
+        # which filter the planner starts from depends on its estimates
+        assert_uses_index(queryset, index_name)
@@ -1,8 +1,14 @@
 from unittest import mock
 
+import pytest
 from django.http import HttpRequest, QueryDict
+from django.test import RequestFactory, override_settings
 
-from utm_tracker.request import parse_qs
+from utm_tracker.request import (
+    compile_tracked_keys_pattern,
+    get_ignored_reason,
+    parse_qs,
+)
 
 
 def test_parse_qs__ignores_non_utm() -> None:
@@ -39,7 +45,7 @@ def test_parse_qs__ignores_empty_fields() -> None:
     }
 
 
-@mock.patch("utm_tracker.request.CUSTOM_TAGS", ["tag1", "tag2"])
+@override_settings(UTM_TRACKER_CUSTOM_TAGS=["tag1", "tag2"])
 def test_parse_qs__custom_tags() -> None:
     request = mock.Mock(spec=HttpRequest)
     request.GET = QueryDict(
@@ -51,3 +57,123 @@ def test_parse_qs__custom_tags() -> None:
         "tag1": "foo,bar",
         "tag2": "baz",
     }
+
+
+def test_parse_qs__ad_params() -> None:
+    request = mock.Mock(spec=HttpRequest)
+    request.GET = QueryDict(
+        "utm_source=Source&gclid=1C5CHFA_enGB&fbclid=&msclkid=a&msclkid=B"
+    )
+    assert parse_qs(request) == {
+        "utm_source": "source",
+        # not lowercased
+        "gclid": "1C5CHFA_enGB",
+        # last value wins
+        "msclkid": "B",
+    }
+
+
+def test_parse_qs__case_sensitive_keys() -> None:
+    request = mock.Mock(spec=HttpRequest)
+    request.GET = QueryDict("UTM_Source=Source&utm_medium=Medium&GCLID=1C5CHFA")
+    assert parse_qs(request) == {"utm_medium": "medium"}
+
+
+@override_settings(UTM_TRACKER_CUSTOM_TAGS=["Tag1"])
+@override_settings(UTM_TRACKER_CASE_INSENSITIVE_KEYS=True)
+def test_parse_qs__case_insensitive_keys() -> None:
+    request = mock.Mock(spec=HttpRequest)
+    request.GET = QueryDict("UTM_Source=Source&utm_medium=Medium&GCLID=1C5CHFA&tag1=a")
+    assert parse_qs(request) == {
+        "utm_source": "source",
+        "utm_medium": "medium",
+        "gclid": "1C5CHFA",
+        "Tag1": "a",
+    }
+
+
+@pytest.mark.parametrize(
+    "query_string,result",
+    [
+        ("", False),
+        ("foo=bar", False),
+        ("utm_source=source", True),
+        ("foo=bar&utm_medium=medium", True),
+        ("foo=bar&gclid=1C5CHFA_enGB874GB874", True),
+        ("utm_campaign", True),
+        ("utm_campaign&foo=bar", True),
+        ("tag1=foo", True),
+        ("not_utm_source=source", False),
+        ("utm_sourcex=source", False),
+        ("foo=utm_source", False),
+        ("tag10=foo", False),
+    ],
+)
+def test_compile_tracked_keys_pattern(query_string: str, result: bool) -> None:
+    pattern = compile_tracked_keys_pattern(["tag1"])
+    assert (pattern.search(query_string) is not None) == result
+
+
+@pytest.mark.parametrize(
+    "query_string,result",
+    [
+        ("UTM_Source=source", True),
+        ("foo=bar&GCLID=1C5CHFA_enGB874GB874", True),
+        ("TAG1=foo", True),
+        ("not_UTM_source=source", False),
+    ],
+)
+def test_compile_tracked_keys_pattern__ignore_case(
+    query_string: str, result: bool
+) -> None:
+    pattern = compile_tracked_keys_pattern(["tag1"], ignore_case=True)
+    assert (pattern.search(query_string) is not None) == result
+    assert compile_tracked_keys_pattern(["tag1"]).search(query_string) is None
+
+
+@pytest.mark.parametrize(
+    "user_agent,path,result",
+    [
+        ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)", "/", None),
+        ("", "/", None),
+        ("Mozilla/5.0 (compatible; Googlebot/2.1)", "/", "user_agent"),
+        ("facebookexternalhit/1.1", "/", "user_agent"),
+        ("Pinterestbot/1.0", "/", "user_agent"),
+        ("WhatsApp/2.23.20.0 A", "/", "user_agent"),
+        # in-app browsers are real visitors
+        (
+            "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) "
+            "AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148 [Pinterest/iOS]",
+            "/",
+            None,
+        ),
+        ("Mozilla/5.0 (Linux; Android 13) Chrome/118.0 WhatsApp", "/", None),
+        ("AdsBot-Google (+http://www.google.com/adsbot.html)", "/", "user_agent"),
+        ("TelegramBot (like TwitterBot)", "/", "user_agent"),
+        # phones with "bot" in the model name
+        (
+            "Mozilla/5.0 (Linux; Android 10; CUBOT_X30) AppleWebKit/537.36 "
+            "(KHTML, like Gecko) Chrome/118.0 Mobile Safari/537.36",
+            "/",
+            None,
+        ),
+        (
+            "Mozilla/5.0 (Linux; Android 9; CUBOT P30) AppleWebKit/537.36 "
+            "(KHTML, like Gecko) Chrome/118.0 Mobile Safari/537.36",
+            "/",
+            None,
+        ),
+        ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)", "/api/foo", "path"),
+        ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)", "/foo/api/", None),
+    ],
+)
+@override_settings(UTM_TRACKER_IGNORED_PATHS=["/api/"])
+def test_get_ignored_reason(user_agent: str, path: str, result: str | None) -> None:
+    request = RequestFactory().get(path, HTTP_USER_AGENT=user_agent)
+    assert get_ignored_reason(request) == result
+
+
+@override_settings(UTM_TRACKER_IGNORED_USER_AGENTS=[])
+def test_get_ignored_reason__disabled() -> None:
+    request = RequestFactory().get("/", HTTP_USER_AGENT="Googlebot/2.1")
+    assert get_ignored_reason(request) is None
@@ -0,0 +1,107 @@
+import datetime
+from io import StringIO
+
+import freezegun
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+
+from utm_tracker.models import Checkpoint, LeadSource, LeadSourceDailyStat
+from utm_tracker.rollup import CHECKPOINT_NAME, rollup_lead_sources
+
+User = get_user_model()
+
+NOW = datetime.datetime(2023, 2, 17, 12, 0, tzinfo=datetime.timezone.utc)
+
+
+def create(user, medium, created_at, timestamp=None, **params):
+    lead_source = LeadSource.objects.create_from_utm_params(
+        user,
+        {
+            "utm_medium": medium,
+            "utm_source": "source",
+            "timestamp": timestamp,
+            "tag": str(created_at),
+            **params,
+        },
+    )
+    lead_source.created_at = created_at
+    lead_source.save()
+    return lead_source
+
+
+def stats():
+    return {
+        (s.date.isoformat(), s.medium, s.campaign): s.count
+        for s in LeadSourceDailyStat.objects.all()
+    }
+
+
+@pytest.mark.django_db
+def test_rollup_lead_sources():
+    user = User.objects.create()
+    create(user, "cpc", NOW - datetime.timedelta(days=2))
+    create(user, "cpc", NOW - datetime.timedelta(days=2, hours=1))
+    create(user, "cpc", NOW - datetime.timedelta(hours=1), utm_campaign="spring")
+    # timestamp takes precedence over created_at
+    create(
+        user,
+        "email",
+        NOW - datetime.timedelta(hours=1),
+        timestamp="2023-02-01T12:00:00+00:00",
+    )
+    # too recent - ignored
+    create(user, "cpc", NOW - datetime.timedelta(minutes=1))
+
+    with freezegun.freeze_time(NOW):
+        assert rollup_lead_sources() == 4
+    assert stats() == {
+        ("2023-02-15", "cpc", ""): 2,
+        ("2023-02-17", "cpc", "spring"): 1,
+        ("2023-02-01", "email", ""): 1,
+    }
+    checkpoint = Checkpoint.objects.get(name=CHECKPOINT_NAME)
+    assert checkpoint.value == (NOW - datetime.timedelta(minutes=5)).isoformat()
+
+    # second run does nothing
+    with freezegun.freeze_time(NOW):
+        assert rollup_lead_sources() == 0
+
+    # and a later run picks up the recent object, and any new ones
+    create(user, "cpc", NOW + datetime.timedelta(minutes=10), utm_campaign="spring")
+    with freezegun.freeze_time(NOW + datetime.timedelta(hours=1)):
+        assert rollup_lead_sources() == 2
+    assert stats() == {
+        ("2023-02-15", "cpc", ""): 2,
+        ("2023-02-17", "cpc", ""): 1,
+        ("2023-02-17", "cpc", "spring"): 2,
+        ("2023-02-01", "email", ""): 1,
+    }
+
+
+@pytest.mark.django_db
+def test_rollup_lead_sources__empty():
+    assert rollup_lead_sources() == 0
+    assert not Checkpoint.objects.exists()
+
+
+@pytest.mark.django_db
+def test_rollup_lead_sources__window():
+    """Check that each window is processed separately."""
+    user = User.objects.create()
+    for days in range(5):
+        create(user, "cpc", NOW - datetime.timedelta(days=days, hours=1))
+    with freezegun.freeze_time(NOW):
+        assert rollup_lead_sources(window=datetime.timedelta(days=2)) == 5
+    assert sum(stats().values()) == 5
+
+
+@pytest.mark.django_db
+def test_rollup_lead_sources_command():
+    user = User.objects.create()
+    create(user, "cpc", NOW - datetime.timedelta(days=1))
+    out = StringIO()
+    with freezegun.freeze_time(NOW):
+        call_command("rollup_lead_sources", "--lag=0", stdout=out)
+    assert out.getvalue() == "Processed 1 lead sources.\n"
+    assert stats() == {("2023-02-16", "cpc", ""): 1}
@@ -1,13 +1,22 @@
 import freezegun
 import pytest
+from asgiref.sync import async_to_sync
 from django.contrib.auth import get_user_model
 from django.contrib.sessions.backends.base import SessionBase
+from django.test import override_settings
 from django.utils.timezone import now as tz_now
 
 from utm_tracker.models import LeadSource
 from utm_tracker.session import (
+    SESSION_KEY_UTM_FINGERPRINTS,
     SESSION_KEY_UTM_PARAMS,
+    adump_utm_params,
+    apop_utm_params,
+    astash_utm_params,
+    decode_stashed_params,
     dump_utm_params,
+    fingerprint_utm_params,
+    pop_utm_params,
     stash_utm_params,
 )
 
@@ -15,6 +24,9 @@ User = get_user_model()
 
 # just need a time to freeze - doesn't matter what it is.
 FROZEN_TIME = tz_now()
+# the compact session encoding stores the timestamp as integer seconds
+FROZEN_EPOCH = int(FROZEN_TIME.timestamp())
+FROZEN_DATETIME = FROZEN_TIME.replace(microsecond=0)
 
 
 @freezegun.freeze_time(FROZEN_TIME)
@@ -25,21 +37,128 @@ def test_stash_utm_params():
     assert stash_utm_params(session, {"utm_medium": "foo"})
     assert session.modified
     assert len(session[SESSION_KEY_UTM_PARAMS]) == 1
+    assert session[SESSION_KEY_UTM_PARAMS][0] == [1, FROZEN_EPOCH, "", "foo"]
+
+    # add a second set of params
+    assert stash_utm_params(session, {"utm_medium": "bar", "tag1": "baz"})
+    assert len(session[SESSION_KEY_UTM_PARAMS]) == 2
+    assert session[SESSION_KEY_UTM_PARAMS][1] == [
+        1,
+        FROZEN_EPOCH,
+        *["", "bar"],
+        *[""] * 8,
+        {"tag1": "baz"},
+    ]
+
+    # add a duplicate set of params
+    assert not stash_utm_params(session, {"utm_medium": "bar", "tag1": "baz"})
+
+
+@freezegun.freeze_time(FROZEN_TIME)
+@override_settings(UTM_TRACKER_COMPACT_SESSION=False)
+def test_stash_utm_params__legacy():
+    session = SessionBase()
+    assert stash_utm_params(session, {"utm_medium": "foo"})
     assert session[SESSION_KEY_UTM_PARAMS][0] == {
         "utm_medium": "foo",
         "timestamp": FROZEN_TIME.isoformat(),
     }
+    # add a duplicate set of params
+    assert not stash_utm_params(session, {"utm_medium": "foo"})
 
-    # add a second set of params
+
+def test_stash_utm_params__mixed_formats():
+    """Check that legacy entries are deduped against compact ones."""
+    session = SessionBase()
+    session[SESSION_KEY_UTM_PARAMS] = [
+        {"utm_medium": "foo", "timestamp": FROZEN_TIME.isoformat()}
+    ]
+    assert not stash_utm_params(session, {"utm_medium": "foo"})
     assert stash_utm_params(session, {"utm_medium": "bar"})
     assert len(session[SESSION_KEY_UTM_PARAMS]) == 2
-    assert session[SESSION_KEY_UTM_PARAMS][1] == {
-        "utm_medium": "bar",
-        "timestamp": FROZEN_TIME.isoformat(),
-    }
 
-    # add a duplicate set of params
+
+def test_stash_utm_params__fingerprints():
+    session = SessionBase()
+    assert stash_utm_params(session, {"utm_medium": "foo"})
+    assert stash_utm_params(session, {"utm_medium": "bar"})
+    assert session[SESSION_KEY_UTM_FINGERPRINTS] == [
+        fingerprint_utm_params({"utm_medium": "foo"}),
+        fingerprint_utm_params({"utm_medium": "bar"}),
+    ]
+    # fingerprints ignore the timestamp
+    assert fingerprint_utm_params(
+        {"utm_medium": "foo", "timestamp": FROZEN_TIME.isoformat()}
+    ) == fingerprint_utm_params({"utm_medium": "foo"})
+
+
+def test_stash_utm_params__fingerprints_out_of_sync():
+    """Check that fingerprints are recalculated if they don't match the params."""
+    session = SessionBase()
+    session[SESSION_KEY_UTM_PARAMS] = [[1, None, "", "foo"], [1, None, "", "bar"]]
+    session[SESSION_KEY_UTM_FINGERPRINTS] = ["xxx"]
     assert not stash_utm_params(session, {"utm_medium": "bar"})
+    assert stash_utm_params(session, {"utm_medium": "baz"})
+    assert len(session[SESSION_KEY_UTM_FINGERPRINTS]) == 3
+
+
+@pytest.mark.parametrize(
+    "policy,mediums,stashed",
+    [
+        ("first", ["0", "1", "2"], [False, False]),
+        ("last", ["2", "3", "4"], [True, True]),
+        ("both", ["0", "3", "4"], [True, True]),
+    ],
+)
+def test_stash_utm_params__eviction(policy, mediums, stashed):
+    session = SessionBase()
+    with (
+        override_settings(UTM_TRACKER_MAX_STASHED_PARAMS=3),
+        override_settings(UTM_TRACKER_EVICTION_POLICY=policy),
+    ):
+        for i in range(3):
+            assert stash_utm_params(session, {"utm_medium": str(i)})
+        assert [
+            stash_utm_params(session, {"utm_medium": str(i)}) for i in range(3, 5)
+        ] == stashed
+    params = decode_stashed_params(session[SESSION_KEY_UTM_PARAMS])
+    assert [p["utm_medium"] for p in params] == mediums
+    assert session[SESSION_KEY_UTM_FINGERPRINTS] == [
+        fingerprint_utm_params({"utm_medium": m}) for m in mediums
+    ]
+
+
+@override_settings(UTM_TRACKER_MAX_STASHED_PARAMS=None)
+def test_stash_utm_params__unlimited():
+    session = SessionBase()
+    for i in range(50):
+        assert stash_utm_params(session, {"utm_medium": str(i)})
+    assert len(session[SESSION_KEY_UTM_PARAMS]) == 50
+
+
+def test_pop_utm_params():
+    session = SessionBase()
+    session[SESSION_KEY_UTM_PARAMS] = [
+        {"utm_medium": "foo", "timestamp": FROZEN_TIME.isoformat()},
+        [1, FROZEN_EPOCH, "src", "bar"],
+    ]
+    assert pop_utm_params(session) == [
+        {"utm_medium": "foo", "timestamp": FROZEN_TIME.isoformat()},
+        {
+            "utm_source": "src",
+            "utm_medium": "bar",
+            "timestamp": FROZEN_DATETIME.isoformat(),
+        },
+    ]
+    assert SESSION_KEY_UTM_PARAMS not in session
+
+
+def test_pop_utm_params__fingerprints():
+    session = SessionBase()
+    stash_utm_params(session, {"utm_medium": "foo"})
+    assert len(pop_utm_params(session)) == 1
+    assert SESSION_KEY_UTM_PARAMS not in session
+    assert SESSION_KEY_UTM_FINGERPRINTS not in session
 
 
 @pytest.mark.django_db
@@ -71,3 +190,69 @@ def test_dump_utm_params__error():
     assert created == [source]
     # session is clean
     assert SESSION_KEY_UTM_PARAMS not in session
+
+
+@pytest.mark.django_db
+def test_dump_utm_params__single_insert(django_assert_num_queries):
+    user = User.objects.create()
+    params_list = [{"utm_medium": f"medium{i}", "utm_source": "src"} for i in range(10)]
+    session = {SESSION_KEY_UTM_PARAMS: params_list}
+    # one INSERT, and one SELECT to fetch the primary keys (in a savepoint,
+    # as the test runs in a transaction)
+    with django_assert_num_queries(4):
+        created = dump_utm_params(user, session)
+    assert len(created) == 10
+    assert list(LeadSource.objects.order_by("id")) == created
+
+
+@pytest.mark.django_db
+def test_dump_utm_params__duplicate():
+    user = User.objects.create()
+    utm_params = {"utm_medium": "medium", "utm_source": "source", "timestamp": None}
+    assert len(dump_utm_params(user, {SESSION_KEY_UTM_PARAMS: [utm_params]})) == 1
+    # already stored, so not created (or returned)
+    assert dump_utm_params(user, {SESSION_KEY_UTM_PARAMS: [utm_params]}) == []
+    assert LeadSource.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_dump_utm_params__empty(django_assert_num_queries):
+    user = User.objects.create()
+    with django_assert_num_queries(0):
+        assert dump_utm_params(user, {}) == []
+
+
+@freezegun.freeze_time(FROZEN_TIME)
+def test_astash_utm_params():
+    session = SessionBase()
+    assert not async_to_sync(astash_utm_params)(session, {})
+
+    assert async_to_sync(astash_utm_params)(session, {"utm_medium": "foo"})
+    assert session.modified
+    assert session[SESSION_KEY_UTM_PARAMS] == [[1, FROZEN_EPOCH, "", "foo"]]
+    # add a duplicate set of params
+    assert not async_to_sync(astash_utm_params)(session, {"utm_medium": "foo"})
+    assert len(session[SESSION_KEY_UTM_PARAMS]) == 1
+
+
+def test_apop_utm_params():
+    session = SessionBase()
+    session[SESSION_KEY_UTM_PARAMS] = [{"utm_medium": "foo"}]
+    assert async_to_sync(apop_utm_params)(session) == [{"utm_medium": "foo"}]
+    assert SESSION_KEY_UTM_PARAMS not in session
+    assert async_to_sync(apop_utm_params)(session) == []
+
+
+@pytest.mark.django_db
+def test_adump_utm_params():
+    user = User.objects.create()
+    session = SessionBase()
+    session[SESSION_KEY_UTM_PARAMS] = [
+        {"utm_mediumx": "medium1", "utm_source": "source1"},
+        {"utm_medium": "medium2", "utm_source": "source2"},
+    ]
+    created = async_to_sync(adump_utm_params)(user, session)
+    source = LeadSource.objects.get()
+    assert source.medium == "medium2"
+    assert created == [source]
+    assert SESSION_KEY_UTM_PARAMS not in session
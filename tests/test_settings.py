@@ -0,0 +1,41 @@
+from django.test import override_settings
+
+from utm_tracker.settings import (
+    TrackerConfig,
+    get_config,
+    lowercase_value,
+    raw_value,
+)
+
+
+def test_get_config():
+    config = get_config()
+    assert isinstance(config, TrackerConfig)
+    assert get_config() is config
+    assert config.custom_tags == ["mytag"]
+    assert config.tracked_keys >= {"utm_source", "gclid", "mytag"}
+    assert config.key_handlers["utm_source"] == ("utm_source", lowercase_value)
+    assert config.key_handlers["gclid"] == ("gclid", raw_value)
+
+
+def test_get_config__setting_changed():
+    config = get_config()
+    with override_settings(UTM_TRACKER_CUSTOM_TAGS=["tag1"]):
+        assert get_config() is not config
+        assert get_config().custom_tags == ["tag1"]
+        assert "mytag" not in get_config().tracked_keys
+        assert get_config().tracked_keys_pattern.search("tag1=foo")
+    assert get_config().custom_tags == ["mytag"]
+
+
+def test_get_config__other_setting_changed():
+    config = get_config()
+    with override_settings(SESSION_COOKIE_AGE=60):
+        assert get_config() is config
+
+
+@override_settings(UTM_TRACKER_CASE_INSENSITIVE_KEYS=True)
+def test_get_config__case_insensitive_keys():
+    config = get_config()
+    assert config.key_handlers["mytag"][0] == "mytag"
+    assert config.tracked_keys_pattern.search("UTM_Source=foo")
@@ -0,0 +1,148 @@
+import json
+import logging
+from unittest import mock
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test import override_settings
+
+from utm_tracker.models import LeadSource, LeadSourceTag
+from utm_tracker.sinks import (
+    DatabaseSink,
+    JsonLinesSink,
+    LeadSourceSink,
+    LoggingSink,
+    awrite_lead_sources,
+    load_sink,
+    write_lead_sources,
+)
+
+User = get_user_model()
+
+
+def build(user, count):
+    return [
+        LeadSource.objects.build_from_utm_params(
+            user,
+            {"utm_medium": f"medium{i}", "utm_source": "source", "tag1": "foo"},
+        )
+        for i in range(count)
+    ]
+
+
+def test_load_sink():
+    sink = load_sink(
+        {
+            "BACKEND": "utm_tracker.sinks.JsonLinesSink",
+            "OPTIONS": {"path": "leads.jsonl"},
+        }
+    )
+    assert isinstance(sink, JsonLinesSink)
+    assert sink.path == "leads.jsonl"
+
+
+def test_sink__abstract():
+    # sinks must implement write
+    with pytest.raises(TypeError):
+        type("BrokenSink", (LeadSourceSink,), {})()
+
+
+@pytest.mark.django_db
+def test_database_sink(django_assert_num_queries):
+    user = User.objects.create()
+    # INSERT, in a savepoint as the test runs in a transaction
+    with django_assert_num_queries(3):
+        DatabaseSink().write(build(user, 3))
+    assert LeadSource.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_database_sink__async():
+    user = User.objects.create()
+    lead_sources = build(user, 3)
+    with mock.patch.object(
+        LeadSource.objects, "bulk_create_ignore_duplicates"
+    ) as mock_create:
+        async_to_sync(DatabaseSink().awrite)(lead_sources)
+    mock_create.assert_not_called()
+    # duplicates are ignored
+    async_to_sync(DatabaseSink().awrite)(lead_sources)
+    assert LeadSource.objects.count() == 3
+
+
+@pytest.mark.django_db
+@override_settings(UTM_TRACKER_INDEXED_TAGS=["tag1"])
+def test_database_sink__async_indexed():
+    user = User.objects.create()
+    async_to_sync(DatabaseSink().awrite)(build(user, 3))
+    assert LeadSourceTag.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_json_lines_sink(tmp_path):
+    user = User.objects.create()
+    path = tmp_path / "leads.jsonl"
+    sink = JsonLinesSink(str(path))
+    sink.write(build(user, 2))
+    sink.write(build(user, 1))
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [r["medium"] for r in records] == ["medium0", "medium1", "medium0"]
+    assert records[0]["user_id"] == user.id
+    assert records[0]["custom_tags"] == {"tag1": "foo"}
+    assert not LeadSource.objects.exists()
+
+
+@pytest.mark.django_db
+def test_logging_sink(caplog):
+    user = User.objects.create()
+    with caplog.at_level(logging.INFO, logger="utm_tracker.leads"):
+        LoggingSink().write(build(user, 2))
+    assert len(caplog.records) == 2
+    assert caplog.records[0].lead["medium"] == "medium0"
+    assert json.loads(caplog.records[1].message)["medium"] == "medium1"
+
+
+@pytest.mark.django_db
+def test_write_lead_sources__error():
+    """Check that a failing sink does not stop the others."""
+    user = User.objects.create()
+    broken = mock.Mock(spec=LeadSourceSink)
+    broken.write.side_effect = Exception("Panic")
+    lead_sources = build(user, 2)
+    with mock.patch(
+        "utm_tracker.sinks.get_sinks", return_value=[broken, DatabaseSink()]
+    ):
+        write_lead_sources(lead_sources)
+    broken.write.assert_called_once_with(lead_sources)
+    assert LeadSource.objects.count() == 2
+
+
+def fail(*args):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT * FROM no_such_table")
+
+
+@pytest.mark.django_db
+def test_write_lead_sources__database_error():
+    """Check that a database error does not break the caller's transaction."""
+    user = User.objects.create()
+    with (
+        transaction.atomic(),
+        mock.patch.object(LeadSource.objects, "fetch_stored", side_effect=fail),
+    ):
+        assert write_lead_sources(build(user, 2), fetch_pks=True) == []
+        # the INSERT was rolled back, and the transaction can still be used
+        assert not LeadSource.objects.exists()
+
+
+@pytest.mark.django_db
+def test_awrite_lead_sources():
+    user = User.objects.create()
+    sink = mock.Mock(spec=LeadSourceSink)
+    lead_sources = build(user, 2)
+    with mock.patch("utm_tracker.sinks.get_sinks", return_value=[sink]):
+        async_to_sync(awrite_lead_sources)(lead_sources)
+    sink.awrite.assert_awaited_once_with(lead_sources)
+    assert not LeadSource.objects.exists()
@@ -0,0 +1,120 @@
+from io import StringIO
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import override_settings
+
+from utm_tracker.models import LeadSource, LeadSourceTag
+from utm_tracker.tags import index_custom_tags
+
+User = get_user_model()
+
+UTM_PARAMS = {"utm_medium": "cpc", "utm_source": "google"}
+
+
+@pytest.fixture
+def user():
+    return User.objects.create(username="Bob")
+
+
+@pytest.fixture
+def indexed():
+    with override_settings(UTM_TRACKER_INDEXED_TAGS=["mytag"]):
+        yield
+
+
+def create(user, **custom_tags):
+    return LeadSource.objects.create_from_utm_params(
+        user, {**UTM_PARAMS, **custom_tags}
+    )
+
+
+@pytest.mark.django_db
+class TestIndexCustomTags:
+    def test_create_from_utm_params(self, user, indexed):
+        lead_source = create(user, mytag="foo")
+        tag = LeadSourceTag.objects.get()
+        assert tag.lead_source == lead_source
+        assert (tag.name, tag.value) == ("mytag", "foo")
+
+    def test_create_from_utm_params__duplicate(self, user, indexed):
+        create(user, mytag="foo")
+        create(user, mytag="foo")
+        assert LeadSourceTag.objects.count() == 1
+
+    def test_not_indexed(self, user):
+        create(user, mytag="foo")
+        assert not LeadSourceTag.objects.exists()
+
+    def test_bulk_create_ignore_duplicates(self, user, indexed):
+        lead_sources = [
+            LeadSource.objects.build_from_utm_params(user, {**UTM_PARAMS, "mytag": v})
+            for v in ("foo", "bar")
+        ]
+        LeadSource.objects.bulk_create_ignore_duplicates(lead_sources)
+        assert set(LeadSourceTag.objects.values_list("lead_source", "value")) == {
+            (lead_sources[0].pk, "foo"),
+            (lead_sources[1].pk, "bar"),
+        }
+
+    def test_value_truncated(self, user, indexed):
+        create(user, mytag="x" * 300)
+        assert LeadSourceTag.objects.get().value == "x" * 255
+
+    def test_index_existing(self, user):
+        create(user, mytag="foo")
+        create(user, mytag="bar")
+        create(user)
+        with override_settings(UTM_TRACKER_INDEXED_TAGS=["mytag"]):
+            assert index_custom_tags(chunk_size=1) == 2
+            # re-running is safe
+            assert index_custom_tags() == 2
+        assert sorted(LeadSourceTag.objects.values_list("value", flat=True)) == [
+            "bar",
+            "foo",
+        ]
+
+    def test_index_existing__disabled(self, user):
+        create(user, mytag="foo")
+        assert index_custom_tags() == 0
+        assert not LeadSourceTag.objects.exists()
+
+    def test_command(self, user, indexed):
+        LeadSource.objects.bulk_create(
+            [
+                LeadSource.objects.build_from_utm_params(
+                    user, {**UTM_PARAMS, "mytag": "foo"}
+                )
+            ]
+        )
+        out = StringIO()
+        call_command("index_custom_tags", stdout=out)
+        assert out.getvalue().strip() == "Indexed 1 lead sources."
+        assert LeadSourceTag.objects.get().value == "foo"
+
+
+@pytest.mark.django_db
+class TestWithCustomTag:
+    def test_indexed(self, user, indexed):
+        lead_source = create(user, mytag="foo")
+        create(user, mytag="bar")
+        queryset = LeadSource.objects.with_custom_tag("mytag", "foo")
+        assert "utm_tracker_leadsourcetag" in str(queryset.query)
+        assert list(queryset) == [lead_source]
+
+    def test_not_indexed(self, user):
+        lead_source = create(user, mytag="foo")
+        create(user, mytag="bar")
+        queryset = LeadSource.objects.with_custom_tag("mytag", "foo")
+        assert "utm_tracker_leadsourcetag" not in str(queryset.query)
+        assert list(queryset) == [lead_source]
+
+    def test_indexed__long_value(self, user, indexed):
+        lead_source = create(user, mytag="x" * 300)
+        # same (truncated) indexed value
+        create(user, mytag="x" * 299)
+        assert list(LeadSource.objects.with_custom_tag("mytag", "x" * 300)) == [
+            lead_source
+        ]
+        assert not LeadSource.objects.with_custom_tag("mytag", "x" * 255).exists()
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from django.urls import path
+from django.urls import include, path
 from django.views import debug
 
 from .views import test_view_200, test_view_301, test_view_302
@@ -9,6 +9,7 @@ admin.autodiscover()
 urlpatterns = [
     path("", debug.default_urlconf),
     path("admin/", admin.site.urls),
+    path("utm/", include("utm_tracker.urls")),
     path("200/", test_view_200, name="test_view_200"),
     path("301/", test_view_301, name="test_view_301"),
     path("302/", test_view_302, name="test_view_302"),
@@ -1,14 +1,195 @@
 from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.http import HttpRequest
+from django.utils.functional import cached_property
 
-from .models import LeadSource
+from .models import (
+    LandingDailyStat,
+    LeadSource,
+    LeadSourceDailyStat,
+    dimension_lookups,
+    dimension_q,
+)
+from .settings import get_config
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that avoids COUNT(*) on large, unfiltered PostgreSQL tables.
+
+    If the queryset is unfiltered, and the planner's estimate of the table
+    size (pg_class.reltuples) is above the threshold, then the estimate is
+    used as the count. Otherwise (filtered querysets, small tables, other
+    databases) the exact count is used.
+
+    """
+
+    threshold = 100_000
+
+    @cached_property
+    def count(self) -> int:
+        if (estimate := self.estimated_count()) is not None:
+            return estimate
+        return super().count
+
+    def estimated_count(self) -> int | None:
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet) or queryset.query.where:
+            return None
+        connection = connections[queryset.db]
+        if connection.vendor != "postgresql":
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples FROM pg_class WHERE relname = %s",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        if row is None or row[0] < self.threshold:
+            return None
+        return int(row[0])
+
+
+class DimensionListFilter(admin.SimpleListFilter):
+    """
+    Filter on a medium or source value.
+
+    The default field filter runs SELECT DISTINCT over the whole LeadSource
+    table on every page load, so the choices are read from the (much
+    smaller) LeadSourceDailyStat table instead. Values that have not been
+    rolled up yet are not listed, but can still be searched for.
+
+    """
+
+    dimension: str
+    max_choices = 100
+
+    def lookups(
+        self, request: HttpRequest, model_admin: admin.ModelAdmin
+    ) -> list[tuple[str, str]]:
+        values = (
+            LeadSourceDailyStat.objects.order_by(self.dimension)
+            .values_list(self.dimension, flat=True)
+            .distinct()[: self.max_choices]
+        )
+        return [(value, value) for value in values]
+
+    def has_output(self) -> bool:
+        # always apply the filter, even if the stats are empty
+        return True
+
+    def queryset(self, request: HttpRequest, queryset: QuerySet) -> QuerySet:
+        if value := self.value():
+            # the value may be stored in UtmDimension
+            return queryset.filter(dimension_q(self.dimension, value))
+        return queryset
+
+
+class MediumListFilter(DimensionListFilter):
+    title = "medium"
+    parameter_name = dimension = "medium"
+
+
+class SourceListFilter(DimensionListFilter):
+    title = "source"
+    parameter_name = dimension = "source"
 
 
 class LeadSourceAdmin(admin.ModelAdmin):
     raw_id_fields = ("user",)
-    list_display = ("user", "medium", "source", "campaign", "timestamp")
-    search_fields = ("user__first_name", "user__last_name", "term", "content")
-    list_filter = ("medium", "source", "timestamp")
+    list_display = ("user", "utm_medium", "utm_source", "utm_campaign", "timestamp")
+    search_help_text = "Exact username, or the start of the source or medium."
+    # NB no date_hierarchy - it runs SELECT DISTINCT over the whole table
+    list_filter = (MediumListFilter, SourceListFilter, "timestamp")
     readonly_fields = ("created_at", "timestamp")
+    paginator = EstimatedCountPaginator
+    # don't run a second COUNT(*) of the whole table when filtering
+    show_full_result_count = False
+
+    # medium, source and campaign may be stored in UtmDimension
+    @admin.display(description="medium")
+    def utm_medium(self, obj: LeadSource) -> str:
+        return obj.utm_medium
+
+    @admin.display(description="source")
+    def utm_source(self, obj: LeadSource) -> str:
+        return obj.utm_source
+
+    @admin.display(description="campaign")
+    def utm_campaign(self, obj: LeadSource) -> str:
+        return obj.utm_campaign
+
+    def get_list_select_related(self, request: HttpRequest) -> tuple[str, ...]:
+        if get_config().normalize_dimensions:
+            # load the UtmDimension values with the page, rather than one
+            # query per value (if they are not already cached)
+            return ("user", "medium_ref", "source_ref", "campaign_ref")
+        return ("user",)
+
+    def get_search_fields(self, request: HttpRequest) -> tuple[str, ...]:
+        # the user model is swappable, and may not have a username field
+        username = get_user_model().USERNAME_FIELD
+        return (f"=user__{username}", "^source", "^medium")
+
+    def get_search_results(
+        self, request: HttpRequest, queryset: QuerySet, search_term: str
+    ) -> tuple[QuerySet, bool]:
+        """
+        Search only on indexed columns.
+
+        The default admin search uses case-insensitive "contains" lookups,
+        which cannot use an index - and ORing conditions on different
+        columns prevents the use of any of their indexes. So each condition
+        is run as a separate (indexed) subquery, and the matching ids are
+        combined using UNION.
+
+        utm_source and utm_medium values are stored in lowercase, so a
+        case-sensitive prefix match on the lowercased term is equivalent.
+
+        """
+        if not (term := search_term.strip()):
+            return queryset, False
+        user_model = get_user_model()
+        users = user_model._default_manager.filter(**{user_model.USERNAME_FIELD: term})
+        conditions = [Q(user__in=users.values("pk"))]
+        for name in ("source", "medium"):
+            # source and medium may be stored in UtmDimension
+            _, *refs = dimension_lookups(name, term.lower(), "startswith")
+            conditions += [self.prefix_q(queryset.db, name, term.lower()), *refs]
+        first, *rest = [
+            LeadSource.objects.using(queryset.db).filter(q).values("pk")
+            for q in conditions
+        ]
+        return queryset.filter(pk__in=first.union(*rest)), False
+
+    def prefix_q(self, using: str, name: str, prefix: str) -> Q:
+        """Return an (indexable) filter on the start of a column value."""
+        if connections[using].vendor == "sqlite":
+            # LIKE is case-insensitive in SQLite, so cannot use an index on
+            # a case-sensitive column - but the equivalent range can.
+            return Q(**{f"{name}__gte": prefix, f"{name}__lt": prefix + "\U0010ffff"})
+        return Q(**{f"{name}__startswith": prefix})
 
 
 admin.site.register(LeadSource, LeadSourceAdmin)
+
+
+class LeadSourceDailyStatAdmin(admin.ModelAdmin):
+    list_display = ("date", "source", "medium", "campaign", "count")
+    list_filter = ("date", "medium", "source")
+    search_fields = ("campaign",)
+    date_hierarchy = "date"
+    readonly_fields = ("date", "source", "medium", "campaign", "count", "updated_at")
+
+
+admin.site.register(LeadSourceDailyStat, LeadSourceDailyStatAdmin)
+
+
+class LandingDailyStatAdmin(LeadSourceDailyStatAdmin):
+    pass
+
+
+admin.site.register(LandingDailyStat, LandingDailyStatAdmin)
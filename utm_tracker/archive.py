@@ -0,0 +1,120 @@
+"""
+Archive old LeadSource objects to gzipped JSON Lines files, and restore them.
+
+Objects created before a cutoff are read in chunks of primary keys. Each
+chunk is appended to the archive file (as a separate gzip member, which
+gzip readers treat as a single stream), flushed to disk, and then deleted
+from the table - along with the checkpoint update - in a short
+transaction. If the job is interrupted it resumes from the checkpoint;
+at worst the last chunk appears in the archive twice, and duplicates are
+ignored on restore.
+
+"""
+
+from __future__ import annotations
+
+import datetime
+import gzip
+import json
+import os
+from typing import Iterator
+
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from .models import Checkpoint, LeadSource
+from .settings import get_config
+
+CHECKPOINT_NAME = "leadsource_archive"
+
+
+def get_resume_pk(before: datetime.datetime) -> int:
+    """
+    Return the last primary key archived by a previous run with the same cutoff.
+
+    The checkpoint is only valid for the same cutoff - a later cutoff may
+    include objects with lower primary keys that were previously skipped.
+
+    """
+    checkpoint = Checkpoint.objects.filter(name=CHECKPOINT_NAME).first()
+    if not (checkpoint and checkpoint.value):
+        return 0
+    cutoff, last_pk = checkpoint.value.rsplit("|", 1)
+    return int(last_pk) if parse_datetime(cutoff) == before else 0
+
+
+def write_chunk(path: str, lead_sources: list[LeadSource]) -> None:
+    """Append the objects to the archive file, and flush them to disk."""
+    with open(path, "ab") as f:
+        with gzip.GzipFile(fileobj=f, mode="wb") as gz:
+            for lead_source in lead_sources:
+                record = json.dumps(lead_source.to_dict(), separators=(",", ":"))
+                gz.write(record.encode() + b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def archive_lead_sources(
+    path: str, before: datetime.datetime, chunk_size: int = 1000
+) -> int:
+    """
+    Move LeadSource objects created before the cutoff into the archive file.
+
+    Returns the number of LeadSource objects archived.
+
+    """
+    queryset = LeadSource.objects.filter(created_at__lt=before)
+    archived = 0
+    for chunk in queryset.chunked(chunk_size, after=get_resume_pk(before)):
+        write_chunk(path, chunk)
+        with transaction.atomic():
+            LeadSource.objects.filter(pk__in=[ls.pk for ls in chunk]).delete()
+            Checkpoint.objects.update_or_create(
+                name=CHECKPOINT_NAME,
+                defaults={"value": f"{before.isoformat()}|{chunk[-1].pk}"},
+            )
+        archived += len(chunk)
+    return archived
+
+
+def read_archive(path: str, batch_size: int = 1000) -> Iterator[list[LeadSource]]:
+    """
+    Yield batches of (unsaved) LeadSource objects from an archive file.
+
+    The archive contains the medium, source and campaign values (see
+    LeadSource.to_dict) - they are normalized again if required.
+
+    """
+    normalize = get_config().normalize_dimensions
+    batch = []
+    with gzip.open(path, "rt") as f:
+        for line in f:
+            if line.strip():
+                lead_source = LeadSource(**json.loads(line))
+                if normalize:
+                    lead_source.normalize_dimensions()
+                batch.append(lead_source)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def restore_lead_sources(path: str, batch_size: int = 1000) -> int:
+    """
+    Restore LeadSource objects from an archive file, with their original ids.
+
+    Objects that are already in the table are ignored, so it is safe to
+    restore the same file more than once.
+
+    Returns the number of LeadSource objects read from the archive.
+
+    """
+    restored = 0
+    for batch in read_archive(path, batch_size):
+        with transaction.atomic():
+            LeadSource.objects.bulk_create(batch, ignore_conflicts=True)
+            LeadSource.objects.index_custom_tags(batch)
+        restored += len(batch)
+    return restored
@@ -0,0 +1,246 @@
+"""
+Bulk import of historical lead data from CSV or JSON Lines files.
+
+Each record contains the user (a "user_id" or "email" column), the utm_*
+params, ad click ids and custom tags, and an optional "timestamp" of the
+event. The export format (see export.py) can be re-imported, so the
+unprefixed "medium", "source" etc. column names are also accepted. Any
+other columns are ignored.
+
+Records are processed in batches - the users for the whole batch are
+resolved in (at most) two queries, the LeadSource objects are built using
+the same rules as create_from_utm_params, and saved with a single bulk
+INSERT. Records that have already been imported (or recorded by the
+middleware) are skipped, so re-running an import is safe.
+
+"""
+
+from __future__ import annotations
+
+import csv
+import dataclasses
+import json
+import time
+from typing import Any, Callable, Iterator
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import LeadSource
+from .request import VALID_UTM_PARAMS
+from .settings import get_config
+from .types import UtmParamsDict
+
+# export column names -> utm param names
+ALIASES = {name.removeprefix("utm_"): name for name in VALID_UTM_PARAMS}
+
+# (line number, record) - record is None if the line could not be parsed
+Row = tuple[int, dict[str, Any] | None]
+
+
+@dataclasses.dataclass
+class BackfillStats:
+    read: int = 0
+    created: int = 0
+    duplicates: int = 0
+    rejected: int = 0
+    started_at: float = dataclasses.field(default_factory=time.monotonic)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def rate(self) -> float:
+        """Return the number of records processed per second."""
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+
+def read_records(path: str, fmt: str) -> Iterator[Row]:
+    """Yield (line number, record) for each record in a CSV or JSONL file."""
+    with open(path, newline="") as f:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            for values in reader:
+                yield reader.line_num, values
+            return
+        for line_num, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record: Any
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield line_num, record if isinstance(record, dict) else None
+
+
+def parse_timestamp(value: str) -> str:
+    """Return the timestamp as an ISO string - naive values are made aware."""
+    try:
+        timestamp = parse_datetime(value)
+    except ValueError:
+        timestamp = None
+    if not timestamp:
+        raise ValueError(f"Invalid timestamp: {value}")
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+    return timestamp.isoformat()
+
+
+def to_utm_params(record: dict[str, Any]) -> UtmParamsDict:
+    """
+    Return the utm_params dict from a record.
+
+    The values are cleaned in the same way as those in a querystring (see
+    request.parse_qs) - empty values are ignored, utm_* values are
+    lowercased and only the configured custom tags are included.
+
+    """
+    values = dict(record)
+    if isinstance(custom_tags := values.pop("custom_tags", None), dict):
+        values = {**custom_tags, **values}
+    config = get_config()
+    params: UtmParamsDict = {}
+    for key, value in values.items():
+        key = ALIASES.get(key, key)
+        if value is None or value == "":
+            continue
+        if key in config.utm_params:
+            params[key] = str(value).lower()
+        elif key in config.tracked_keys:
+            params[key] = str(value)
+        elif key == "timestamp":
+            params[key] = parse_timestamp(str(value))
+    return params
+
+
+def resolve_user_ids(user_ids: set[str]) -> dict[tuple[str, str], Any]:
+    """Return a map of ("user_id", value) to pk for the users that exist."""
+    User = get_user_model()  # noqa: N806
+    pks = set()
+    for user_id in user_ids:
+        try:
+            pks.add(User._meta.pk.to_python(user_id))
+        except ValidationError:
+            pass
+    users = User.objects.filter(pk__in=pks).values_list("pk", flat=True)
+    return {("user_id", str(pk)): pk for pk in users}
+
+
+def resolve_emails(emails: set[str]) -> dict[tuple[str, str], Any]:
+    """Return a map of ("email", value) to pk for emails used by one user."""
+    User = get_user_model()  # noqa: N806
+    email_field = User.get_email_field_name()
+    matches: dict[str, list[Any]] = {}
+    users = User.objects.filter(**{f"{email_field}__in": emails})
+    for pk, email in users.values_list("pk", email_field):
+        matches.setdefault(email, []).append(pk)
+    return {("email", e): pks[0] for e, pks in matches.items() if len(pks) == 1}
+
+
+def resolve_users(records: list[dict[str, Any]]) -> dict[tuple[str, str], Any]:
+    """
+    Return a map of ("user_id" | "email", value) to user pk for the records.
+
+    Users are fetched in bulk, with one query for ids and one for emails.
+    Values that do not match exactly one user are not included.
+
+    """
+    keys = set()
+    for record in records:
+        try:
+            keys.add(get_user_key(record))
+        except ValueError:
+            pass
+    user_ids = {value for kind, value in keys if kind == "user_id"}
+    emails = {value for kind, value in keys if kind == "email"}
+    users = {}
+    if user_ids:
+        users.update(resolve_user_ids(user_ids))
+    if emails:
+        users.update(resolve_emails(emails))
+    return users
+
+
+def get_user_key(record: dict[str, Any]) -> tuple[str, str]:
+    if user_id := record.get("user_id"):
+        return ("user_id", str(user_id))
+    if email := record.get("email"):
+        return ("email", str(email))
+    raise ValueError("Missing user_id or email")
+
+
+def import_batch(
+    rows: list[Row],
+    stats: BackfillStats,
+    on_reject: Callable[[int, str], None] | None = None,
+) -> None:
+    """Build and save the LeadSource objects for a batch of records."""
+    User = get_user_model()  # noqa: N806
+    users = resolve_users([record for _, record in rows if record])
+    lead_sources: dict[str, LeadSource] = {}
+    for line_num, record in rows:
+        stats.read += 1
+        try:
+            if record is None:
+                raise ValueError("Invalid record")
+            key = get_user_key(record)
+            if key not in users:
+                raise ValueError(f"Unknown user: {key[1]}")
+            lead_source = LeadSource.objects.build_from_utm_params(
+                User(pk=users[key]), to_utm_params(record)
+            )
+        except ValueError as ex:
+            stats.rejected += 1
+            if on_reject:
+                on_reject(line_num, str(ex))
+            continue
+        if lead_source.fingerprint in lead_sources:
+            stats.duplicates += 1
+        else:
+            lead_sources[lead_source.fingerprint] = lead_source
+    with transaction.atomic():
+        existing = set(
+            LeadSource.objects.filter(fingerprint__in=lead_sources).values_list(
+                "fingerprint", flat=True
+            )
+        )
+        new = [ls for fp, ls in lead_sources.items() if fp not in existing]
+        LeadSource.objects.bulk_create_ignore_duplicates(new)
+    stats.created += len(new)
+    stats.duplicates += len(existing)
+
+
+def backfill_lead_sources(
+    path: str,
+    fmt: str,
+    batch_size: int = 1000,
+    on_reject: Callable[[int, str], None] | None = None,
+    on_batch: Callable[[BackfillStats], None] | None = None,
+) -> BackfillStats:
+    """
+    Import LeadSource objects from a CSV or JSON Lines ("jsonl") file.
+
+    The optional on_reject callback is called with the line number and
+    reason for each rejected record, and on_batch with the stats after
+    each batch is saved.
+
+    """
+    stats = BackfillStats()
+    batch: list[Row] = []
+    for row in read_records(path, fmt):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            import_batch(batch, stats, on_reject)
+            batch = []
+            if on_batch:
+                on_batch(stats)
+    if batch:
+        import_batch(batch, stats, on_reject)
+        if on_batch:
+            on_batch(stats)
+    return stats
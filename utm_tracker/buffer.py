@@ -0,0 +1,173 @@
+"""
+Write-behind buffer for LeadSource objects.
+
+If UTM_TRACKER_WRITE_BEHIND is enabled, dump_utm_params puts validated (but
+unsaved) LeadSource objects onto an in-process queue, and returns without
+waiting for the INSERT. A background thread drains the queue, writing the
+objects in batches to the configured sinks (see sinks.py). A batch is
+written when it reaches the batch size, or when the oldest object in it
+has waited for the flush interval, whichever comes first. Anything left in
+the queue is written when the process exits.
+
+NB objects in the queue are lost if the process is killed - this is a
+trade-off between request latency and durability, which is why the mode
+is disabled by default.
+
+"""
+
+from __future__ import annotations
+
+import atexit
+import os
+import queue
+import threading
+import time
+
+from django.db import close_old_connections
+
+from .models import LeadSource
+from .settings import get_config
+from .sinks import write_lead_sources
+
+# put on the queue to wake the worker thread up when stopping
+STOP = object()
+
+
+class LeadSourceBuffer:
+    """
+    Bounded in-process queue of LeadSource objects, and its worker thread.
+
+    The queue size, batch size and flush interval are read from the
+    UTM_TRACKER_WRITE_BEHIND_* settings on each use (so that changes to
+    the settings take effect), unless they are passed in.
+
+    """
+
+    def __init__(
+        self,
+        max_size: int | None = None,
+        batch_size: int | None = None,
+        flush_interval: float | None = None,
+    ) -> None:
+        self._max_size = max_size
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        # the size limit is enforced by put, so that it can change
+        self.queue: queue.Queue = queue.Queue()
+        self.thread: threading.Thread | None = None
+        self.pid: int | None = None
+        self.lock = threading.Lock()
+
+    @property
+    def max_size(self) -> int:
+        if self._max_size is None:
+            return get_config().write_behind_queue_size
+        return self._max_size
+
+    @property
+    def batch_size(self) -> int:
+        if self._batch_size is None:
+            return get_config().write_behind_batch_size
+        return self._batch_size
+
+    @property
+    def flush_interval(self) -> float:
+        if self._flush_interval is None:
+            return get_config().write_behind_flush_interval
+        return self._flush_interval
+
+    def start(self) -> None:
+        """Start the worker thread, if it's not already running."""
+        with self.lock:
+            if self.pid == os.getpid() and self.thread and self.thread.is_alive():
+                return
+            if self.pid != os.getpid():
+                # this is a new (forked) process - the queue belongs to
+                # the parent and the worker thread doesn't exist here.
+                self.queue = queue.Queue()
+                if self.pid is None:
+                    atexit.register(self.stop)
+            self.pid = os.getpid()
+            self.thread = threading.Thread(
+                target=self.run, name="utm-tracker-write-behind", daemon=True
+            )
+            self.thread.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        """Stop the worker thread and save anything left in the queue."""
+        if self.thread and self.thread.is_alive():
+            self.queue.put(STOP)
+            self.thread.join(timeout)
+        self.flush()
+
+    def put(self, lead_sources: list[LeadSource]) -> list[LeadSource]:
+        """
+        Add objects to the queue, to be saved by the worker thread.
+
+        Returns a list of the objects that could not be queued because
+        the queue was full - it's up to the caller to save these.
+
+        """
+        self.start()
+        max_size = self.max_size
+        for i, lead_source in enumerate(lead_sources):
+            # NB qsize is approximate, so the limit is not exact
+            if self.queue.qsize() >= max_size:
+                return lead_sources[i:]
+            self.queue.put_nowait(lead_source)
+        return []
+
+    def get_batch(self) -> tuple[list[LeadSource], bool]:
+        """
+        Block until there is a batch to save.
+
+        Returns the batch, and a bool that is True if the STOP sentinel
+        was read from the queue.
+
+        """
+        batch: list[LeadSource] = []
+        deadline: float | None = None
+        while len(batch) < self.batch_size:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is STOP:
+                return batch, True
+            batch.append(item)
+            # the clock starts when the first object in the batch arrives
+            deadline = deadline or time.monotonic() + self.flush_interval
+        return batch, False
+
+    def run(self) -> None:
+        stopped = False
+        while not stopped:
+            batch, stopped = self.get_batch()
+            self.save(batch)
+
+    def flush(self) -> None:
+        """Save everything in the queue, in the calling thread."""
+        batch: list[LeadSource] = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not STOP:
+                batch.append(item)
+        for i in range(0, len(batch), self.batch_size):
+            self.save(batch[i : i + self.batch_size])
+
+    def save(self, batch: list[LeadSource]) -> None:
+        if not batch:
+            return
+        try:
+            write_lead_sources(batch)
+        finally:
+            close_old_connections()
+
+
+lead_source_buffer = LeadSourceBuffer()
@@ -0,0 +1,156 @@
+"""
+Cookie-only storage for stashed utm_params.
+
+If UTM_TRACKER_STASH_COOKIE is set, then stashed params are stored in a
+signed cookie of that name, rather than in the session, so that tagged
+landings from anonymous visitors require no session (and no database or
+cache write). The cookie contains the list of stashed params, in the
+compact encoding (see encoding.py), serialized using django.core.signing
+(JSON, compressed and base64-encoded), and signed with SECRET_KEY.
+
+The same deduplication and eviction rules apply as for the session, and
+in addition entries are evicted if the cookie would be larger than
+UTM_TRACKER_STASH_COOKIE_MAX_SIZE bytes.
+
+"""
+
+from __future__ import annotations
+
+from typing import Any, List
+
+from django.conf import settings
+from django.core import signing
+from django.http import HttpRequest, HttpResponse
+
+from . import metrics
+from .models import LeadSource
+from .session import (
+    StashedUtmParams,
+    abuild_lead_sources,
+    apersist_lead_sources,
+    append_utm_params,
+    build_lead_sources,
+    decode_stashed_params,
+    evict_utm_params,
+    get_fingerprints,
+    persist_lead_sources,
+)
+from .settings import get_config
+from .types import UtmParamsDict
+
+COOKIE_SALT = "utm_tracker.cookie"
+
+
+def encode_cookie(stashed: StashedUtmParams) -> str:
+    return signing.dumps(stashed, salt=COOKIE_SALT, compress=True)
+
+
+def decode_cookie(value: str) -> StashedUtmParams:
+    """Return the stashed params from a cookie value ([] if it is invalid)."""
+    try:
+        stashed = signing.loads(
+            value, salt=COOKIE_SALT, max_age=settings.SESSION_COOKIE_AGE
+        )
+    except signing.BadSignature:
+        return []
+    return stashed if isinstance(stashed, list) else []
+
+
+class CookieStash:
+    """
+    The params stashed in the cookie for a single request.
+
+    The cookie is read when the object is created, and any changes are
+    written to the response by update_response.
+
+    """
+
+    def __init__(self, request: HttpRequest) -> None:
+        self.name: str = get_config().stash_cookie or ""
+        self.in_request = self.name in request.COOKIES
+        value = request.COOKIES.get(self.name)
+        self.stashed = decode_cookie(value) if value else []
+        self.modified = False
+
+    def __bool__(self) -> bool:
+        return bool(self.stashed)
+
+    def add(self, params: UtmParamsDict) -> bool:
+        """
+        Add new params to the stash, if they are not already in it.
+
+        Returns True if the params are stored.
+
+        """
+        if not params:
+            return False
+        fingerprints = get_fingerprints(self.stashed, None)
+        if not append_utm_params(self.stashed, fingerprints, params):
+            return False
+        self.modified = True
+        fingerprint = fingerprints[-1]
+        max_size = get_config().stash_cookie_max_size
+        while self.stashed and len(encode_cookie(self.stashed)) > max_size:
+            limit = len(self.stashed) - 1
+            metrics.incr("evicted", evict_utm_params(self.stashed, fingerprints, limit))
+        return fingerprint in fingerprints
+
+    def pop(self) -> List[UtmParamsDict]:
+        """Remove and return (decoded) all of the stashed params."""
+        stashed, self.stashed = self.stashed, []
+        self.modified = self.modified or bool(stashed)
+        return decode_stashed_params(stashed)
+
+    def update_response(self, response: HttpResponse) -> None:
+        """Set (or delete) the cookie on the response, if the stash has changed."""
+        if not self.modified:
+            return
+        self.modified = False
+        if self.stashed:
+            response.set_cookie(
+                self.name,
+                encode_cookie(self.stashed),
+                max_age=settings.SESSION_COOKIE_AGE,
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True,
+                samesite="Lax",
+            )
+        elif self.in_request:
+            response.delete_cookie(self.name, samesite="Lax")
+
+
+def get_cookie_stash(request: HttpRequest) -> CookieStash:
+    """Return the CookieStash for the request (created on first use)."""
+    if not hasattr(request, "utm_cookie_stash"):
+        request.utm_cookie_stash = CookieStash(request)
+    return request.utm_cookie_stash
+
+
+def has_cookie_utm_params(request: HttpRequest) -> bool:
+    """Return True if the request may have params stashed in the cookie."""
+    if hasattr(request, "utm_cookie_stash"):
+        return bool(request.utm_cookie_stash)
+    return get_config().stash_cookie in request.COOKIES
+
+
+def dump_cookie_utm_params(user: Any, request: HttpRequest) -> List[LeadSource]:
+    """
+    Flush utm_params from the cookie and save as LeadSource objects.
+
+    This is the cookie equivalent of session.dump_utm_params - the cookie
+    is deleted when CookieStash.update_response is called.
+
+    """
+    lead_sources = build_lead_sources(user, get_cookie_stash(request).pop())
+    if lead_sources:
+        return persist_lead_sources(lead_sources)
+    return []
+
+
+async def adump_cookie_utm_params(user: Any, request: HttpRequest) -> List[LeadSource]:
+    """Async version of dump_cookie_utm_params."""
+    params_list = get_cookie_stash(request).pop()
+    lead_sources = await abuild_lead_sources(user, params_list)
+    if lead_sources:
+        return await apersist_lead_sources(lead_sources)
+    return []
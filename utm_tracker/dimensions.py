@@ -0,0 +1,47 @@
+"""
+Migrate existing LeadSource objects to (or from) normalized dimensions.
+
+New objects are normalized on creation if UTM_TRACKER_NORMALIZE_DIMENSIONS
+is enabled; this module converts the rows that already exist, in chunks
+of primary keys, so that it can be run against a large live table.
+
+"""
+
+from __future__ import annotations
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import DIMENSIONS, LeadSource
+
+UPDATE_FIELDS = [*DIMENSIONS, *(f"{name}_ref" for name in DIMENSIONS)]
+
+
+def normalize_lead_sources(chunk_size: int = 1000, reverse: bool = False) -> int:
+    """
+    Move medium, source and campaign values to (or from) UtmDimension.
+
+    If reverse is True the values are copied back from UtmDimension into
+    the LeadSource columns, which must be done before the feature is
+    disabled.
+
+    Returns the number of LeadSource objects updated.
+
+    """
+    if reverse:
+        pending = Q(medium_ref__isnull=False)
+        pending |= Q(source_ref__isnull=False)
+        pending |= Q(campaign_ref__isnull=False)
+    else:
+        pending = ~Q(medium="") | ~Q(source="") | ~Q(campaign="")
+    updated = 0
+    for chunk in LeadSource.objects.filter(pending).chunked(chunk_size):
+        for lead_source in chunk:
+            if reverse:
+                lead_source.denormalize_dimensions()
+            else:
+                lead_source.normalize_dimensions()
+        with transaction.atomic():
+            LeadSource.objects.bulk_update(chunk, UPDATE_FIELDS)
+        updated += len(chunk)
+    return updated
@@ -0,0 +1,107 @@
+"""
+Compact encoding for stashed utm_params.
+
+The legacy format stores each set of params as a dict, with the full key
+names, and an ISO-8601 timestamp string:
+
+    {
+        "utm_source": "google",
+        "utm_medium": "cpc",
+        "gclid": "1C5CHFA_enGB874GB874",
+        "timestamp": "2023-02-17T09:20:00.123456+00:00",
+    }
+
+The compact format is a list, with a version number, an epoch (integer)
+timestamp, and then the values of the known params in a fixed order, with
+any trailing empty values removed. Custom tags are appended as a dict, if
+there are any:
+
+    [1, 1676625600, "google", "cpc", "", "", "", "1C5CHFA_enGB874GB874"]
+
+Both formats are decoded into the same (legacy) dict.
+
+"""
+
+from __future__ import annotations
+
+import datetime
+from typing import Any
+
+from django.utils.dateparse import parse_datetime
+
+from .types import UtmParamsDict
+
+ENCODING_VERSION = 1
+
+# NB the order of these keys is part of the encoding - they must never be
+# reordered, and new keys can only be appended (as version 1 entries will
+# just not have values for them).
+KNOWN_KEYS = (
+    "utm_source",
+    "utm_medium",
+    "utm_campaign",
+    "utm_term",
+    "utm_content",
+    "gclid",
+    "aclk",
+    "msclkid",
+    "fbclid",
+    "twclid",
+)
+
+EncodedUtmParams = list[Any]
+
+
+def encode_timestamp(timestamp: str | None) -> int | None:
+    """Convert an ISO-8601 timestamp to epoch seconds."""
+    if not timestamp:
+        return None
+    if (value := parse_datetime(timestamp)) is None:
+        return None
+    return int(value.timestamp())
+
+
+def decode_timestamp(epoch: int | None) -> str | None:
+    """Convert epoch seconds to an ISO-8601 (UTC) timestamp."""
+    if epoch is None:
+        return None
+    return datetime.datetime.fromtimestamp(epoch, tz=datetime.timezone.utc).isoformat()
+
+
+def encode_utm_params(params: UtmParamsDict) -> EncodedUtmParams:
+    """Return the compact encoding of a dict of utm_params."""
+    values = [params.get(key, "") for key in KNOWN_KEYS]
+    custom = {
+        k: v for k, v in params.items() if k not in KNOWN_KEYS and k != "timestamp"
+    }
+    if not custom:
+        while values and not values[-1]:
+            values.pop()
+    encoded: EncodedUtmParams = [
+        ENCODING_VERSION,
+        encode_timestamp(params.get("timestamp")),
+        *values,
+    ]
+    if custom:
+        encoded.append(custom)
+    return encoded
+
+
+def decode_utm_params(encoded: EncodedUtmParams | UtmParamsDict) -> UtmParamsDict:
+    """
+    Return the dict of utm_params from a compact (or legacy) encoding.
+
+    Legacy dicts are returned as-is.
+
+    """
+    if isinstance(encoded, dict):
+        return encoded
+    version, epoch, *values = encoded
+    if version != ENCODING_VERSION:
+        raise ValueError(f"Unknown utm_params encoding version: {version}")
+    custom = values.pop() if values and isinstance(values[-1], dict) else {}
+    params = {key: value for key, value in zip(KNOWN_KEYS, values) if value}
+    params.update(custom)
+    if (timestamp := decode_timestamp(epoch)) is not None:
+        params["timestamp"] = timestamp
+    return params
@@ -0,0 +1,166 @@
+"""
+Streaming export of LeadSource objects as CSV or JSON Lines.
+
+The objects are read in chunks using keyset pagination (see
+LeadSourceQuerySet.chunked) and each row is encoded as it is read, so
+memory use is independent of the number of rows exported. The output
+is a generator of str lines, which can be written to a file, or passed
+to a StreamingHttpResponse.
+
+"""
+
+from __future__ import annotations
+
+import csv
+import datetime
+import json
+from typing import Any, Callable, Iterator
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import LeadSource, LeadSourceQuerySet
+from .settings import get_config
+
+EXPORT_FIELDS = [
+    "id",
+    "user_id",
+    "timestamp",
+    "created_at",
+    "medium",
+    "source",
+    "campaign",
+    "term",
+    "content",
+    "gclid",
+    "aclk",
+    "msclkid",
+    "fbclid",
+    "twclid",
+]
+
+
+def get_columns() -> list[str]:
+    """Return the export columns - custom tags are flattened into columns."""
+    custom_tags = get_config().custom_tags
+    return EXPORT_FIELDS + [tag for tag in custom_tags if tag not in EXPORT_FIELDS]
+
+
+def to_row(lead_source: LeadSource, columns: list[str]) -> dict[str, Any]:
+    """Return a flat dict of the export values for the LeadSource."""
+    row: dict[str, Any] = {}
+    custom_tags = lead_source.custom_tags or {}
+    for column in columns:
+        value: Any
+        if column in ("medium", "source", "campaign"):
+            value = lead_source.get_dimension(column)
+        elif column in EXPORT_FIELDS:
+            value = getattr(lead_source, column)
+        else:
+            value = custom_tags.get(column, "")
+        if isinstance(value, datetime.datetime):
+            value = value.isoformat()
+        row[column] = value
+    return row
+
+
+# a cell starting with one of these is treated as a formula by spreadsheets
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def escape_formula(value: Any) -> Any:
+    """
+    Escape a CSV cell value that a spreadsheet would treat as a formula.
+
+    The values come from visitors' querystrings, e.g.
+    ?utm_source==HYPERLINK(...), so they are prefixed with a single quote,
+    which spreadsheets display as text.
+
+    """
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return f"'{value}"
+    return value
+
+
+class Echo:
+    """File-like object that returns the value written (for csv.writer)."""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def iter_csv(queryset: LeadSourceQuerySet, chunk_size: int = 1000) -> Iterator[str]:
+    """
+    Yield the objects as CSV lines, starting with a header.
+
+    Values that a spreadsheet would treat as formulas are escaped (see
+    escape_formula) - use JSON Lines for a lossless export.
+
+    """
+    columns = get_columns()
+    writer = csv.DictWriter(Echo(), fieldnames=columns)
+    yield writer.writeheader()
+    for chunk in queryset.chunked(chunk_size):
+        for lead_source in chunk:
+            row = to_row(lead_source, columns)
+            yield writer.writerow({k: escape_formula(v) for k, v in row.items()})
+
+
+def iter_jsonl(queryset: LeadSourceQuerySet, chunk_size: int = 1000) -> Iterator[str]:
+    """Yield the objects as JSON Lines."""
+    columns = get_columns()
+    for chunk in queryset.chunked(chunk_size):
+        for lead_source in chunk:
+            row = to_row(lead_source, columns)
+            yield json.dumps(row, separators=(",", ":")) + "\n"
+
+
+# format: (encoder, content type)
+FORMATS: dict[str, tuple[Callable[..., Iterator[str]], str]] = {
+    "csv": (iter_csv, "text/csv"),
+    "jsonl": (iter_jsonl, "application/x-ndjson"),
+}
+
+
+def parse_dates(**values: str | None) -> dict[str, datetime.date]:
+    """
+    Parse the since / until (YYYY-MM-DD) filter values.
+
+    Raises ValueError if any of the values is not a valid date.
+
+    """
+    dates = {}
+    for name, value in values.items():
+        if not value:
+            continue
+        try:
+            date = parse_date(value)
+        except ValueError:
+            date = None
+        if not date:
+            raise ValueError(f"Invalid {name} date: {value}")
+        dates[name] = date
+    return dates
+
+
+def start_of_day(date: datetime.date) -> datetime.datetime:
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time()))
+
+
+def filter_lead_sources(
+    since: datetime.date | None = None, until: datetime.date | None = None
+) -> LeadSourceQuerySet:
+    """
+    Return LeadSource objects created between the dates (inclusive).
+
+    The dates are converted to datetime ranges (in the current time zone)
+    so that the created_at index can be used.
+
+    """
+    queryset = LeadSource.objects.all()
+    if since:
+        queryset = queryset.filter(created_at__gte=start_of_day(since))
+    if until:
+        next_day = until + datetime.timedelta(days=1)
+        queryset = queryset.filter(created_at__lt=start_of_day(next_day))
+    return queryset
@@ -0,0 +1,152 @@
+"""
+In-process counters of tagged landings, by source, medium and campaign.
+
+If UTM_TRACKER_LANDING_COUNTS is enabled, UtmSessionMiddleware counts each
+request with utm_source and utm_medium params - whether or not the user
+is authenticated - in a dict keyed on (date, source, medium, campaign).
+A background thread swaps the dict out every flush interval, and adds the
+counts to LandingDailyStat, with one UPDATE ... SET count = count + n per
+key (and an INSERT for new keys), so the number of writes depends on the
+number of distinct campaigns, not on the number of landings. Anything not
+yet flushed is written when the process exits.
+
+NB counts that have not been flushed are lost if the process is killed.
+
+"""
+
+from __future__ import annotations
+
+import atexit
+import datetime
+import logging
+import os
+import threading
+from collections import Counter
+
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import LandingDailyStat
+from .settings import get_config
+from .types import UtmParamsDict
+
+logger = logging.getLogger(__name__)
+
+# (date, source, medium, campaign)
+LandingKey = tuple[datetime.date, str, str, str]
+
+
+def get_landing_key(params: UtmParamsDict) -> LandingKey | None:
+    """Return the key to count the params under, or None if incomplete."""
+    source, medium = params.get("utm_source"), params.get("utm_medium")
+    if not (source and medium):
+        return None
+    campaign = params.get("utm_campaign", "")
+    return (timezone.localdate(), source[:100], medium[:100], campaign[:100])
+
+
+def add_landing_count(key: LandingKey, count: int) -> None:
+    """Atomically add count to the LandingDailyStat row for the key."""
+    date, source, medium, campaign = key
+    stats = LandingDailyStat.objects.filter(
+        date=date, source=source, medium=medium, campaign=campaign
+    )
+    increment = {"count": F("count") + count, "updated_at": timezone.now()}
+    if stats.update(**increment):
+        return
+    try:
+        with transaction.atomic():
+            LandingDailyStat.objects.create(
+                date=date, source=source, medium=medium, campaign=campaign, count=count
+            )
+    except IntegrityError:
+        # another process has created the row since the UPDATE
+        stats.update(**increment)
+
+
+def add_landing_counts(counts: dict[LandingKey, int]) -> None:
+    with transaction.atomic():
+        for key, count in sorted(counts.items()):
+            add_landing_count(key, count)
+
+
+class LandingCounter:
+    """
+    In-process landing counts, and the thread that flushes them.
+
+    The flush interval is read from UTM_TRACKER_LANDING_COUNTS_FLUSH_INTERVAL
+    before each wait (so that changes to the setting take effect), unless
+    it is passed in.
+
+    """
+
+    def __init__(self, flush_interval: float | None = None) -> None:
+        self._flush_interval = flush_interval
+        self.counts: Counter[LandingKey] = Counter()
+        self.thread: threading.Thread | None = None
+        self.pid: int | None = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    @property
+    def flush_interval(self) -> float:
+        if self._flush_interval is None:
+            return get_config().landing_counts_flush_interval
+        return self._flush_interval
+
+    def start(self) -> None:
+        """Start the flush thread, if it's not already running."""
+        with self.lock:
+            if self.pid == os.getpid() and self.thread and self.thread.is_alive():
+                return
+            if self.pid != os.getpid():
+                # this is a new (forked) process - the counts belong to the
+                # parent, which will flush them.
+                self.counts = Counter()
+                if self.pid is None:
+                    atexit.register(self.stop)
+            self.pid = os.getpid()
+            self.stopped.clear()
+            self.thread = threading.Thread(
+                target=self.run, name="utm-tracker-landing-counts", daemon=True
+            )
+            self.thread.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        """Stop the flush thread and save the current counts."""
+        if self.thread and self.thread.is_alive():
+            self.stopped.set()
+            self.thread.join(timeout)
+        self.flush()
+
+    def incr(self, params: UtmParamsDict) -> None:
+        """Count a landing with the params (if it has a source and medium)."""
+        if (key := get_landing_key(params)) is None:
+            return
+        self.start()
+        with self.lock:
+            self.counts[key] += 1
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self) -> None:
+        """Add the current counts to LandingDailyStat, in the calling thread."""
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+        if not counts:
+            return
+        try:
+            add_landing_counts(counts)
+        except Exception:
+            logger.exception("Error saving landing counts")
+            # keep the counts for the next flush
+            with self.lock:
+                self.counts.update(counts)
+        finally:
+            close_old_connections()
+
+
+landing_counter = LandingCounter()
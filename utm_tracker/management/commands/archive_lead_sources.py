@@ -0,0 +1,48 @@
+import datetime
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from utm_tracker.archive import archive_lead_sources
+
+
+class Command(BaseCommand):
+    help = "Move old LeadSource objects into a gzipped JSON Lines archive file."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("path", help="The archive file (appended to).")
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=365,
+            help="Archive objects created more than DAYS days ago (default: 365).",
+        )
+        parser.add_argument(
+            "--before",
+            help="Archive objects created before this date (YYYY-MM-DD).",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of objects to archive in each chunk (default: 1000).",
+        )
+
+    def get_cutoff(self, options: dict[str, Any]) -> datetime.datetime:
+        if not options["before"]:
+            today = timezone.localdate()
+            options["before"] = str(today - datetime.timedelta(days=options["days"]))
+        if not (date := parse_date(options["before"])):
+            raise CommandError(f"Invalid date: {options['before']}")
+        return timezone.make_aware(datetime.datetime.combine(date, datetime.time()))
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        before = self.get_cutoff(options)
+        archived = archive_lead_sources(
+            options["path"], before, chunk_size=options["chunk_size"]
+        )
+        self.stdout.write(
+            f"Archived {archived} lead sources created before {before.date()}."
+        )
@@ -0,0 +1,47 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from utm_tracker.backfill import BackfillStats, backfill_lead_sources
+
+
+class Command(BaseCommand):
+    help = "Import historical LeadSource records from a CSV or JSON Lines file."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("path", help="The CSV or JSON Lines file.")
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl"],
+            help="The file format (default: from the file extension).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of records to insert in each query (default: 1000).",
+        )
+
+    def on_reject(self, line_num: int, reason: str) -> None:
+        self.stderr.write(f"Line {line_num}: {reason}")
+
+    def on_batch(self, stats: BackfillStats) -> None:
+        if self.verbosity > 1:
+            self.stdout.write(f"Read {stats.read} records ({stats.rate:.0f}/s)")
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        self.verbosity = options["verbosity"]
+        path = options["path"]
+        fmt = options["format"] or ("csv" if path.endswith(".csv") else "jsonl")
+        stats = backfill_lead_sources(
+            path,
+            fmt,
+            batch_size=options["batch_size"],
+            on_reject=self.on_reject,
+            on_batch=self.on_batch,
+        )
+        self.stdout.write(
+            f"Read {stats.read} records in {stats.elapsed:.1f}s "
+            f"({stats.rate:.0f}/s): {stats.created} created, "
+            f"{stats.duplicates} duplicates, {stats.rejected} rejected."
+        )
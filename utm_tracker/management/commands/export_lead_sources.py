@@ -0,0 +1,43 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from utm_tracker.export import FORMATS, filter_lead_sources, parse_dates
+
+
+class Command(BaseCommand):
+    help = "Export LeadSource objects as CSV or JSON Lines."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "path", nargs="?", help="The output file (default: stdout)."
+        )
+        parser.add_argument(
+            "--format", choices=sorted(FORMATS), default="csv", help="(default: csv)"
+        )
+        parser.add_argument(
+            "--since", help="Export objects created on or after this date."
+        )
+        parser.add_argument(
+            "--until", help="Export objects created on or before this date."
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of objects to read in each query (default: 1000).",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        try:
+            dates = parse_dates(since=options["since"], until=options["until"])
+        except ValueError as ex:
+            raise CommandError(str(ex))
+        encode, _ = FORMATS[options["format"]]
+        lines = encode(filter_lead_sources(**dates), chunk_size=options["chunk_size"])
+        if not options["path"]:
+            for line in lines:
+                self.stdout.write(line, ending="")
+            return
+        with open(options["path"], "w", newline="") as f:
+            f.writelines(lines)
@@ -0,0 +1,21 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from utm_tracker.tags import index_custom_tags
+
+
+class Command(BaseCommand):
+    help = "Copy the UTM_TRACKER_INDEXED_TAGS custom tags into LeadSourceTag."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of objects to index in each query (default: 1000).",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        indexed = index_custom_tags(chunk_size=options["chunk_size"])
+        self.stdout.write(f"Indexed {indexed} lead sources.")
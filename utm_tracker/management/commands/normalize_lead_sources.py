@@ -0,0 +1,28 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from utm_tracker.dimensions import normalize_lead_sources
+
+
+class Command(BaseCommand):
+    help = "Move LeadSource medium, source and campaign values to UtmDimension."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of objects to update in each query (default: 1000).",
+        )
+        parser.add_argument(
+            "--reverse",
+            action="store_true",
+            help="Copy the values from UtmDimension back to LeadSource.",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        updated = normalize_lead_sources(
+            chunk_size=options["chunk_size"], reverse=options["reverse"]
+        )
+        self.stdout.write(f"Updated {updated} lead sources.")
@@ -0,0 +1,23 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from utm_tracker.archive import restore_lead_sources
+
+
+class Command(BaseCommand):
+    help = "Restore LeadSource objects from gzipped JSON Lines archive files."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("paths", nargs="+", help="The archive file(s).")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of objects to insert in each query (default: 1000).",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        for path in options["paths"]:
+            restored = restore_lead_sources(path, batch_size=options["batch_size"])
+            self.stdout.write(f"Restored {restored} lead sources from {path}.")
@@ -0,0 +1,31 @@
+import datetime
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from utm_tracker.rollup import rollup_lead_sources
+
+
+class Command(BaseCommand):
+    help = "Add LeadSource objects created since the last run to the daily stats."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--lag",
+            type=int,
+            default=300,
+            help="Ignore objects created in the last LAG seconds (default: 300).",
+        )
+        parser.add_argument(
+            "--window",
+            type=int,
+            default=24,
+            help="Process objects in windows of WINDOW hours (default: 24).",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        processed = rollup_lead_sources(
+            lag=datetime.timedelta(seconds=options["lag"]),
+            window=datetime.timedelta(hours=options["window"]),
+        )
+        self.stdout.write(f"Processed {processed} lead sources.")
@@ -0,0 +1,131 @@
+"""
+Lightweight counters and timings for the request path.
+
+Metrics are sent to the backend configured by the
+UTM_TRACKER_METRICS_BACKEND setting - by default they are kept in memory
+(per process), and can be read using get_backend().snapshot(). The
+SignalMetricsBackend sends each metric as a Django signal, which can be
+used to forward them to statsd, Prometheus, etc.
+
+Counters:
+
+    stashed             params added to the session
+    deduped             params ignored as they were already in the session
+    evicted             params removed from the session (see EVICTION_POLICY)
+    persisted           LeadSource objects written to all of the sinks
+    dropped             LeadSource objects that a sink failed to write
+    rejected            params discarded as invalid (e.g. missing utm_source)
+    sink_errors         errors writing a batch to a sink
+    skipped_user_agent  tagged requests ignored due to the User-Agent (bots)
+    skipped_path        tagged requests ignored due to the path
+
+Timings:
+
+    parse_qs    parsing the tracked params from the querystring
+    stash       adding the params to the session
+    flush       writing a batch of LeadSource objects to the sinks
+
+"""
+
+from __future__ import annotations
+
+import contextlib
+import functools
+import threading
+import time
+from typing import Any, Iterator
+
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .settings import get_config
+from .signals import counter_incremented, timing_recorded
+
+
+class MetricsBackend:
+    """Base class for all metrics backends - discards all metrics."""
+
+    def incr(self, name: str, value: int = 1) -> None:
+        pass
+
+    def timing(self, name: str, seconds: float) -> None:
+        pass
+
+
+class InMemoryMetricsBackend(MetricsBackend):
+    """Keeps running totals of counters and timings, per process."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.counters: dict[str, int] = {}
+        # name: [count, total seconds, max seconds]
+        self.timings: dict[str, list[float]] = {}
+
+    def incr(self, name: str, value: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def timing(self, name: str, seconds: float) -> None:
+        with self.lock:
+            if stats := self.timings.get(name):
+                stats[0] += 1
+                stats[1] += seconds
+                stats[2] = max(stats[2], seconds)
+            else:
+                self.timings[name] = [1, seconds, seconds]
+
+    def snapshot(self) -> dict[str, dict]:
+        """Return a copy of the current counters and timings."""
+        with self.lock:
+            return {
+                "counters": dict(self.counters),
+                "timings": {
+                    name: {"count": int(count), "total": total, "max": max_}
+                    for name, (count, total, max_) in self.timings.items()
+                },
+            }
+
+    def reset(self) -> None:
+        with self.lock:
+            self.counters.clear()
+            self.timings.clear()
+
+
+class SignalMetricsBackend(MetricsBackend):
+    """Sends each metric as a signal (see utm_tracker.signals)."""
+
+    def incr(self, name: str, value: int = 1) -> None:
+        counter_incremented.send(sender=self.__class__, name=name, value=value)
+
+    def timing(self, name: str, seconds: float) -> None:
+        timing_recorded.send(sender=self.__class__, name=name, seconds=seconds)
+
+
+@functools.cache
+def get_backend() -> MetricsBackend:
+    """Return the configured backend (instantiated once per process)."""
+    return import_string(get_config().metrics_backend)()
+
+
+@receiver(setting_changed)
+def reset_backend(*, setting: str, **kwargs: Any) -> None:
+    if setting == "UTM_TRACKER_METRICS_BACKEND":
+        get_backend.cache_clear()
+
+
+def incr(name: str, value: int = 1) -> None:
+    if value:
+        get_backend().incr(name, value)
+
+
+def timing(name: str, seconds: float) -> None:
+    get_backend().timing(name, seconds)
+
+
+@contextlib.contextmanager
+def timer(name: str) -> Iterator[None]:
+    """Record the time taken by the block (if it does not raise)."""
+    start = time.perf_counter()
+    yield
+    timing(name, time.perf_counter() - start)
@@ -1,26 +1,215 @@
 import logging
-from typing import Callable
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable
 
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
 from django.http import HttpRequest, HttpResponse
 
-from .request import parse_qs
-from .session import dump_utm_params, stash_utm_params
+from . import metrics
+from .cookie import (
+    adump_cookie_utm_params,
+    dump_cookie_utm_params,
+    get_cookie_stash,
+    has_cookie_utm_params,
+)
+from .landings import landing_counter
+from .request import get_ignored_reason, has_tracked_params, parse_qs
+from .session import (
+    adump_utm_params,
+    ahas_utm_params,
+    astash_utm_params,
+    dump_utm_params,
+    has_utm_params,
+    stash_utm_params,
+)
+from .settings import get_config
+from .types import UtmParamsDict
 
 logger = logging.getLogger(__name__)
 
+GetResponse = Callable[[HttpRequest], HttpResponse]
+AsyncGetResponse = Callable[[HttpRequest], Awaitable[HttpResponse]]
 
-class UtmSessionMiddleware:
-    """Extract utm values from querystring and store in session."""
 
-    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+def set_pending_cookie(response: HttpResponse) -> None:
+    """Flag that the session contains utm_params waiting to be persisted."""
+    response.set_cookie(
+        get_config().pending_cookie,
+        "1",
+        max_age=settings.SESSION_COOKIE_AGE,
+        secure=settings.SESSION_COOKIE_SECURE,
+        httponly=True,
+        samesite="Lax",
+    )
+
+
+def has_pending_utm_params(request: HttpRequest) -> bool:
+    """
+    Return True if the session may contain utm_params to persist.
+
+    If the pending cookie is not configured we have to assume that
+    there may be something in the session.
+
+    """
+    if not (pending_cookie := get_config().pending_cookie):
+        return True
+    if getattr(request, "utm_params_stashed", False):
+        return True
+    return pending_cookie in request.COOKIES
+
+
+def clear_pending_cookie(request: HttpRequest, response: HttpResponse) -> None:
+    """Delete the pending cookie from the client (if it was sent)."""
+    pending_cookie = get_config().pending_cookie
+    if pending_cookie and pending_cookie in request.COOKIES:
+        response.delete_cookie(pending_cookie, samesite="Lax")
+
+
+def is_trackable(request: HttpRequest) -> bool:
+    """Return True if the request has tracked params, and is not ignored."""
+    if not has_tracked_params(request):
+        return False
+    if reason := get_ignored_reason(request):
+        metrics.incr(f"skipped_{reason}")
+        return False
+    return True
+
+
+async def aget_user(request: HttpRequest) -> Any:
+    """Return request.user without blocking the event loop."""
+    # request.auser was added in Django 5.0
+    if hasattr(request, "auser"):
+        return await request.auser()
+
+    def get_user() -> Any:
+        # evaluate the lazy user object, which may hit the database
+        user = request.user
+        user.is_authenticated
+        return user
+
+    return await sync_to_async(get_user)()
+
+
+class AsyncCapableMiddleware(ABC):
+    """
+    Base class for middleware that supports both sync and async requests.
+
+    Subclasses implement process (sync) and __acall__ (async) - the one
+    that is called depends on the get_response passed in by the handler.
+
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: GetResponse | AsyncGetResponse):
         self.get_response = get_response
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            # tell the handler that calling this instance returns a coroutine
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest) -> Any:
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.process(request)
+
+    @abstractmethod
+    def process(self, request: HttpRequest) -> HttpResponse:
+        """Process a sync request."""
 
-    def __call__(self, request: HttpRequest) -> HttpResponse:
-        stash_utm_params(request.session, parse_qs(request))
-        return self.get_response(request)
+    @abstractmethod
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        """Process an async request."""
 
 
-class LeadSourceMiddleware:
+class UtmSessionMiddleware(AsyncCapableMiddleware):
+    """
+    Extract utm values from querystring and store in session.
+
+    Requests whose raw querystring contains no tracked keys are passed
+    straight through - request.GET is not parsed, and request.session is
+    not accessed (so an anonymous session is not loaded or created). The
+    same applies to requests from crawlers and bots, or to ignored paths
+    (see UTM_TRACKER_IGNORED_USER_AGENTS and UTM_TRACKER_IGNORED_PATHS).
+
+    If UTM_TRACKER_STASH_COOKIE is set, then the params are stored in a
+    signed cookie of that name instead of the session (see cookie.py).
+
+    If UTM_TRACKER_LANDING_COUNTS is set, then each request with params is
+    also counted in memory, and added to LandingDailyStat periodically
+    (see landings.py).
+
+    If UTM_TRACKER_PENDING_COOKIE is set, then a cookie of that name is
+    set on the response whenever there are params left in the session, so
+    that LeadSourceMiddleware knows that it has some work to do.
+
+    """
+
+    def process(self, request: HttpRequest) -> HttpResponse:
+        if not is_trackable(request):
+            return self.get_response(request)
+        with metrics.timer("parse_qs"):
+            params = parse_qs(request)
+        if get_config().landing_counts:
+            landing_counter.incr(params)
+        if get_config().stash_cookie:
+            return self.process_cookie(request, params)
+        # flag the request so that LeadSourceMiddleware can flush the params
+        # in this request, without waiting for the pending cookie.
+        with metrics.timer("stash"):
+            request.utm_params_stashed = stash_utm_params(request.session, params)
+        response = self.get_response(request)
+        # the session has already been loaded, so this check is free; if
+        # LeadSourceMiddleware has flushed the params there is no point in
+        # flagging them as pending.
+        if get_config().pending_cookie and has_utm_params(request.session):
+            set_pending_cookie(response)
+        return response
+
+    def process_cookie(
+        self, request: HttpRequest, params: UtmParamsDict
+    ) -> HttpResponse:
+        stash = get_cookie_stash(request)
+        with metrics.timer("stash"):
+            request.utm_params_stashed = stash.add(params)
+        response = self.get_response(request)
+        # a no-op if LeadSourceMiddleware has already flushed the params
+        stash.update_response(response)
+        return response
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        if not is_trackable(request):
+            return await self.get_response(request)
+        with metrics.timer("parse_qs"):
+            params = parse_qs(request)
+        if get_config().landing_counts:
+            landing_counter.incr(params)
+        if get_config().stash_cookie:
+            # the cookie stash does no I/O, so there is no async version
+            return await self.aprocess_cookie(request, params)
+        with metrics.timer("stash"):
+            request.utm_params_stashed = await astash_utm_params(
+                request.session, params
+            )
+        response = await self.get_response(request)
+        if get_config().pending_cookie and await ahas_utm_params(request.session):
+            set_pending_cookie(response)
+        return response
+
+    async def aprocess_cookie(
+        self, request: HttpRequest, params: UtmParamsDict
+    ) -> HttpResponse:
+        stash = get_cookie_stash(request)
+        with metrics.timer("stash"):
+            request.utm_params_stashed = stash.add(params)
+        response = await self.get_response(request)
+        stash.update_response(response)
+        return response
+
+
+class LeadSourceMiddleware(AsyncCapableMiddleware):
     """
     Store LeadSource and clear Session UTM values.
 
@@ -34,16 +223,70 @@ class LeadSourceMiddleware:
     registered, then the session data will be retained, and on the first request
     with an authenticated user the data will be stored.
 
-    """
+    If UTM_TRACKER_PENDING_COOKIE is set then the session is only read if the
+    request has the pending cookie, and the cookie is deleted once the params
+    have been flushed.
 
-    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
-        self.get_response = get_response
+    If UTM_TRACKER_STASH_COOKIE is set then the params are read from that
+    cookie instead of the session, and the cookie is deleted once they have
+    been flushed.
 
-    def __call__(self, request: HttpRequest) -> HttpResponse:
-        if request.user.is_authenticated:
+    """
+
+    def process(self, request: HttpRequest) -> HttpResponse:
+        if get_config().stash_cookie:
+            return self.process_cookie(request)
+        flushed = False
+        if has_pending_utm_params(request) and request.user.is_authenticated:
             try:
                 dump_utm_params(request.user, request.session)
+                flushed = True
+            except:  # noqa E722
+                logger.exception("Error flushing utm_params from request")
+
+        response = self.get_response(request)
+        if flushed:
+            clear_pending_cookie(request, response)
+        return response
+
+    def process_cookie(self, request: HttpRequest) -> HttpResponse:
+        if has_cookie_utm_params(request) and request.user.is_authenticated:
+            try:
+                dump_cookie_utm_params(request.user, request)
             except:  # noqa E722
                 logger.exception("Error flushing utm_params from request")
+        response = self.get_response(request)
+        if hasattr(request, "utm_cookie_stash"):
+            request.utm_cookie_stash.update_response(response)
+        return response
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        if get_config().stash_cookie:
+            return await self.aprocess_cookie(request)
+        flushed = False
+        if has_pending_utm_params(request):
+            user = await aget_user(request)
+            if user.is_authenticated:
+                try:
+                    await adump_utm_params(user, request.session)
+                    flushed = True
+                except:  # noqa E722
+                    logger.exception("Error flushing utm_params from request")
+
+        response = await self.get_response(request)
+        if flushed:
+            clear_pending_cookie(request, response)
+        return response
 
-        return self.get_response(request)
+    async def aprocess_cookie(self, request: HttpRequest) -> HttpResponse:
+        if has_cookie_utm_params(request):
+            user = await aget_user(request)
+            if user.is_authenticated:
+                try:
+                    await adump_cookie_utm_params(user, request)
+                except:  # noqa E722
+                    logger.exception("Error flushing utm_params from request")
+        response = await self.get_response(request)
+        if hasattr(request, "utm_cookie_stash"):
+            request.utm_cookie_stash.update_response(response)
+        return response
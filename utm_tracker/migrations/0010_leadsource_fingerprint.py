@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("utm_tracker", "0009_alter_leadsource_timestamp"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="leadsource",
+            name="fingerprint",
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                help_text="Hash of the user, timestamp and all params - used to prevent the same event being recorded twice.",
+                max_length=64,
+                null=True,
+                unique=True,
+            ),
+        ),
+    ]
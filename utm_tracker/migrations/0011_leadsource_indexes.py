@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("utm_tracker", "0010_leadsource_fingerprint"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="leadsource",
+            index=models.Index(
+                fields=["user", "timestamp"], name="utm_ls_user_timestamp_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="leadsource",
+            index=models.Index(
+                fields=["source", "medium", "timestamp"], name="utm_ls_src_med_ts_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="leadsource",
+            index=models.Index(fields=["timestamp"], name="utm_ls_timestamp_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="leadsource",
+            index=models.Index(fields=["created_at"], name="utm_ls_created_at_idx"),
+        ),
+    ]
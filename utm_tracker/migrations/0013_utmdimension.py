@@ -0,0 +1,98 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("utm_tracker", "0012_rollup"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UtmDimension",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("medium", "medium"),
+                            ("source", "source"),
+                            ("campaign", "campaign"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("value", models.CharField(max_length=100)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("kind", "value"), name="utm_dimension_unique"
+                    )
+                ],
+            },
+        ),
+        migrations.AddField(
+            model_name="leadsource",
+            name="campaign_ref",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="utm_tracker.utmdimension",
+            ),
+        ),
+        migrations.AddField(
+            model_name="leadsource",
+            name="medium_ref",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="utm_tracker.utmdimension",
+            ),
+        ),
+        migrations.AddField(
+            model_name="leadsource",
+            name="source_ref",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="utm_tracker.utmdimension",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="leadsource",
+            index=models.Index(
+                fields=["source_ref", "medium_ref", "timestamp"],
+                name="utm_ls_src_med_ref_ts_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="leadsource",
+            index=models.Index(fields=["campaign_ref"], name="utm_ls_campaign_ref_idx"),
+        ),
+    ]
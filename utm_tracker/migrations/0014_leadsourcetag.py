@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("utm_tracker", "0013_utmdimension"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LeadSourceTag",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100)),
+                ("value", models.CharField(max_length=255)),
+                (
+                    "lead_source",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="tags",
+                        to="utm_tracker.leadsource",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["name", "value"], name="utm_ls_tag_name_value_idx"
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("lead_source", "name"), name="utm_ls_tag_unique"
+                    )
+                ],
+            },
+        ),
+    ]
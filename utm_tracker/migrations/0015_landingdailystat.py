@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("utm_tracker", "0014_leadsourcetag"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LandingDailyStat",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                ("source", models.CharField(max_length=100)),
+                ("medium", models.CharField(max_length=100)),
+                ("campaign", models.CharField(blank=True, max_length=100)),
+                ("count", models.PositiveIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("date", "source", "medium", "campaign"),
+                        name="utm_landing_stat_unique",
+                    )
+                ],
+            },
+        ),
+    ]
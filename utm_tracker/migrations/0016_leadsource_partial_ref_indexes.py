@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("utm_tracker", "0015_landingdailystat"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="leadsource",
+            name="utm_ls_src_med_ref_ts_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="leadsource",
+            name="utm_ls_campaign_ref_idx",
+        ),
+        migrations.AddIndex(
+            model_name="leadsource",
+            index=models.Index(
+                condition=models.Q(("source_ref__isnull", False)),
+                fields=["source_ref", "medium_ref", "timestamp"],
+                name="utm_ls_src_med_ref_ts_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="leadsource",
+            index=models.Index(
+                condition=models.Q(("campaign_ref__isnull", False)),
+                fields=["campaign_ref"],
+                name="utm_ls_campaign_ref_idx",
+            ),
+        ),
+    ]
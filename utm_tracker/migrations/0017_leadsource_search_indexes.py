@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("utm_tracker", "0016_leadsource_partial_ref_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="leadsource",
+            name="utm_ls_src_med_ts_idx",
+        ),
+        migrations.AddIndex(
+            model_name="leadsource",
+            index=models.Index(
+                fields=["source", "medium", "timestamp"],
+                name="utm_ls_src_med_ts_idx",
+                opclasses=["varchar_pattern_ops", "varchar_pattern_ops", ""],
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="leadsource",
+            index=models.Index(
+                fields=["medium", "timestamp"],
+                name="utm_ls_med_ts_idx",
+                opclasses=["varchar_pattern_ops", ""],
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="leadsource",
+            index=models.Index(
+                condition=models.Q(("medium_ref__isnull", False)),
+                fields=["medium_ref"],
+                name="utm_ls_medium_ref_idx",
+            ),
+        ),
+    ]
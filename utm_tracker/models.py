@@ -1,38 +1,348 @@
 from __future__ import annotations
 
+import datetime
+import functools
+import hashlib
+import json
+import operator
+from typing import Any, Iterator
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.db import models
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import F, OuterRef, Q, Subquery, Window
 from django.db.models.base import Model
+from django.db.models.functions import Coalesce, NullIf, RowNumber
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
+from .settings import get_config
 from .types import UtmParamsDict
 
+# params that must be present to create a LeadSource
+REQUIRED_PARAMS = ("utm_medium", "utm_source")
+
+# the LeadSource fields that can be stored in the UtmDimension table
+DIMENSIONS = ("medium", "source", "campaign")
+
+
+def fingerprint_lead_source(user_id: Any, utm_params: UtmParamsDict) -> str:
+    """
+    Return a hash of the user, timestamp and all of the utm_params.
+
+    This is stored in the LeadSource.fingerprint column, which is unique,
+    and so prevents the same params being stored more than once, e.g. by
+    concurrent requests, or re-running a backfill.
+
+    """
+    params = utm_params.copy()
+    timestamp = params.pop("timestamp", None)
+    if isinstance(timestamp, str):
+        timestamp = parse_datetime(timestamp)
+    if isinstance(timestamp, datetime.datetime):
+        timestamp = timestamp.astimezone(datetime.timezone.utc).isoformat()
+    data = json.dumps(
+        [str(user_id), timestamp, sorted(params.items())],
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def dimension_value(name: str) -> Coalesce | F:
+    """
+    Return an expression for the value of a medium, source or campaign.
+
+    The value is either stored in the LeadSource column, or (if the
+    dimensions have been normalized) in the UtmDimension table - which is
+    only joined if UTM_TRACKER_NORMALIZE_DIMENSIONS is enabled.
+
+    """
+    if not get_config().normalize_dimensions:
+        return F(name)
+    return Coalesce(
+        NullIf(F(name), models.Value("")), F(f"{name}_ref__value"), models.Value("")
+    )
+
+
+def dimension_lookups(name: str, value: str, lookup: str = "exact") -> list[Q]:
+    """
+    Return the filters that match a medium, source or campaign value.
+
+    The first is on the LeadSource column, and (if the dimensions have been
+    normalized) the second on the id of the value in the UtmDimension
+    table. UtmDimension is never joined, as that prevents the use of the
+    indexes on LeadSource - exact values are resolved to an id (normally
+    from the cache), and other lookups use a subquery.
+
+    """
+    lookups = [Q(**{f"{name}__{lookup}": value})]
+    if not get_config().normalize_dimensions:
+        return lookups
+    if lookup == "exact":
+        if ref_id := UtmDimension.objects.find_id(name, value):
+            lookups.append(Q(**{f"{name}_ref_id": ref_id}))
+        return lookups
+    ref_ids = UtmDimension.objects.filter(kind=name, **{f"value__{lookup}": value})
+    lookups.append(Q(**{f"{name}_ref__in": ref_ids.values("pk")}))
+    return lookups
+
+
+def dimension_q(name: str, value: str, lookup: str = "exact") -> Q:
+    """Return a filter on a medium, source or campaign value."""
+    return functools.reduce(operator.or_, dimension_lookups(name, value, lookup))
+
+
+class LeadSourceQuerySet(models.QuerySet):
+    def _touch(self, users: Any, last: bool) -> LeadSourceQuerySet:
+        queryset = self if users is None else self.filter(user__in=users)
+        # the timestamp is when the event happened, if we know it
+        touched_at = Coalesce("timestamp", "created_at")
+        if last:
+            order_by = [touched_at.desc(), F("id").desc()]
+        else:
+            order_by = [touched_at.asc(), F("id").asc()]
+        if connections[self.db].features.supports_over_clause:
+            return queryset.annotate(
+                touch_rank=Window(
+                    RowNumber(), partition_by=[F("user")], order_by=order_by
+                )
+            ).filter(touch_rank=1)
+        # fall back to a correlated subquery if window functions are not
+        # supported - this is still a single query, but may be slower.
+        first_pk = queryset.filter(user=OuterRef("user")).order_by(*order_by)
+        return queryset.filter(pk=Subquery(first_pk.values("pk")[:1]))
+
+    def first_touch(self, users: Any = None) -> LeadSourceQuerySet:
+        """
+        Return the first LeadSource for each user, in a single query.
+
+        The optional users arg (a User queryset, or iterable of users / ids)
+        restricts the results to those users. Any other filters applied to
+        the queryset are applied before the first touch is determined, e.g.
+        LeadSource.objects.with_dimensions(medium="cpc").first_touch()
+        returns the first "cpc" LeadSource for each user.
+
+        """
+        return self._touch(users, last=False)
+
+    def last_touch(self, users: Any = None) -> LeadSourceQuerySet:
+        """Return the last LeadSource for each user (see first_touch)."""
+        return self._touch(users, last=True)
+
+    def with_dimensions(self, **values: str) -> LeadSourceQuerySet:
+        """
+        Filter on medium, source and / or campaign values.
+
+        Use this rather than filter(medium=...), as the values may be
+        stored in UtmDimension (see UTM_TRACKER_NORMALIZE_DIMENSIONS).
+
+        """
+        queryset = self
+        for name, value in values.items():
+            if name not in DIMENSIONS:
+                raise ValueError(f"Invalid dimension: {name!r}")
+            queryset = queryset.filter(dimension_q(name, value))
+        return queryset
+
+    def with_custom_tag(self, name: str, value: str) -> LeadSourceQuerySet:
+        """
+        Filter on the value of a custom tag.
+
+        If the tag is in UTM_TRACKER_INDEXED_TAGS this uses the (indexed)
+        LeadSourceTag table, otherwise it falls back to a lookup on the
+        custom_tags JSON, which requires a full table scan.
+
+        Indexed values are truncated (see LeadSourceTag.to_value), so a
+        value that fills the indexed column could also match a longer,
+        truncated, value - these are matched on the truncated prefix using
+        the index, and then on the full value in the custom_tags JSON.
+
+        """
+        if name not in get_config().indexed_tags:
+            return self.filter(**{f"custom_tags__{name}": value})
+        indexed_value = LeadSourceTag.to_value(value)
+        queryset = self.filter(tags__name=name, tags__value=indexed_value)
+        if len(indexed_value) == LeadSourceTag.MAX_VALUE_LENGTH:
+            queryset = queryset.filter(**{f"custom_tags__{name}": value})
+        return queryset
+
+    def chunked(self, size: int = 1000, after: int = 0) -> Iterator[list[LeadSource]]:
+        """
+        Yield lists of (up to) size objects, in primary key order.
+
+        Each chunk is fetched with a separate "WHERE id > last ORDER BY id
+        LIMIT size" query (keyset pagination), so the cost of each query
+        does not grow as the table is scanned, only one chunk is held in
+        memory, and objects can safely be updated or deleted between
+        chunks. Iteration starts after the primary key `after`.
+
+        """
+        last_pk = after
+        while chunk := list(self.filter(pk__gt=last_pk).order_by("pk")[:size]):
+            yield chunk
+            last_pk = chunk[-1].pk
+
+
+class LeadSourceManager(models.Manager.from_queryset(LeadSourceQuerySet)):  # type: ignore[misc]
+    def build_from_utm_params(
+        self, user: type[Model], utm_params: UtmParamsDict
+    ) -> LeadSource:
+        """
+        Return an unsaved LeadSource from a dictionary of utm_* values.
+
+        The values are truncated to fit the model fields, and any params
+        that do not map to a field are stored as custom tags.
+
+        """
+        for param in REQUIRED_PARAMS:
+            if param not in utm_params:
+                raise ValueError(f"Missing utm param: {param!r}")
+        config = get_config()
+        params = utm_params.copy()
+        timestamp = params.pop("timestamp", None)
+        fields = {
+            field: params.pop(param, "")[:max_length]
+            for param, (field, max_length) in config.param_fields.items()
+        }
+        lead_source = LeadSource(
+            user=user,
+            fingerprint=fingerprint_lead_source(user.pk, utm_params),
+            timestamp=timestamp,
+            # everything that hasn't already been popped is custom
+            custom_tags=params,
+            **fields,
+        )
+        if config.normalize_dimensions:
+            lead_source.normalize_dimensions()
+        return lead_source
 
-class LeadSourceManager(models.Manager):
     def create_from_utm_params(
         self, user: type[Model], utm_params: UtmParamsDict
     ) -> LeadSource:
-        """Persist a LeadSource dictionary of utm_* values."""
+        """
+        Persist a LeadSource dictionary of utm_* values.
+
+        If the same params have already been stored for the user (i.e. there
+        is a LeadSource with the same fingerprint) then nothing is saved, and
+        the existing object is returned.
+
+        """
+        lead_source = self.build_from_utm_params(user, utm_params)
         try:
-            params = utm_params.copy()
-            return LeadSource.objects.create(
-                user=user,
-                timestamp=params.pop("timestamp", None),
-                medium=params.pop("utm_medium")[:100],
-                source=params.pop("utm_source")[:100],
-                campaign=params.pop("utm_campaign", "")[:100],
-                term=params.pop("utm_term", "")[:100],
-                content=params.pop("utm_content", "")[:100],
-                gclid=params.pop("gclid", "")[:255],
-                msclkid=params.pop("msclkid", "")[:255],
-                aclk=params.pop("aclk", "")[:255],
-                twclid=params.pop("twclid", "")[:255],
-                fbclid=params.pop("fbclid", "")[:255],
-                # everything that hasn't already been popped is custom
-                custom_tags=params,
+            with transaction.atomic(using=self.db):
+                lead_source.save(force_insert=True, using=self.db)
+                self.index_custom_tags([lead_source])
+        except IntegrityError:
+            existing = self.filter(fingerprint=lead_source.fingerprint).first()
+            if existing is None:
+                raise
+            return existing
+        return lead_source
+
+    def bulk_create_ignore_duplicates(
+        self, lead_sources: list[LeadSource], fetch_pks: bool = False
+    ) -> list[LeadSource]:
+        """
+        Persist unsaved LeadSource objects, ignoring any duplicates.
+
+        Objects whose fingerprint already exists are not saved (using the
+        database "ON CONFLICT DO NOTHING" equivalent), in a single INSERT.
+
+        As the database does not return the primary keys when ignoring
+        conflicts, the objects are left without a pk, unless fetch_pks is
+        True (or any custom tags are indexed) - in which case they are set
+        by fetch_stored.
+
+        This runs in a savepoint if called inside a transaction, so that if
+        it fails (and the error is handled, e.g. by write_lead_sources) the
+        transaction can continue.
+
+        Returns the objects passed in - or, if fetch_pks is True, only the
+        objects that were inserted (i.e. not the duplicates).
+
+        """
+        if not lead_sources:
+            return []
+        with transaction.atomic(using=self.db):
+            self.bulk_create(lead_sources, ignore_conflicts=True)
+            if not (fetch_pks or get_config().indexed_tags):
+                return lead_sources
+            inserted = self.fetch_stored(lead_sources)
+            self.index_custom_tags(lead_sources)
+        return inserted if fetch_pks else lead_sources
+
+    def fetch_stored(self, lead_sources: list[LeadSource]) -> list[LeadSource]:
+        """
+        Set the pk of each object to that of the stored row (by fingerprint).
+
+        Returns the objects that were inserted - the row stored for a
+        duplicate was inserted earlier (with a different created_at), or is
+        that of the first object in the list with the same fingerprint.
+
+        """
+        stored = self.in_bulk(
+            [ls.fingerprint for ls in lead_sources], field_name="fingerprint"
+        )
+        inserted: dict[int, LeadSource] = {}
+        for lead_source in lead_sources:
+            if not (row := stored.get(lead_source.fingerprint)):
+                continue
+            lead_source.pk = row.pk
+            lead_source._state.adding = False
+            lead_source._state.db = self.db
+            if row.created_at == lead_source.created_at:
+                inserted.setdefault(row.pk, lead_source)
+        return list(inserted.values())
+
+    def index_custom_tags(self, lead_sources: list[LeadSource]) -> None:
+        """
+        Copy the UTM_TRACKER_INDEXED_TAGS custom tags into LeadSourceTag.
+
+        The objects must have been saved. Tags that already exist are
+        ignored, so this is safe to call more than once.
+
+        """
+        if not (names := get_config().indexed_tags):
+            return
+        tags = [
+            LeadSourceTag(
+                lead_source_id=ls.pk, name=name, value=LeadSourceTag.to_value(value)
+            )
+            for ls in lead_sources
+            for name, value in (ls.custom_tags or {}).items()
+            if name in names
+        ]
+        if tags:
+            LeadSourceTag.objects.using(self.db).bulk_create(
+                tags, ignore_conflicts=True
             )
-        except KeyError as ex:
-            raise ValueError(f"Missing utm param: {ex}")
+
+    def bulk_create_from_utm_params(
+        self, user: type[Model], params_list: list[UtmParamsDict]
+    ) -> list[LeadSource]:
+        """
+        Persist multiple dictionaries of utm_* values in a single INSERT.
+
+        All of the params are validated before anything is written, so if
+        any of them are invalid a ValueError is raised and nothing is saved.
+        Params that have already been stored are ignored, and are not
+        returned (see bulk_create_ignore_duplicates).
+
+        """
+        lead_sources = [self.build_from_utm_params(user, p) for p in params_list]
+        return self.bulk_create_ignore_duplicates(lead_sources, fetch_pks=True)
+
+    async def acreate_from_utm_params(
+        self, user: type[Model], utm_params: UtmParamsDict
+    ) -> LeadSource:
+        """Async version of create_from_utm_params."""
+        return await sync_to_async(self.create_from_utm_params)(user, utm_params)
+
+    async def abulk_create_from_utm_params(
+        self, user: type[Model], params_list: list[UtmParamsDict]
+    ) -> list[LeadSource]:
+        """Async version of bulk_create_from_utm_params."""
+        return await sync_to_async(self.bulk_create_from_utm_params)(user, params_list)
 
 
 class LeadSource(models.Model):
@@ -156,17 +466,375 @@ class LeadSource(models.Model):
     created_at = models.DateTimeField(
         default=timezone.now, help_text="When the event was recorded."
     )
+    fingerprint = models.CharField(
+        max_length=64,
+        unique=True,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text=(
+            "Hash of the user, timestamp and all params - used to prevent "
+            "the same event being recorded twice."
+        ),
+    )
+
+    # normalized storage for medium, source and campaign - see UtmDimension
+    medium_ref = models.ForeignKey(
+        "UtmDimension",
+        on_delete=models.PROTECT,
+        related_name="+",
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=False,
+    )
+    source_ref = models.ForeignKey(
+        "UtmDimension",
+        on_delete=models.PROTECT,
+        related_name="+",
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=False,
+    )
+    campaign_ref = models.ForeignKey(
+        "UtmDimension",
+        on_delete=models.PROTECT,
+        related_name="+",
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=False,
+    )
 
     objects = LeadSourceManager()
 
     class Meta:
         get_latest_by = ("timestamp",)
+        indexes = [
+            # per-user lookups, e.g. user.lead_sources.latest()
+            models.Index(
+                fields=["user", "timestamp"], name="utm_ls_user_timestamp_idx"
+            ),
+            # admin filtering / reporting by source and medium - and search
+            # on the start of the source or medium. On PostgreSQL the text
+            # columns use varchar_pattern_ops, as an index using the default
+            # operator class cannot be used for LIKE 'x%' with a non-C
+            # collation (other databases ignore the opclasses).
+            models.Index(
+                fields=["source", "medium", "timestamp"],
+                name="utm_ls_src_med_ts_idx",
+                opclasses=["varchar_pattern_ops", "varchar_pattern_ops", ""],
+            ),
+            models.Index(
+                fields=["medium", "timestamp"],
+                name="utm_ls_med_ts_idx",
+                opclasses=["varchar_pattern_ops", ""],
+            ),
+            # LeadSource.objects.latest(), and admin filtering by date
+            models.Index(fields=["timestamp"], name="utm_ls_timestamp_idx"),
+            # range scans on created_at, e.g. incremental processing
+            models.Index(fields=["created_at"], name="utm_ls_created_at_idx"),
+            # as above, for normalized dimensions - these are partial, so
+            # that they are empty (and cost nothing to maintain on insert)
+            # unless UTM_TRACKER_NORMALIZE_DIMENSIONS is enabled.
+            models.Index(
+                fields=["source_ref", "medium_ref", "timestamp"],
+                name="utm_ls_src_med_ref_ts_idx",
+                condition=Q(source_ref__isnull=False),
+            ),
+            models.Index(
+                fields=["medium_ref"],
+                name="utm_ls_medium_ref_idx",
+                condition=Q(medium_ref__isnull=False),
+            ),
+            models.Index(
+                fields=["campaign_ref"],
+                name="utm_ls_campaign_ref_idx",
+                condition=Q(campaign_ref__isnull=False),
+            ),
+        ]
 
     def __str__(self) -> str:
-        return f"Lead source {self.id} for {self.user}: {self.medium}/{self.source}"
+        return (
+            f"Lead source {self.id} for {self.user}: "
+            f"{self.utm_medium}/{self.utm_source}"
+        )
 
     def __repr__(self) -> str:
         return (
             f"<LeadSource id={self.id} user={self.user_id} "
-            f"medium='{self.medium}' source='{self.source}'>"
+            f"medium='{self.utm_medium}' source='{self.utm_source}'>"
         )
+
+    def get_dimension(self, name: str) -> str:
+        """Return the medium, source or campaign - however it is stored."""
+        if value := getattr(self, name):
+            return value
+        if ref_id := getattr(self, f"{name}_ref_id"):
+            # use the related object if it was loaded with select_related
+            if self._meta.get_field(f"{name}_ref").is_cached(self):
+                return getattr(self, f"{name}_ref").value
+            return UtmDimension.objects.get_value(ref_id)
+        return ""
+
+    @property
+    def utm_medium(self) -> str:
+        return self.get_dimension("medium")
+
+    @property
+    def utm_source(self) -> str:
+        return self.get_dimension("source")
+
+    @property
+    def utm_campaign(self) -> str:
+        return self.get_dimension("campaign")
+
+    def normalize_dimensions(self) -> None:
+        """Move the medium, source and campaign values to UtmDimension refs."""
+        for name in DIMENSIONS:
+            if value := getattr(self, name):
+                ref_id = UtmDimension.objects.get_id(name, value)
+                setattr(self, f"{name}_ref_id", ref_id)
+                setattr(self, name, "")
+
+    def denormalize_dimensions(self) -> None:
+        """Move the medium, source and campaign values back from the refs."""
+        for name in DIMENSIONS:
+            if ref_id := getattr(self, f"{name}_ref_id"):
+                setattr(self, name, UtmDimension.objects.get_value(ref_id))
+                setattr(self, f"{name}_ref_id", None)
+
+    def to_dict(self) -> dict[str, Any]:
+        """
+        Return a JSON-serializable dict of all the field values.
+
+        Normalized medium, source and campaign values are resolved (and the
+        UtmDimension ids are not included), so that the dict does not
+        depend on the UtmDimension table.
+
+        """
+        record = {}
+        refs = {f"{name}_ref_id" for name in DIMENSIONS}
+        for field in self._meta.concrete_fields:
+            if field.attname in refs:
+                continue
+            value: Any
+            if field.attname in DIMENSIONS:
+                value = self.get_dimension(field.attname)
+            else:
+                value = getattr(self, field.attname)
+            if isinstance(value, datetime.datetime):
+                value = value.isoformat()
+            record[field.attname] = value
+        return record
+
+
+class LeadSourceTag(models.Model):
+    """
+    Indexed copy of a LeadSource custom tag.
+
+    The custom tags listed in UTM_TRACKER_INDEXED_TAGS are copied into
+    this table when LeadSource objects are created, so that they can be
+    queried efficiently (see LeadSourceQuerySet.with_custom_tag).
+
+    """
+
+    lead_source = models.ForeignKey(
+        LeadSource, on_delete=models.CASCADE, related_name="tags"
+    )
+    MAX_VALUE_LENGTH = 255
+
+    name = models.CharField(max_length=100)
+    value = models.CharField(max_length=MAX_VALUE_LENGTH)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["lead_source", "name"], name="utm_ls_tag_unique"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["name", "value"], name="utm_ls_tag_name_value_idx")
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.name}={self.value}"
+
+    @classmethod
+    def to_value(cls, value: Any) -> str:
+        """Return a custom tag value as stored (truncated) in the table."""
+        return str(value)[: cls.MAX_VALUE_LENGTH]
+
+
+class UtmDimensionManager(models.Manager):
+    # in-process cache of (kind, value) -> id, and id -> value - there are
+    # typically only a few hundred distinct values, but as they come from
+    # querystrings there is no upper bound, so the cache is capped.
+    max_cache_size = 10_000
+    ids: dict[tuple[str, str], int] = {}
+    values: dict[int, str] = {}
+
+    def cache(self, kind: str, value: str, pk: int) -> None:
+        if len(self.values) >= self.max_cache_size:
+            self.clear_cache()
+        self.ids[(kind, value)] = pk
+        self.values[pk] = value
+
+    def cache_on_commit(self, dimension: UtmDimension) -> None:
+        """
+        Cache the dimension once the current transaction is committed.
+
+        The row may have been created (or read) inside a transaction that
+        is later rolled back, in which case the id is not valid - and if
+        it was cached every LeadSource that referenced it would fail.
+
+        """
+        transaction.on_commit(
+            lambda: self.cache(dimension.kind, dimension.value, dimension.pk),
+            using=self.db,
+        )
+
+    def clear_cache(self) -> None:
+        self.ids.clear()
+        self.values.clear()
+
+    def get_id(self, kind: str, value: str) -> int:
+        """Return the id of the dimension value, creating it if required."""
+        try:
+            return self.ids[(kind, value)]
+        except KeyError:
+            pass
+        dimension, _ = self.get_or_create(kind=kind, value=value)
+        self.cache_on_commit(dimension)
+        return dimension.pk
+
+    def find_id(self, kind: str, value: str) -> int | None:
+        """Return the id of the dimension value, or None if it does not exist."""
+        try:
+            return self.ids[(kind, value)]
+        except KeyError:
+            pass
+        if dimension := self.filter(kind=kind, value=value).first():
+            self.cache_on_commit(dimension)
+            return dimension.pk
+        return None
+
+    def get_value(self, pk: int) -> str:
+        """Return the dimension value for an id."""
+        try:
+            return self.values[pk]
+        except KeyError:
+            pass
+        dimension = self.get(pk=pk)
+        self.cache_on_commit(dimension)
+        return dimension.value
+
+
+class UtmDimension(models.Model):
+    """
+    Distinct utm_medium, utm_source and utm_campaign values.
+
+    If UTM_TRACKER_NORMALIZE_DIMENSIONS is enabled, new LeadSource objects
+    store these values as foreign keys to this table, rather than repeating
+    the strings on each row. The values are cached in-process, so in the
+    steady state no extra queries are required to resolve them.
+
+    """
+
+    kind = models.CharField(
+        max_length=10, choices=[(name, name) for name in DIMENSIONS]
+    )
+    value = models.CharField(max_length=100)
+
+    objects = UtmDimensionManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["kind", "value"], name="utm_dimension_unique"
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.kind}: {self.value}"
+
+
+class Checkpoint(models.Model):
+    """
+    Stores the progress of incremental (resumable) jobs.
+
+    Each job has a unique name, and is free to store whatever it needs to
+    in the value field - e.g. a timestamp, or the last primary key it
+    processed.
+
+    """
+
+    name = models.CharField(max_length=100, unique=True)
+    value = models.CharField(max_length=100, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"Checkpoint {self.name}: {self.value}"
+
+
+class LeadSourceDailyStat(models.Model):
+    """
+    Daily count of LeadSource objects by source, medium and campaign.
+
+    This is a rollup table that is updated incrementally by the
+    rollup_lead_sources management command, so that reporting can be
+    done without scanning the LeadSource table. The date is the date (in
+    the current time zone) of the event timestamp, or created_at if the
+    timestamp is unknown.
+
+    """
+
+    date = models.DateField()
+    source = models.CharField(max_length=100)
+    medium = models.CharField(max_length=100)
+    campaign = models.CharField(max_length=100, blank=True)
+    count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "source", "medium", "campaign"],
+                name="utm_daily_stat_unique",
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.date}: {self.source}/{self.medium}/{self.campaign}"
+
+
+class LandingDailyStat(models.Model):
+    """
+    Daily count of tagged landings by source, medium and campaign.
+
+    Unlike LeadSourceDailyStat this includes anonymous visitors - each
+    request with utm_source and utm_medium params is counted (in memory)
+    by UtmSessionMiddleware, and the counts are added to this table
+    periodically (see landings.py), if UTM_TRACKER_LANDING_COUNTS is set.
+    The date is the date of the request, in the current time zone.
+
+    """
+
+    date = models.DateField()
+    source = models.CharField(max_length=100)
+    medium = models.CharField(max_length=100)
+    campaign = models.CharField(max_length=100, blank=True)
+    count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "source", "medium", "campaign"],
+                name="utm_landing_stat_unique",
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.date}: {self.source}/{self.medium}/{self.campaign}"
@@ -1,23 +1,52 @@
+from __future__ import annotations
+
 from django.http import HttpRequest
 
-from .settings import CUSTOM_TAGS
+from .settings import (  # noqa: F401 - re-exported
+    VALID_AD_PARAMS,
+    VALID_UTM_PARAMS,
+    compile_tracked_keys_pattern,
+    get_config,
+)
 from .types import UtmParamsDict
 
-VALID_UTM_PARAMS = [
-    "utm_source",
-    "utm_medium",
-    "utm_campaign",
-    "utm_term",
-    "utm_content",
-]
-# additional service-specific parameters
-VALID_AD_PARAMS = [
-    "gclid",  # Google ad click
-    "aclk",  # Bing ad click
-    "msclkid",  # MSFT ad click (non-Bing)
-    "fbclid",  # Facebook ad click
-    "twclid",  # Twitter ad click
-]
+
+def has_tracked_params(request: HttpRequest) -> bool:
+    """
+    Return True if the raw querystring may contain tracked params.
+
+    This is a cheap pre-filter that runs against the raw QUERY_STRING, so
+    that requests with no tracked params (the vast majority) do not have
+    to build request.GET, or touch the session. It may return True for
+    keys with empty values (which parse_qs then ignores), but it will not
+    return False for a querystring that parse_qs would extract values from
+    (unless the keys themselves are percent-encoded).
+
+    """
+    query_string = request.META.get("QUERY_STRING", "")
+    if not query_string:
+        return False
+    return get_config().tracked_keys_pattern.search(query_string) is not None
+
+
+def get_ignored_reason(request: HttpRequest) -> str | None:
+    """
+    Return why the request should not be tracked, or None if it should be.
+
+    Returns "user_agent" if the User-Agent matches UTM_TRACKER_IGNORED_USER_AGENTS
+    (crawlers and link-preview bots by default), or "path" if the path matches
+    UTM_TRACKER_IGNORED_PATHS. Like has_tracked_params this only reads
+    request.META and request.path, so that the session is not accessed.
+
+    """
+    config = get_config()
+    if pattern := config.ignored_user_agents_pattern:
+        if pattern.search(request.META.get("HTTP_USER_AGENT", "")):
+            return "user_agent"
+    if pattern := config.ignored_paths_pattern:
+        if pattern.match(request.path):
+            return "path"
+    return None
 
 
 def parse_qs(request: HttpRequest) -> UtmParamsDict:
@@ -29,27 +58,24 @@ def parse_qs(request: HttpRequest) -> UtmParamsDict:
     not appear in valid querystrings, so this may have an unpredictable
     outcome. Look after your querystrings.
 
-    This function parses three separate chunks of qs values - first it
-    parses the utm_* tags, then it adds the ad click ids, then it adds
-    custom tags the user wishes to stash.
+    This function makes a single pass over the querystring, looking up
+    each key in a table of handlers - utm_* values are lowercased, the ad
+    click ids are stored as-is (as they are typically BASE64 encoded), and
+    custom tags (which may be a list) are comma-separated.
 
-    """
-    utm_keys = {
-        str(k).lower(): str(v).lower()
-        for k, v in request.GET.items()
-        if k in VALID_UTM_PARAMS and v != ""
-    }
-
-    for ad_key in VALID_AD_PARAMS:
-        if akey := request.GET.get(ad_key):
-            # We don't want to lowercase the ad key, as they are
-            # typically BASE64 encoded
-            utm_keys[ad_key] = akey
-
-    # add in any custom tags we have decided to stash
-    for tag in CUSTOM_TAGS:
-        # custom tags may be a list
-        if val := request.GET.getlist(tag):
-            utm_keys[tag] = ",".join(val)
+    If UTM_TRACKER_CASE_INSENSITIVE_KEYS is True then keys are matched
+    regardless of case.
 
+    """
+    config = get_config()
+    handlers = config.key_handlers
+    ignore_case = config.case_insensitive_keys
+    utm_keys: UtmParamsDict = {}
+    for key, values in request.GET.lists():
+        if ignore_case:
+            key = key.lower()
+        if entry := handlers.get(key):
+            name, handler = entry
+            if (value := handler(values)) is not None:
+                utm_keys[name] = value
     return utm_keys
@@ -0,0 +1,133 @@
+"""
+Incremental rollup of LeadSource objects into LeadSourceDailyStat.
+
+Each run processes the LeadSource objects created since the last run (the
+high-water mark is stored in a Checkpoint), and adds their counts to the
+daily stats. The rollup and the checkpoint are updated in the same
+transaction, so each LeadSource is counted exactly once.
+
+"""
+
+from __future__ import annotations
+
+import datetime
+
+from django.db import transaction
+from django.db.models import Count, Min
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now as tz_now
+
+from .models import Checkpoint, LeadSource, LeadSourceDailyStat, dimension_value
+
+CHECKPOINT_NAME = "leadsource_daily_stats"
+
+StatKey = tuple[datetime.date, str, str, str]
+
+
+def get_high_water_mark() -> datetime.datetime | None:
+    """Return the created_at value up to which the rollup is complete."""
+    checkpoint = Checkpoint.objects.filter(name=CHECKPOINT_NAME).first()
+    if checkpoint and checkpoint.value:
+        return parse_datetime(checkpoint.value)
+    return None
+
+
+def count_lead_sources(
+    since: datetime.datetime | None, until: datetime.datetime
+) -> dict[StatKey, int]:
+    """Return counts of LeadSource objects created in (since, until]."""
+    queryset = LeadSource.objects.filter(created_at__lte=until)
+    if since:
+        queryset = queryset.filter(created_at__gt=since)
+    rows = (
+        queryset.annotate(
+            date=TruncDate(Coalesce("timestamp", "created_at")),
+            # resolves values stored in UtmDimension (if normalized)
+            source_value=dimension_value("source"),
+            medium_value=dimension_value("medium"),
+            campaign_value=dimension_value("campaign"),
+        )
+        .values_list("date", "source_value", "medium_value", "campaign_value")
+        .annotate(count=Count("id"))
+        .order_by()
+    )
+    return {
+        (date, source, medium, campaign): n
+        for date, source, medium, campaign, n in rows
+    }
+
+
+def add_counts(counts: dict[StatKey, int]) -> None:
+    """Add counts to the daily stats (must be called inside a transaction)."""
+    if not counts:
+        return
+    dates = {key[0] for key in counts}
+    existing = {
+        (s.date, s.source, s.medium, s.campaign): s
+        for s in LeadSourceDailyStat.objects.select_for_update().filter(date__in=dates)
+    }
+    to_update, to_create = [], []
+    updated_at = tz_now()
+    for key, count in counts.items():
+        if stat := existing.get(key):
+            stat.count += count
+            stat.updated_at = updated_at
+            to_update.append(stat)
+        else:
+            date, source, medium, campaign = key
+            to_create.append(
+                LeadSourceDailyStat(
+                    date=date,
+                    source=source,
+                    medium=medium,
+                    campaign=campaign,
+                    count=count,
+                )
+            )
+    LeadSourceDailyStat.objects.bulk_update(to_update, ["count", "updated_at"])
+    LeadSourceDailyStat.objects.bulk_create(to_create)
+
+
+def rollup_lead_sources(
+    lag: datetime.timedelta = datetime.timedelta(minutes=5),
+    window: datetime.timedelta = datetime.timedelta(days=1),
+) -> int:
+    """
+    Roll up all LeadSource objects created since the last run.
+
+    Objects created in the last `lag` are not processed, as they may be
+    in transactions that have not yet been committed (or in the write-
+    behind buffer), and would otherwise be missed. The objects are
+    processed in windows of `window` (of created_at), each in its own
+    transaction, so the first run over a large table does not hold locks
+    for a long time.
+
+    Returns the number of LeadSource objects processed.
+
+    """
+    until = tz_now() - lag
+    since = get_high_water_mark()
+    if since is None:
+        earliest = LeadSource.objects.aggregate(earliest=Min("created_at"))["earliest"]
+        if earliest is None:
+            return 0
+        # the window is exclusive of since, so start just before the earliest
+        since = earliest - datetime.timedelta(microseconds=1)
+    processed = 0
+    while since < until:
+        window_end = min(since + window, until)
+        with transaction.atomic():
+            checkpoint, _ = Checkpoint.objects.select_for_update().get_or_create(
+                name=CHECKPOINT_NAME
+            )
+            # another process may have moved the checkpoint on
+            if checkpoint.value and parse_datetime(checkpoint.value) != since:
+                return processed
+            counts = count_lead_sources(since, window_end)
+            add_counts(counts)
+            checkpoint.value = window_end.isoformat()
+            checkpoint.save()
+        processed += sum(counts.values())
+        since = window_end
+    return processed
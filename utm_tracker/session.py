@@ -1,26 +1,131 @@
+import hashlib
+import json
 import logging
 from typing import Any, List
 
+from asgiref.sync import sync_to_async
 from django.contrib.sessions.backends.base import SessionBase
 from django.utils.timezone import now as tz_now
 
+from . import metrics
+from .buffer import lead_source_buffer
+from .encoding import EncodedUtmParams, decode_utm_params, encode_utm_params
 from .models import LeadSource
+from .settings import get_config
+from .sinks import awrite_lead_sources, write_lead_sources
 from .types import UtmParamsDict
 
 SESSION_KEY_UTM_PARAMS = "utm_params"
+SESSION_KEY_UTM_FINGERPRINTS = "utm_params_fp"
+
+# the async session API (aget, aset, apop, ...) was added in Django 5.1
+ASYNC_SESSIONS = hasattr(SessionBase, "aget")
+
+# each stashed entry is either a legacy dict, or compact list (see encoding.py)
+StashedUtmParams = List[EncodedUtmParams | UtmParamsDict]
 
 logger = logging.getLogger(__name__)
 
 
-def strip_timestamps(params_list: List[UtmParamsDict]) -> List[UtmParamsDict]:
+def fingerprint_utm_params(params: UtmParamsDict) -> str:
     """
-    Return a copy of the session params without timestamps.
+    Return a short hash of the params, ignoring the timestamp.
 
-    The stashed params include a timestamp, which we need to pop as it
+    The stashed params include a timestamp, which we need to ignore as it
     will change on each request, and we don't want that.
 
     """
-    return [{k: v for k, v in p.items() if k != "timestamp"} for p in params_list]
+    values = sorted((k, v) for k, v in params.items() if k != "timestamp")
+    data = json.dumps(values, separators=(",", ":")).encode()
+    return hashlib.blake2b(data, digest_size=6).hexdigest()
+
+
+def decode_stashed_params(stashed: StashedUtmParams) -> List[UtmParamsDict]:
+    """Return the list of utm_params dicts from the stashed (encoded) list."""
+    return [decode_utm_params(p) for p in stashed]
+
+
+def get_fingerprints(
+    stashed: StashedUtmParams, fingerprints: List[str] | None
+) -> List[str]:
+    """
+    Return the fingerprints for each of the stashed params.
+
+    The fingerprints are stored in the session alongside the params, but
+    may be missing (or out of sync) if the params were stashed by an older
+    version, or by something else, in which case they are recalculated.
+
+    """
+    if fingerprints is not None and len(fingerprints) == len(stashed):
+        return fingerprints
+    return [fingerprint_utm_params(p) for p in decode_stashed_params(stashed)]
+
+
+def evict_utm_params(
+    stashed: StashedUtmParams, fingerprints: List[str], limit: int | None = None
+) -> int:
+    """
+    Remove entries (in place) according to the configured eviction policy.
+
+    Entries are removed until there are no more than limit left - which
+    defaults to UTM_TRACKER_MAX_STASHED_PARAMS.
+
+    Returns the number of entries evicted.
+
+    """
+    config = get_config()
+    max_stashed = config.max_stashed_params if limit is None else limit
+    if max_stashed is None:
+        return 0
+    evicted = 0
+    while len(stashed) > max_stashed:
+        if config.eviction_policy == "first":
+            index = -1
+        elif config.eviction_policy == "last":
+            index = 0
+        else:
+            index = max_stashed // 2
+        del stashed[index]
+        del fingerprints[index]
+        evicted += 1
+    return evicted
+
+
+def append_utm_params(
+    stashed: StashedUtmParams, fingerprints: List[str], params: UtmParamsDict
+) -> bool:
+    """
+    Append params to the stashed list (in place) if they are not already in it.
+
+    The params are stored using the compact encoding, unless
+    UTM_TRACKER_COMPACT_SESSION is False, and their fingerprint is added
+    to the fingerprints list. Entries are then evicted if the list is
+    longer than UTM_TRACKER_MAX_STASHED_PARAMS.
+
+    Returns True if the params were appended (and not evicted).
+
+    NB the duplicate check is a linear scan of the fingerprints, so it is
+    O(n) in the number of params stashed - as are loading and saving the
+    session - and n is only bounded by UTM_TRACKER_MAX_STASHED_PARAMS. A
+    set would not help, as it would have to be built from the list (which
+    is what the session stores) for each lookup.
+
+    """
+    fingerprint = fingerprint_utm_params(params)
+    if fingerprint in fingerprints:
+        metrics.incr("deduped")
+        return False
+    # cast to str so that it can be serialized in session; value is
+    # recast to datetime automatically when the object is created.
+    params["timestamp"] = tz_now().isoformat()
+    compact = get_config().compact_session
+    stashed.append(encode_utm_params(params) if compact else params)
+    fingerprints.append(fingerprint)
+    metrics.incr("evicted", evict_utm_params(stashed, fingerprints))
+    if fingerprints[-1:] != [fingerprint]:
+        return False
+    metrics.incr("stashed")
+    return True
 
 
 def stash_utm_params(session: SessionBase, params: UtmParamsDict) -> bool:
@@ -36,22 +141,113 @@ def stash_utm_params(session: SessionBase, params: UtmParamsDict) -> bool:
     if not params:
         return False
 
-    session.setdefault(SESSION_KEY_UTM_PARAMS, [])
-    if params in strip_timestamps(session[SESSION_KEY_UTM_PARAMS]):
+    stashed = session.get(SESSION_KEY_UTM_PARAMS, [])
+    fingerprints = get_fingerprints(stashed, session.get(SESSION_KEY_UTM_FINGERPRINTS))
+    if not append_utm_params(stashed, fingerprints, params):
         return False
-    # cast to str so that it can be serialized in session; value is
-    # recast to datetime automatically when the object is created.
-    params["timestamp"] = tz_now().isoformat()
-    session[SESSION_KEY_UTM_PARAMS].append(params)
-    # because we are adding to a list, we are not actually changing the
-    # session object itself, so we need to force it to be saved.
+    session[SESSION_KEY_UTM_PARAMS] = stashed
+    session[SESSION_KEY_UTM_FINGERPRINTS] = fingerprints
+    # because we may be adding to an existing list, we are not actually
+    # changing the session object itself, so we need to force it to be saved.
     session.modified = True
     return True
 
 
+async def astash_utm_params(session: SessionBase, params: UtmParamsDict) -> bool:
+    """Async version of stash_utm_params."""
+    if not params:
+        return False
+
+    if not ASYNC_SESSIONS:
+        return await sync_to_async(stash_utm_params)(session, params)
+
+    stashed = await session.aget(SESSION_KEY_UTM_PARAMS, [])
+    fingerprints = get_fingerprints(
+        stashed, await session.aget(SESSION_KEY_UTM_FINGERPRINTS)
+    )
+    if not append_utm_params(stashed, fingerprints, params):
+        return False
+    await session.aset(SESSION_KEY_UTM_PARAMS, stashed)
+    await session.aset(SESSION_KEY_UTM_FINGERPRINTS, fingerprints)
+    return True
+
+
+def has_utm_params(session: SessionBase) -> bool:
+    """Return True if the session contains stashed utm_params."""
+    return SESSION_KEY_UTM_PARAMS in session
+
+
+async def ahas_utm_params(session: SessionBase) -> bool:
+    """Async version of has_utm_params."""
+    if not ASYNC_SESSIONS:
+        return await sync_to_async(has_utm_params)(session)
+    return await session.ahas_key(SESSION_KEY_UTM_PARAMS)
+
+
 def pop_utm_params(session: SessionBase) -> List[UtmParamsDict]:
-    """Pop the list of utm_param dicts from a session."""
-    return session.pop(SESSION_KEY_UTM_PARAMS, [])
+    """Pop (and decode) the list of utm_param dicts from a session."""
+    session.pop(SESSION_KEY_UTM_FINGERPRINTS, None)
+    return decode_stashed_params(session.pop(SESSION_KEY_UTM_PARAMS, []))
+
+
+async def apop_utm_params(session: SessionBase) -> List[UtmParamsDict]:
+    """Async version of pop_utm_params."""
+    if not ASYNC_SESSIONS:
+        return await sync_to_async(pop_utm_params)(session)
+    await session.apop(SESSION_KEY_UTM_FINGERPRINTS, None)
+    return decode_stashed_params(await session.apop(SESSION_KEY_UTM_PARAMS, []))
+
+
+def build_lead_sources(user: Any, params_list: List[UtmParamsDict]) -> List[LeadSource]:
+    """
+    Return unsaved LeadSource objects for each valid utm_params dict.
+
+    Any invalid params (e.g. missing utm_source) are logged and discarded.
+
+    """
+    lead_sources = []
+    for params in params_list:
+        try:
+            lead_sources.append(LeadSource.objects.build_from_utm_params(user, params))
+        except ValueError as ex:
+            msg = str(ex)
+            logger.debug("Unable to save utm_params %s: %s", params, msg)
+            metrics.incr("rejected")
+    return lead_sources
+
+
+def persist_lead_sources(lead_sources: List[LeadSource]) -> List[LeadSource]:
+    """
+    Write the objects to the sinks, or queue them in write-behind mode.
+
+    Returns the objects that were saved (see write_lead_sources), or in
+    write-behind mode all of the (queued, and so unsaved) objects.
+
+    """
+    if get_config().write_behind:
+        if overflow := lead_source_buffer.put(lead_sources):
+            write_lead_sources(overflow)
+        return lead_sources
+    return write_lead_sources(lead_sources, fetch_pks=True)
+
+
+async def apersist_lead_sources(lead_sources: List[LeadSource]) -> List[LeadSource]:
+    """Async version of persist_lead_sources."""
+    if get_config().write_behind:
+        if overflow := lead_source_buffer.put(lead_sources):
+            await awrite_lead_sources(overflow)
+        return lead_sources
+    return await awrite_lead_sources(lead_sources, fetch_pks=True)
+
+
+async def abuild_lead_sources(
+    user: Any, params_list: List[UtmParamsDict]
+) -> List[LeadSource]:
+    """Async version of build_lead_sources."""
+    if get_config().normalize_dimensions:
+        # resolving dimension ids may require database access
+        return await sync_to_async(build_lead_sources)(user, params_list)
+    return build_lead_sources(user, params_list)
 
 
 def dump_utm_params(user: Any, session: SessionBase) -> List[LeadSource]:
@@ -61,15 +257,27 @@ def dump_utm_params(user: Any, session: SessionBase) -> List[LeadSource]:
     Calling this function will remove all existing utm_params from the
     current session.
 
-    Returns a list of LeadSource objects created - one for each utm_params
-    dict found in the session.
+    All of the valid utm_params are written to the configured sinks (by
+    default the database, in a single bulk INSERT) as one batch - any
+    invalid params (e.g. missing utm_source) are logged and discarded.
+
+    Returns a list of LeadSource objects created - one for each valid
+    utm_params dict found in the session that had not already been stored.
+
+    If UTM_TRACKER_WRITE_BEHIND is enabled the objects are queued, and
+    written later by a background thread, so the objects returned will
+    not have been saved yet (and may include duplicates).
 
     """
-    created = []
-    for params in pop_utm_params(session):
-        try:
-            created.append(LeadSource.objects.create_from_utm_params(user, params))
-        except ValueError as ex:
-            msg = str(ex)
-            logger.debug("Unable to save utm_params %s: %s", params, msg)
-    return created
+    lead_sources = build_lead_sources(user, pop_utm_params(session))
+    if lead_sources:
+        return persist_lead_sources(lead_sources)
+    return []
+
+
+async def adump_utm_params(user: Any, session: SessionBase) -> List[LeadSource]:
+    """Async version of dump_utm_params."""
+    lead_sources = await abuild_lead_sources(user, await apop_utm_params(session))
+    if lead_sources:
+        return await apersist_lead_sources(lead_sources)
+    return []
@@ -1,4 +1,263 @@
+"""
+Configuration for utm_tracker, compiled from the UTM_TRACKER_* settings.
+
+The settings are read (and the derived lookup tables built) once, on the
+first call to get_config(), and the config is rebuilt if any of the
+settings is changed (e.g. by override_settings in tests). Code on the
+request path should call get_config() on each use, rather than storing
+the config, so that it sees the current settings.
+
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Any, Callable, List, Optional
+
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+VALID_UTM_PARAMS = [
+    "utm_source",
+    "utm_medium",
+    "utm_campaign",
+    "utm_term",
+    "utm_content",
+]
+# additional service-specific parameters
+VALID_AD_PARAMS = [
+    "gclid",  # Google ad click
+    "aclk",  # Bing ad click
+    "msclkid",  # MSFT ad click (non-Bing)
+    "fbclid",  # Facebook ad click
+    "twclid",  # Twitter ad click
+]
+
+# param: (LeadSource field, max length)
+PARAM_FIELDS = {
+    "utm_medium": ("medium", 100),
+    "utm_source": ("source", 100),
+    "utm_campaign": ("campaign", 100),
+    "utm_term": ("term", 100),
+    "utm_content": ("content", 100),
+    "gclid": ("gclid", 255),
+    "msclkid": ("msclkid", 255),
+    "aclk": ("aclk", 255),
+    "twclid": ("twclid", 255),
+    "fbclid": ("fbclid", 255),
+}
+
+# user agents of common crawlers and link-preview bots that follow tagged
+# URLs (these are case-insensitive regex fragments). NB app names must only
+# match the app's fetcher, not its in-app browser - e.g. the Pinterest app
+# browser includes "[Pinterest/iOS]", and the crawler is caught by "bot".
+DEFAULT_IGNORED_USER_AGENTS = [
+    # "Googlebot/2.1", "AdsBot-Google", "bingbot/2.0;" - but not phones such
+    # as the CUBOT P30 / CUBOT_X30
+    "bot[/;-]",
+    "googlebot",
+    "bingbot",
+    "telegrambot",
+    "crawler",
+    "spider",
+    "slurp",
+    "facebookexternalhit",
+    "facebookcatalog",
+    "embedly",
+    "quora link preview",
+    "outbrain",
+    "vkshare",
+    "w3c_validator",
+    # the link-preview fetcher ("WhatsApp/2.23.20.0 A") - not the app
+    "^whatsapp/",
+    "headlesschrome",
+    "lighthouse",
+    "python-requests",
+    "curl/",
+    "wget/",
+]
+
+# Each handler takes the list of values for a querystring key, and returns
+# the value to store, or None if the key should be ignored.
+KeyHandler = Callable[[List[str]], Optional[str]]
+
+
+def lowercase_value(values: List[str]) -> str | None:
+    """Return the last value, lowercased (utm_* params)."""
+    return values[-1].lower() or None
+
+
+def raw_value(values: List[str]) -> str | None:
+    """Return the last value, unchanged (ad click ids, which are encoded)."""
+    return values[-1] or None
+
+
+def join_values(values: List[str]) -> str | None:
+    """Return all of the values, comma-separated (custom tags)."""
+    return ",".join(values)
+
+
+def compile_tracked_keys_pattern(
+    custom_tags: list[str], ignore_case: bool = False
+) -> re.Pattern[str]:
+    """
+    Return a regex that matches any tracked key in a raw querystring.
+
+    The pattern matches a key at the start of the string or after an '&',
+    and followed by '=', '&' or the end of the string - so 'utm_source=x'
+    and 'a=1&gclid=x' both match, but 'not_utm_source=x' does not.
+
+    """
+    keys = VALID_UTM_PARAMS + VALID_AD_PARAMS + list(custom_tags)
+    alternatives = "|".join(re.escape(k) for k in keys)
+    flags = re.IGNORECASE if ignore_case else 0
+    return re.compile(rf"(?:^|&)(?:{alternatives})(?:=|&|$)", flags)
+
+
+def build_key_handlers(
+    custom_tags: list[str], ignore_case: bool
+) -> dict[str, tuple[str, KeyHandler]]:
+    """
+    Return the map of querystring key to (param name, handler).
+
+    If ignore_case is True the map is keyed on the lowercased key, so that
+    e.g. 'UTM_Source' is stored as 'utm_source'.
+
+    """
+    handlers: dict[str, KeyHandler] = {}
+    handlers.update((key, lowercase_value) for key in VALID_UTM_PARAMS)
+    handlers.update((key, raw_value) for key in VALID_AD_PARAMS)
+    handlers.update((tag, join_values) for tag in custom_tags)
+    return {
+        (key.lower() if ignore_case else key): (key, handler)
+        for key, handler in handlers.items()
+    }
+
+
+def compile_patterns(
+    patterns: list[str], ignore_case: bool = False
+) -> re.Pattern[str] | None:
+    """Return a single regex that matches any of the patterns (or None)."""
+    if not patterns:
+        return None
+    flags = re.IGNORECASE if ignore_case else 0
+    return re.compile("|".join(f"(?:{p})" for p in patterns), flags)
+
+
+def get_setting(name: str, default: Any) -> Any:
+    return getattr(settings, f"UTM_TRACKER_{name}", default)
+
+
+class TrackerConfig:
+    def __init__(self) -> None:
+        # list of custom args to extract from the querystring
+        self.custom_tags: list[str] = list(get_setting("CUSTOM_TAGS", []))
+        # if True, querystring keys are matched regardless of case, e.g.
+        # UTM_Source
+        self.case_insensitive_keys: bool = get_setting("CASE_INSENSITIVE_KEYS", False)
+        self.utm_params = frozenset(VALID_UTM_PARAMS)
+        self.ad_params = frozenset(VALID_AD_PARAMS)
+        self.tracked_keys = self.utm_params | self.ad_params | set(self.custom_tags)
+        self.tracked_keys_pattern = compile_tracked_keys_pattern(
+            self.custom_tags, self.case_insensitive_keys
+        )
+        self.key_handlers = build_key_handlers(
+            self.custom_tags, self.case_insensitive_keys
+        )
+        self.param_fields = PARAM_FIELDS
+
+        # requests from matching user agents (case-insensitive), or to
+        # matching paths, are not tracked - so that crawlers following
+        # tagged links do not create sessions. The patterns are regexes.
+        self.ignored_user_agents_pattern = compile_patterns(
+            get_setting("IGNORED_USER_AGENTS", DEFAULT_IGNORED_USER_AGENTS),
+            ignore_case=True,
+        )
+        self.ignored_paths_pattern = compile_patterns(get_setting("IGNORED_PATHS", []))
+
+        # name of the cookie used to flag that the session contains utm_params
+        # that have not yet been persisted - if set, LeadSourceMiddleware will
+        # only read the session when this cookie is present.
+        self.pending_cookie: str | None = get_setting("PENDING_COOKIE", None)
+
+        # cookie-only mode - if set, stashed params are stored in a signed
+        # cookie of this name, rather than in the session, so that anonymous
+        # visitors need no server-side state. The cookie value is limited to
+        # stash_cookie_max_size bytes - entries are evicted to make it fit.
+        self.stash_cookie: str | None = get_setting("STASH_COOKIE", None)
+        self.stash_cookie_max_size: int = get_setting("STASH_COOKIE_MAX_SIZE", 2048)
+
+        # write-behind mode - if enabled, LeadSource objects are queued in
+        # memory and saved in batches by a background thread, rather than
+        # inside the request.
+        self.write_behind: bool = get_setting("WRITE_BEHIND", False)
+        # max number of objects held in the queue - if the queue is full,
+        # objects are saved synchronously (as if write_behind was disabled).
+        self.write_behind_queue_size: int = get_setting(
+            "WRITE_BEHIND_QUEUE_SIZE", 10_000
+        )
+        # max number of objects saved in a single bulk_create
+        self.write_behind_batch_size: int = get_setting("WRITE_BEHIND_BATCH_SIZE", 500)
+        # max number of seconds an object waits in the queue before it is saved
+        self.write_behind_flush_interval: float = get_setting(
+            "WRITE_BEHIND_FLUSH_INTERVAL", 5.0
+        )
+
+        # list of sinks that LeadSource objects are written to - each one is a
+        # dict with a BACKEND (dotted path to a LeadSourceSink subclass) and
+        # optional OPTIONS (kwargs passed to the sink constructor).
+        self.sinks: list[dict[str, Any]] = get_setting(
+            "SINKS", [{"BACKEND": "utm_tracker.sinks.DatabaseSink"}]
+        )
+
+        # if True, stashed params are stored in the session using a compact
+        # encoding (see encoding.py); if False the legacy format (a dict per
+        # set of params) is used. Both formats are always readable.
+        self.compact_session: bool = get_setting("COMPACT_SESSION", True)
+
+        # max number of sets of params stashed in a session (None for
+        # unlimited), and what to do when the limit is reached: "first" keeps
+        # the first N (new params are ignored), "last" keeps the last N (the
+        # oldest are evicted), and "both" keeps the first N/2 and the last N/2
+        # (evicting from the middle).
+        self.max_stashed_params: int | None = get_setting("MAX_STASHED_PARAMS", 20)
+        self.eviction_policy: str = get_setting("EVICTION_POLICY", "both")
+
+        # if True, LeadSource medium, source and campaign values are stored in
+        # the UtmDimension table, and referenced by foreign key.
+        self.normalize_dimensions: bool = get_setting("NORMALIZE_DIMENSIONS", False)
+
+        # custom tags that are copied into the (indexed) LeadSourceTag table
+        self.indexed_tags = frozenset(get_setting("INDEXED_TAGS", []))
+
+        # if True, tagged landings (including anonymous ones) are counted in
+        # memory by UtmSessionMiddleware, and added to LandingDailyStat by a
+        # background thread every landing_counts_flush_interval seconds.
+        self.landing_counts: bool = get_setting("LANDING_COUNTS", False)
+        self.landing_counts_flush_interval: float = get_setting(
+            "LANDING_COUNTS_FLUSH_INTERVAL", 60.0
+        )
+
+        # dotted path to the class that receives counters and timings
+        self.metrics_backend: str = get_setting(
+            "METRICS_BACKEND", "utm_tracker.metrics.InMemoryMetricsBackend"
+        )
+
+
+_config: TrackerConfig | None = None
+
+
+def get_config() -> TrackerConfig:
+    """Return the current config, building it on first use."""
+    global _config
+    if _config is None:
+        _config = TrackerConfig()
+    return _config
+
 
-# list of custom args to extract from the querystring
-CUSTOM_TAGS = getattr(settings, "UTM_TRACKER_CUSTOM_TAGS", [])
+@receiver(setting_changed)
+def reset_config(*, setting: str, **kwargs: Any) -> None:
+    global _config
+    if setting.startswith("UTM_TRACKER_"):
+        _config = None
@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+# sent by the SignalMetricsBackend - args: name, value
+counter_incremented = Signal()
+# sent by the SignalMetricsBackend - args: name, seconds
+timing_recorded = Signal()
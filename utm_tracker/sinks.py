@@ -0,0 +1,210 @@
+"""
+Pluggable destinations for LeadSource objects.
+
+By default LeadSource objects are saved to the database, but this can be
+changed (or added to) using the UTM_TRACKER_SINKS setting, e.g. to stream
+lead events to an append-only file that is loaded into a warehouse later:
+
+    UTM_TRACKER_SINKS = [
+        {"BACKEND": "utm_tracker.sinks.DatabaseSink"},
+        {
+            "BACKEND": "utm_tracker.sinks.JsonLinesSink",
+            "OPTIONS": {"path": "/var/log/leads.jsonl"},
+        },
+    ]
+
+Sinks always receive batches of (unsaved) LeadSource objects.
+
+"""
+
+from __future__ import annotations
+
+import functools
+import json
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Any
+
+from asgiref.sync import sync_to_async
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from . import metrics
+from .models import LeadSource
+from .settings import get_config
+
+logger = logging.getLogger(__name__)
+
+
+class LeadSourceSink(ABC):
+    """Base class for all sinks."""
+
+    @abstractmethod
+    def write(self, lead_sources: list[LeadSource]) -> None:
+        """Write a batch of LeadSource objects."""
+
+    async def awrite(self, lead_sources: list[LeadSource]) -> None:
+        await sync_to_async(self.write)(lead_sources)
+
+
+class DatabaseSink(LeadSourceSink):
+    """Save LeadSource objects to the database, ignoring duplicates."""
+
+    def __init__(self, using: str | None = None) -> None:
+        self.using = using
+
+    def write(self, lead_sources: list[LeadSource]) -> None:
+        manager = LeadSource.objects.db_manager(self.using)
+        manager.bulk_create_ignore_duplicates(lead_sources)
+
+    async def awrite(self, lead_sources: list[LeadSource]) -> None:
+        if get_config().indexed_tags:
+            # indexing the custom tags requires the primary keys
+            await super().awrite(lead_sources)
+            return
+        manager = LeadSource.objects.db_manager(self.using)
+        await manager.abulk_create(lead_sources, ignore_conflicts=True)
+
+    def save(self, lead_sources: list[LeadSource]) -> list[LeadSource]:
+        """Write the objects, and return those inserted (with their pk set)."""
+        manager = LeadSource.objects.db_manager(self.using)
+        return manager.bulk_create_ignore_duplicates(lead_sources, fetch_pks=True)
+
+    async def asave(self, lead_sources: list[LeadSource]) -> list[LeadSource]:
+        return await sync_to_async(self.save)(lead_sources)
+
+
+class JsonLinesSink(LeadSourceSink):
+    """Append LeadSource objects to a file, one JSON object per line."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+
+    def write(self, lead_sources: list[LeadSource]) -> None:
+        data = "".join(
+            json.dumps(ls.to_dict(), separators=(",", ":")) + "\n"
+            for ls in lead_sources
+        ).encode()
+        # write the batch with a single write(2) on an O_APPEND descriptor,
+        # which (on a local filesystem) appends it without interleaving it
+        # with writes from other processes - a buffered file object may
+        # split it into several writes.
+        with self.lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+            try:
+                view = memoryview(data)
+                while view:
+                    # a partial write is unlikely, but must be completed
+                    view = view[os.write(fd, view) :]
+            finally:
+                os.close(fd)
+
+
+class LoggingSink(LeadSourceSink):
+    """Log each LeadSource object as a JSON message."""
+
+    def __init__(self, logger: str = "utm_tracker.leads", level: int = logging.INFO):
+        self.logger = logging.getLogger(logger)
+        self.level = level
+
+    def write(self, lead_sources: list[LeadSource]) -> None:
+        for lead_source in lead_sources:
+            record = lead_source.to_dict()
+            self.logger.log(self.level, json.dumps(record), extra={"lead": record})
+
+    async def awrite(self, lead_sources: list[LeadSource]) -> None:
+        self.write(lead_sources)
+
+
+def load_sink(config: dict[str, Any]) -> LeadSourceSink:
+    """Return a sink instance from a {"BACKEND": ..., "OPTIONS": ...} dict."""
+    sink_class = import_string(config["BACKEND"])
+    return sink_class(**config.get("OPTIONS", {}))
+
+
+@functools.cache
+def get_sinks() -> list[LeadSourceSink]:
+    """Return the configured sinks (instantiated once per process)."""
+    return [load_sink(config) for config in get_config().sinks]
+
+
+@receiver(setting_changed)
+def reset_sinks(*, setting: str, **kwargs: Any) -> None:
+    if setting == "UTM_TRACKER_SINKS":
+        get_sinks.cache_clear()
+
+
+def count_batch(lead_sources: list[LeadSource], failed: bool) -> None:
+    """
+    Count the batch as persisted - or dropped, if any of the sinks failed.
+
+    NB objects that the database ignored as duplicates are counted as
+    persisted, as they were already stored.
+
+    """
+    metrics.incr("dropped" if failed else "persisted", len(lead_sources))
+
+
+def write_lead_sources(
+    lead_sources: list[LeadSource], fetch_pks: bool = False
+) -> list[LeadSource]:
+    """
+    Write a batch of LeadSource objects to all of the configured sinks.
+
+    An error in one sink is logged, and does not prevent the batch from
+    being written to the other sinks.
+
+    Returns the objects passed in - unless fetch_pks is True, and one of
+    the sinks is a DatabaseSink, in which case only the objects that it
+    inserted are returned, with their pk set (see DatabaseSink.save). This
+    costs an extra SELECT, so is only used when the caller needs them.
+
+    """
+    stored = lead_sources
+    failed = False
+    with metrics.timer("flush"):
+        for sink in get_sinks():
+            try:
+                if fetch_pks and isinstance(sink, DatabaseSink):
+                    # nothing is stored if the save fails
+                    stored = []
+                    stored = sink.save(lead_sources)
+                else:
+                    sink.write(lead_sources)
+            except Exception:
+                failed = True
+                metrics.incr("sink_errors")
+                logger.exception(
+                    "Error writing %i lead sources to %r", len(lead_sources), sink
+                )
+    count_batch(lead_sources, failed)
+    return stored
+
+
+async def awrite_lead_sources(
+    lead_sources: list[LeadSource], fetch_pks: bool = False
+) -> list[LeadSource]:
+    """Async version of write_lead_sources."""
+    stored = lead_sources
+    failed = False
+    with metrics.timer("flush"):
+        for sink in get_sinks():
+            try:
+                if fetch_pks and isinstance(sink, DatabaseSink):
+                    # nothing is stored if the save fails
+                    stored = []
+                    stored = await sink.asave(lead_sources)
+                else:
+                    await sink.awrite(lead_sources)
+            except Exception:
+                failed = True
+                metrics.incr("sink_errors")
+                logger.exception(
+                    "Error writing %i lead sources to %r", len(lead_sources), sink
+                )
+    count_batch(lead_sources, failed)
+    return stored
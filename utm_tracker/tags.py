@@ -0,0 +1,36 @@
+"""
+Index the custom tags of existing LeadSource objects.
+
+New objects have their UTM_TRACKER_INDEXED_TAGS custom tags copied into
+the LeadSourceTag table on creation; this module indexes the rows that
+already exist (e.g. after a tag is added to the setting), in chunks of
+primary keys, so that it can be run against a large live table.
+
+"""
+
+from __future__ import annotations
+
+from django.db import transaction
+
+from .models import LeadSource
+from .settings import get_config
+
+
+def index_custom_tags(chunk_size: int = 1000) -> int:
+    """
+    Index the custom tags of the LeadSource objects that have any.
+
+    Tags that are already indexed are ignored, so this is safe to re-run.
+
+    Returns the number of LeadSource objects processed.
+
+    """
+    if not (names := get_config().indexed_tags):
+        return 0
+    queryset = LeadSource.objects.filter(custom_tags__has_any_keys=sorted(names))
+    indexed = 0
+    for chunk in queryset.chunked(chunk_size):
+        with transaction.atomic():
+            LeadSource.objects.index_custom_tags(chunk)
+        indexed += len(chunk)
+    return indexed
@@ -0,0 +1,9 @@
+from django.urls import path
+
+from .views import export_lead_sources
+
+app_name = "utm_tracker"
+
+urlpatterns = [
+    path("export/", export_lead_sources, name="export_lead_sources"),
+]
@@ -0,0 +1,35 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.decorators import permission_required
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
+from django.http.response import HttpResponseBadRequest
+from django.views.decorators.http import require_GET
+
+from .export import FORMATS, filter_lead_sources, parse_dates
+
+
+@require_GET
+@staff_member_required
+@permission_required("utm_tracker.view_leadsource", raise_exception=True)
+def export_lead_sources(request: HttpRequest) -> HttpResponse:
+    """
+    Stream all LeadSource objects as CSV (default) or JSON Lines.
+
+    Querystring params: format (csv or jsonl), and since / until
+    (YYYY-MM-DD) to filter on the date the objects were created.
+
+    """
+    fmt = request.GET.get("format", "csv")
+    if fmt not in FORMATS:
+        return HttpResponseBadRequest(f"Invalid format: {fmt}")
+    try:
+        dates = parse_dates(
+            since=request.GET.get("since"), until=request.GET.get("until")
+        )
+    except ValueError as ex:
+        return HttpResponseBadRequest(str(ex))
+    encode, content_type = FORMATS[fmt]
+    response = StreamingHttpResponse(
+        encode(filter_lead_sources(**dates)), content_type=content_type
+    )
+    response["Content-Disposition"] = f'attachment; filename="lead_sources.{fmt}"'
+    return response